@@ -0,0 +1,110 @@
+"""
+Caches values alongside the generations of the keys they depend on, so that they can
+be dropped all at once by replacing a generation.
+
+Generations are replaced once a transaction which changes what they cover commits.
+Until then, the connection which made the change skips the cache for them, so it sees
+its own changes while other connections keep the committed ones. A generation which
+is missing, whether it was never set or has been evicted, is started anew, so values
+stored under the old one are never mistaken for current.
+
+Pending generations are kept in an asgiref Local, the same way Django keeps its
+database connections. Any left over from a transaction which was rolled back are
+cleared the next time they're checked outside of one.
+"""
+
+from functools import partial
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Set
+from uuid import uuid4
+
+from asgiref.local import Local
+from django.core.cache import cache
+from django.db import connection, transaction
+
+_state = Local()
+
+
+def pending_generations() -> Set[str]:
+    pending = getattr(_state, "pending", None)
+    if pending is None:
+        pending = set()
+        _state.pending = pending
+    return pending
+
+
+def bump_generations(generation_keys: Iterable[str]):
+    generation_keys = frozenset(generation_keys)
+    cache.set_many({key: uuid4().hex for key in generation_keys}, None)
+    pending_generations().difference_update(generation_keys)
+
+
+def invalidate_generations(generation_keys: Iterable[str]):
+    """
+    Replaces these generations once the current transaction commits, or right away
+    if there isn't one.
+    """
+    generation_keys = frozenset(generation_keys)
+    if not generation_keys:
+        return
+    if connection.in_atomic_block:
+        pending_generations().update(generation_keys)
+    transaction.on_commit(partial(bump_generations, generation_keys))
+
+
+def generations_pending(generation_keys: Iterable[str]) -> bool:
+    """
+    Whether the current transaction has invalidated any of these generations without
+    committing yet. If so, the cache can't be used for them. Its own changes wouldn't
+    be in it, and other connections mustn't see them before they commit.
+    """
+    pending = pending_generations()
+    if not connection.in_atomic_block:
+        pending.clear()
+        return False
+    return not pending.isdisjoint(generation_keys)
+
+
+def current_generations(
+    generation_keys: Sequence[str], cached: dict
+) -> Optional[List[str]]:
+    """
+    The generations of these keys, starting any which are missing. Returns None if
+    one still couldn't be read.
+    """
+    generations = []
+    for generation_key in generation_keys:
+        generation = cached.get(generation_key)
+        if generation is None:
+            # Someone else may have started it first, in which case theirs stands.
+            cache.add(generation_key, uuid4().hex, None)
+            generation = cache.get(generation_key)
+        if generation is None:
+            return None
+        generations.append(generation)
+    return generations
+
+
+def get_cached(
+    key: str,
+    generation_keys: Sequence[str],
+    load: Callable[[], Any],
+    timeout: int,
+) -> Any:
+    """
+    The value cached under a key, so long as none of its generations have been
+    replaced since it was stored. Otherwise, loads and caches it again.
+    """
+    if generations_pending(generation_keys):
+        return load()
+    cached = cache.get_many([key, *generation_keys])
+    generations = [cached.get(generation_key) for generation_key in generation_keys]
+    entry = cached.get(key)
+    if entry and None not in generations and entry.get("generations") == generations:
+        return entry["value"]
+    # The generations are read first, so a change made while the value is loaded
+    # leaves it stale on arrival rather than cached with the old contents.
+    generations = current_generations(generation_keys, cached)
+    value = load()
+    if generations is not None:
+        cache.set(key, {"generations": generations, "value": value}, timeout)
+    return value
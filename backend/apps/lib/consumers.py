@@ -1,7 +1,9 @@
 import asyncio
 from collections import defaultdict
+from functools import lru_cache
 from pprint import pprint
-from typing import Any, DefaultDict, Dict, Optional, Type
+from typing import Any, DefaultDict, Dict, List, Optional, Tuple, Type
+from uuid import uuid4
 
 from aiofile import async_open
 
@@ -11,20 +13,25 @@ from apps.lib.consumer_serializers import (
     WatchNewSpecSerializer,
     WatchSpecSerializer,
 )
+from apps.lib.outbox import batched_broadcasts, queue_broadcast
+from apps.lib.permissions import acheck_object_permission, async_capable
 from apps.lib.signals import send_update
-from apps.lib.utils import FakeRequest, post_commit_defer
+from apps.lib.utils import FakeRequest
 from apps.profiles.models import User
 from apps.profiles.utils import empty_user
-from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from channels.layers import get_channel_layer
 from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
 from django.db.models import Model
-from django.db.models.signals import post_delete, post_save
-from rest_framework.serializers import ModelSerializer, Serializer
+from django.db.models.manager import BaseManager
+from django.db.models.signals import post_delete, post_init, post_save
+from rest_framework.fields import Field, SkipField
+from rest_framework.permissions import BasePermission
+from rest_framework.serializers import ListSerializer, ModelSerializer, Serializer
 
 BROADCAST_SERIALIZERS: DefaultDict[Type[Model], Dict[str, Type[ModelSerializer]]] = (
     defaultdict(dict)
@@ -32,6 +39,28 @@ BROADCAST_SERIALIZERS: DefaultDict[Type[Model], Dict[str, Type[ModelSerializer]]
 
 SA = sync_to_async
 
+# (app_label, model_name, pk, serializer_name)
+PermissionKey = Tuple[str, str, str, Optional[str]]
+
+# Stands in for fields which were deferred when an instance was loaded.
+DEFERRED = object()
+
+
+def broadcast_roles(instance: Model, serializer_name: str) -> dict:
+    """
+    The roles which users play in an instance, for serializers whose output depends on
+    them, to be sent along with a broadcast. See viewer_class.
+    """
+    serializer_class = BROADCAST_SERIALIZERS[type(instance)].get(serializer_name)
+    get_roles = getattr(serializer_class, "viewer_roles", None)
+    if get_roles is None:
+        return {}
+    return {
+        "viewer_roles": {
+            str(user_id): role for user_id, role in get_roles(instance).items()
+        }
+    }
+
 
 def send_new(instance: Model):
     """
@@ -39,33 +68,36 @@ def send_new(instance: Model):
     lists.
     """
     model = type(instance)
-    layer = get_channel_layer()
     app_label = model._meta.app_label
     model_name = model.__name__
     if not hasattr(instance, "announce_channels"):
         return
     channels = instance.announce_channels()
-    for serializer_name in [key for key in model.watch_permissions.keys() if key]:
-        # Not great that we're in nested for loops here, but in practice we shouldn't
-        # have that many entries. Might find a way to optimize this if it ends up
-        # causing performance problems. It probably won't since most won't have
-        # listeners.
-        for channel in channels:
-            group_name = f"{channel}.{serializer_name}"
-            async_to_sync(layer.group_send)(
-                f"{channel}.{serializer_name}",
-                {
-                    "type": "new_item",
-                    "exclude": [],
-                    "contents": {
-                        "model_name": model_name,
-                        "app_label": app_label,
-                        "serializer": serializer_name,
-                        "pk": instance.pk,
-                        "list_name": group_name,
+    broadcast_id = uuid4().hex
+    with batched_broadcasts():
+        for serializer_name in [key for key in model.watch_permissions.keys() if key]:
+            roles = broadcast_roles(instance, serializer_name)
+            # Not great that we're in nested for loops here, but in practice we
+            # shouldn't have that many entries. The messages are all sent together by
+            # the outbox in any case.
+            for channel in channels:
+                group_name = f"{channel}.{serializer_name}"
+                queue_broadcast(
+                    group_name,
+                    {
+                        "type": "new_item",
+                        "exclude": [],
+                        "contents": {
+                            "model_name": model_name,
+                            "app_label": app_label,
+                            "serializer": serializer_name,
+                            "pk": instance.pk,
+                            "list_name": group_name,
+                            "broadcast_id": broadcast_id,
+                            **roles,
+                        },
                     },
-                },
-            )
+                )
 
 
 def send_updated(instance, serializers=None):
@@ -73,40 +105,39 @@ def send_updated(instance, serializers=None):
     Constructs and sends an 'updated' message to send out for an instance.
     """
     model = type(instance)
-    layer = get_channel_layer()
     app_label = model._meta.app_label
     model_name = model.__name__
     if serializers is None:
         serializers = list(model.watch_permissions.keys())
-    for serializer_name in [
-        key for key in model.watch_permissions.keys() if key and key in serializers
-    ]:
-        channel_name = (
-            f"{app_label}.{model_name}.update.{serializer_name}.{instance.pk}"
-        )
-        async_to_sync(layer.group_send)(
-            channel_name,
-            {
-                "type": "update_model",
-                "exclude": [],
-                "contents": {
-                    "model_name": model_name,
-                    "app_label": app_label,
-                    "serializer": serializer_name,
-                    "pk": instance.pk,
+    broadcast_id = uuid4().hex
+    with batched_broadcasts():
+        for serializer_name in [
+            key for key in model.watch_permissions.keys() if key and key in serializers
+        ]:
+            queue_broadcast(
+                f"{app_label}.{model_name}.update.{serializer_name}.{instance.pk}",
+                {
+                    "type": "update_model",
+                    "exclude": [],
+                    "contents": {
+                        "model_name": model_name,
+                        "app_label": app_label,
+                        "serializer": serializer_name,
+                        "pk": instance.pk,
+                        "broadcast_id": broadcast_id,
+                        **broadcast_roles(instance, serializer_name),
+                    },
                 },
-            },
-        )
+            )
 
 
 def send_deleted(model, instance, pk=None):
     """
     Constructs and sends a 'deleted' message to send out for an instance.
     """
-    layer = get_channel_layer()
     app_label = model._meta.app_label
     model_name = model.__name__
-    async_to_sync(layer.group_send)(
+    queue_broadcast(
         f"{app_label}.{model_name}.delete.{pk or instance.pk}",
         {
             "type": "delete_model",
@@ -120,23 +151,107 @@ def send_deleted(model, instance, pk=None):
     )
 
 
+def permission_key(
+    app_label: str, model_name: str, pk: Any, serializer_name: Optional[str]
+) -> PermissionKey:
+    return app_label, model_name, str(pk), serializer_name
+
+
+def invalidate_watch_permissions(instance: Model):
+    """
+    Tells the consumers watching an instance to check their permissions on it again
+    before sending anything else about it. The message goes out on the same groups as
+    updates, ahead of them, so that it arrives before the update which prompted it.
+    """
+    model = type(instance)
+    app_label = model._meta.app_label
+    model_name = model.__name__
+    watch_permissions = getattr(model, "watch_permissions", {})
+    for serializer_name in [key for key in watch_permissions.keys() if key]:
+        queue_broadcast(
+            f"{app_label}.{model_name}.update.{serializer_name}.{instance.pk}",
+            {
+                "type": "permissions_changed",
+                "exclude": [],
+                "contents": {
+                    "model_name": model_name,
+                    "app_label": app_label,
+                    "pk": instance.pk,
+                },
+            },
+            first=True,
+        )
+
+
+def invalidate_user_watch_permissions(user_id: int):
+    """
+    Throws out every permission decision made for a user's connections, for changes
+    that affect what they can see across the board, like their block lists.
+    """
+    queue_broadcast(
+        f"client.user.{user_id}",
+        {"type": "permissions_changed", "exclude": [], "contents": {}},
+    )
+
+
+def watch_permission_state(instance: Model) -> tuple:
+    """
+    Values of the fields listed in a model's watch_permission_fields. Reads them
+    without loading deferred fields.
+    """
+    return tuple(
+        instance.__dict__.get(instance._meta.get_field(name).attname, DEFERRED)
+        for name in instance.watch_permission_fields
+    )
+
+
+def track_watch_permissions(model):
+    """
+    Invalidates cached watch permissions whenever one of the fields in a model's
+    watch_permission_fields changes, such as its owner or privacy settings.
+
+    Other instances can be checked against those fields as well, like deliverables
+    against the buyer of their order. Models list them with a
+    watch_permission_dependents method, and their permissions are invalidated along
+    with the instance's own. The model doesn't need to be watchable itself.
+    """
+
+    def remember_state(instance: Model, **kwargs):
+        instance._watch_permission_state = watch_permission_state(instance)
+
+    def check_state(instance: Model, created=False, **kwargs):
+        state = watch_permission_state(instance)
+        if not created and state != getattr(instance, "_watch_permission_state", None):
+            invalidate_watch_permissions(instance)
+            if hasattr(instance, "watch_permission_dependents"):
+                for dependent in instance.watch_permission_dependents():
+                    invalidate_watch_permissions(dependent)
+        instance._watch_permission_state = state
+
+    post_init.connect(remember_state, sender=model, weak=False)
+    post_save.connect(check_state, sender=model, weak=False)
+
+
 def update_websocket(model):
     """
     Used to connect a model to broadcast out changes when updates are made. Attach a
     signal to have the instance run through the specified serializers and broadcasted
     to the listening clients.
+
+    The messages are held in the outbox until the transaction commits, which also
+    collapses repeated changes to the same instance into one message.
     """
+    if getattr(model, "watch_permission_fields", None):
+        track_watch_permissions(model)
 
-    @post_commit_defer
     def update_broadcaster(instance: Model, created=False, **kwargs):
         if created:
             send_new(instance)
         else:
             send_updated(instance)
 
-    @post_commit_defer
-    def delete_broadcaster(instance: Model, pk: int, **kwargs):
-        send_deleted(model, instance, pk=pk)
+    def delete_broadcaster(instance: Model, **kwargs):
+        send_deleted(model, instance)
 
     post_save.connect(update_broadcaster, sender=model, weak=False)
     post_delete.connect(delete_broadcaster, sender=model, weak=False)
@@ -184,6 +299,186 @@ def get_serializer_data(
     return serializer.data
 
 
+def payload_delta(previous: dict, current: dict) -> Optional[dict]:
+    """
+    The top level fields of a payload which differ from an earlier one, as a merge
+    patch. Clients apply updates by merging them into what they already have, so nested
+    values are replaced whole. Returns None if fields have gone missing, since merging
+    can't remove them.
+    """
+    if not previous.keys() <= current.keys():
+        return None
+    return {
+        key: value
+        for key, value in current.items()
+        if key not in previous or previous[key] != value
+    }
+
+
+def viewer_class(
+    serializer_class: Type[Serializer], user: User, contents: dict
+) -> Optional[str]:
+    """
+    Groups together viewers who get identical output from a serializer, apart from the
+    fields listed in its viewer_fields and those of the serializers nested in it, so
+    that they can share a broadcast payload. Returns None for viewers who are in a
+    class of their own.
+
+    Serializers which never look at the viewer outside their viewer_fields set
+    viewer_independent = True. Those which only care about the part a viewer plays in
+    the instance, such as being its buyer or seller, define viewer_roles, which maps
+    the IDs of the users involved to their roles when the broadcast is sent. Everyone
+    else gets the same output as each other. Staff may have powers which change what
+    they see, so they always get their own.
+    """
+    independent = getattr(serializer_class, "viewer_independent", False)
+    if independent and not has_viewer_fields(serializer_class):
+        return "all"
+    if not user.is_authenticated:
+        return "anonymous"
+    if independent:
+        return "all"
+    roles = contents.get("viewer_roles")
+    if roles is None or user.is_staff or user.is_superuser:
+        return None
+    return f"role.{roles.get(str(user.id), 'other')}"
+
+
+async def wait_for_payload(key: str) -> Optional[dict]:
+    """
+    Waits for another consumer to finish serializing a broadcast payload.
+    """
+    for _ in range(settings.BROADCAST_CACHE_WAIT_STEPS):
+        await asyncio.sleep(settings.BROADCAST_CACHE_WAIT_INTERVAL)
+        data = await cache.aget(key)
+        if data is not None:
+            return data
+    return None
+
+
+def nested_serializer(field: Field) -> Optional[Serializer]:
+    """
+    The serializer a field nests in its output, if any.
+    """
+    if isinstance(field, ListSerializer):
+        field = field.child
+    return field if isinstance(field, Serializer) else None
+
+
+@lru_cache(maxsize=None)
+def has_viewer_fields(serializer_class: Type[Serializer]) -> bool:
+    """
+    Whether a serializer, or any serializer nested in its output, has viewer_fields.
+    Nested serializers are always declared, so the declared fields are enough.
+    """
+    if getattr(serializer_class, "viewer_fields", ()):
+        return True
+    return any(
+        nested is not None and has_viewer_fields(type(nested))
+        for nested in (
+            nested_serializer(field)
+            for field in serializer_class._declared_fields.values()
+            if not field.write_only
+        )
+    )
+
+
+def fill_viewer_fields(serializer: Serializer, instance: Model, shared: dict) -> dict:
+    """
+    Copies a shared payload with the fields which differ between viewers serialized
+    for this one, including those of the serializers nested in it.
+    """
+    viewer_fields = getattr(type(serializer), "viewer_fields", ())
+    data = dict(shared)
+    for name, field in serializer.fields.items():
+        if field.write_only or name not in shared:
+            continue
+        nested = nested_serializer(field)
+        if name not in viewer_fields and not (
+            nested is not None and has_viewer_fields(type(nested))
+        ):
+            continue
+        try:
+            attribute = field.get_attribute(instance)
+        except SkipField:
+            continue
+        if attribute is None:
+            data[name] = None
+        elif name in viewer_fields or shared[name] is None:
+            data[name] = field.to_representation(attribute)
+        elif isinstance(field, ListSerializer):
+            items = list(
+                attribute.all() if isinstance(attribute, BaseManager) else attribute
+            )
+            if len(items) != len(shared[name]):
+                # Changed since the payload was made, so it can't be matched up.
+                data[name] = field.to_representation(items)
+                continue
+            by_id = {item.pk: item for item in items}
+            data[name] = [
+                fill_viewer_fields(nested, by_id.get(entry.get("id"), item), entry)
+                for item, entry in zip(items, shared[name])
+            ]
+        else:
+            data[name] = fill_viewer_fields(nested, attribute, shared[name])
+    return data
+
+
+@database_sync_to_async
+def get_viewer_data(
+    serializer_class: Type[Serializer], instance: Model, context: dict, shared: dict
+) -> dict:
+    return fill_viewer_fields(
+        serializer_class(instance=instance, context=context), instance, shared
+    )
+
+
+async def broadcast_data(
+    *, model: Type[Model], contents: dict, user: User, instance: Optional[Model] = None
+):
+    """
+    Serializes an instance for a broadcast. Each broadcast carries its own ID, so the
+    first consumer to handle it for a class of viewers caches the result, and the
+    other consumers in that class reuse it instead of serializing the whole instance
+    themselves. They only fill in the viewer_fields of the serializer and of those
+    nested in it, if there are any.
+
+    Raises ObjectDoesNotExist if the instance has been deleted since.
+    """
+    serializer_class = BROADCAST_SERIALIZERS[model][contents["serializer"]]
+    context = {"request": FakeRequest(user=user)}
+    broadcast_id = contents.get("broadcast_id")
+    group = viewer_class(serializer_class, user, contents)
+    if broadcast_id is None or group is None:
+        # Nobody to share with, so don't bother with the cache.
+        instance = instance or await get_instance(model, pk=contents["pk"])
+        return await get_serializer_data(serializer_class, instance, context=context)
+    key = (
+        f"broadcast.{contents['app_label']}.{contents['model_name']}.{contents['pk']}."
+        f"{contents['serializer']}.{group}.{broadcast_id}"
+    )
+    data = await cache.aget(key)
+    timeout = settings.BROADCAST_CACHE_TIMEOUT
+    if data is None and not await cache.aadd(f"{key}.lock", True, timeout):
+        data = await wait_for_payload(key)
+    if data is None:
+        try:
+            instance = instance or await get_instance(model, pk=contents["pk"])
+            data = await get_serializer_data(
+                serializer_class, instance, context=context
+            )
+        except Exception:
+            # Let anyone waiting on us try for themselves.
+            await cache.adelete(f"{key}.lock")
+            raise
+        await cache.aset(key, dict(data), timeout)
+        return data
+    if group == "anonymous" or not has_viewer_fields(serializer_class):
+        return data
+    instance = instance or await get_instance(model, pk=contents["pk"])
+    return await get_viewer_data(serializer_class, instance, context, data)
+
+
 async def git_version():
     proc = await asyncio.create_subprocess_exec(
         "git",
@@ -248,31 +543,83 @@ async def aprint(value: Any):
     await sync_to_async(pprint)(value)
 
 
-async def can_watch(
-    *, user: User, instance: Type[Model], serializer_name: Optional[str]
-):
+def watch_permission_classes(
+    model: Type[Model], serializer_name: Optional[str]
+) -> List[Type[BasePermission]]:
     """
-    Runs a permissions check on a model to see if the listening user can watch it or
-    not.
+    The permission classes a user must pass to watch a model through a serializer.
     """
     # If we don't have a registered serializer for this model with the given name, then
     # we can't listen for changes.
-    if serializer_name is not None and not BROADCAST_SERIALIZERS.get(
-        instance.__class__, {}
-    ).get(serializer_name):
+    if serializer_name is not None and not BROADCAST_SERIALIZERS.get(model, {}).get(
+        serializer_name
+    ):
         raise ValueError(
             f"Serializer '{serializer_name}' does not exist. Choices are {BROADCAST_SERIALIZERS}"
         )
-    request = FakeRequest(user=user)
-    permission_check = getattr(instance, "watch_permissions", None)
+    permission_check = getattr(model, "watch_permissions", None)
     if permission_check is None:
         raise ValueError("That model does not support watching.")
-    for perm in permission_check[serializer_name]:
-        if not await SA(perm().has_object_permission)(request, None, instance):
+    return permission_check[serializer_name]
+
+
+def watch_allowed(*, user: User, instance: Model, serializer_name: Optional[str]):
+    """
+    Runs a permissions check on a model to see if the listening user can watch it or
+    not.
+    """
+    request = FakeRequest(user=user)
+    for perm in watch_permission_classes(type(instance), serializer_name):
+        if not perm().has_object_permission(request, None, instance):
+            return False
+    return True
+
+
+def fetch_watchable_instance(
+    model: Type[Model], pk: Any, user: User, serializer_name: Optional[str]
+) -> Tuple[Model, bool]:
+    instance = model.objects.get(pk=pk)
+    return instance, watch_allowed(
+        user=user, instance=instance, serializer_name=serializer_name
+    )
+
+
+async def can_watch(*, user: User, instance: Model, serializer_name: Optional[str]):
+    """
+    Async version of watch_allowed. If every permission class has an async check, they
+    run on the event loop. Otherwise, they all run in one trip to the database thread.
+    """
+    perms = watch_permission_classes(type(instance), serializer_name)
+    if not all(async_capable(perm) for perm in perms):
+        return await database_sync_to_async(watch_allowed)(
+            user=user, instance=instance, serializer_name=serializer_name
+        )
+    request = FakeRequest(user=user)
+    for perm in perms:
+        if not await acheck_object_permission(perm(), request, None, instance):
             return False
     return True
 
 
+async def get_watchable_instance(
+    model: Type[Model], pk: Any, user: User, serializer_name: Optional[str]
+) -> Tuple[Model, bool]:
+    """
+    Fetches an instance and checks whether the user can watch it. Uses the async ORM
+    when the permission checks can run on the event loop, and otherwise does both in
+    one trip to the database thread.
+    """
+    perms = watch_permission_classes(model, serializer_name)
+    if not all(async_capable(perm) for perm in perms):
+        return await database_sync_to_async(fetch_watchable_instance)(
+            model, pk, user, serializer_name
+        )
+    instance = await get_instance(model, pk)
+    return instance, await can_watch(
+        user=user, instance=instance, serializer_name=serializer_name
+    )
+
+
 async def watch_new(consumer, payload: Dict):
     from apps.lib.consumer_serializers import WatchNewSpecSerializer
 
@@ -289,10 +636,8 @@ async def watch_new(consumer, payload: Dict):
     try:
         model = apps.get_model(app_label, model_name)
         if pk:
-            instance = await get_instance(model=model, pk=pk)
-            if not await can_watch(
-                user=consumer.scope["user"], instance=instance, serializer_name=None
-            ):
+            allowed, _instance = await consumer.check_watch(model, pk, None)
+            if not allowed:
                 raise ObjectDoesNotExist
             channel = f"{app_label}.{model_name}.pk.{pk}.{list_name}.{serializer_name}"
         else:
@@ -326,22 +671,20 @@ async def watch(consumer, payload: Dict):
     )
     try:
         model = apps.get_model(app_label, model_name)
-        instance = await get_instance(model=model, pk=pk)
-        if not await can_watch(
-            user=consumer.scope["user"],
-            instance=instance,
-            serializer_name=serializer_name,
-        ):
+        allowed, _instance = await consumer.check_watch(model, pk, serializer_name)
+        if not allowed:
             raise ObjectDoesNotExist
-        channel_name = (
-            f"{app_label}.{model_name}.update.{serializer_name}.{instance.pk}"
+        # The client has fetched the object itself, so start over with a snapshot.
+        consumer.forget_payload(
+            permission_key(app_label, model_name, pk, serializer_name)
         )
+        channel_name = f"{app_label}.{model_name}.update.{serializer_name}.{pk}"
         await consumer.channel_layer.group_add(
             channel_name,
             consumer.channel_name,
         )
         await consumer.channel_layer.group_add(
-            f"{app_label}.{model_name}.delete.{instance.pk}",
+            f"{app_label}.{model_name}.delete.{pk}",
             consumer.channel_name,
         )
     except ObjectDoesNotExist:
@@ -353,6 +696,45 @@ async def watch(consumer, payload: Dict):
         return error_command(str(err))
 
 
+async def resync(consumer, payload: Dict):
+    """
+    Sends the full current payload for a watched object, for clients which think they
+    have missed an update.
+    """
+    app_label, model_name, serializer_name, pk = (
+        payload["app_label"],
+        payload["model_name"],
+        payload["serializer"],
+        payload["pk"],
+    )
+    key = permission_key(app_label, model_name, pk, serializer_name)
+    try:
+        model = apps.get_model(app_label, model_name)
+        allowed, instance = await consumer.check_watch(model, pk, serializer_name)
+        if not allowed:
+            raise ObjectDoesNotExist
+        data = await broadcast_data(
+            model=model,
+            contents={"serializer": serializer_name, "pk": pk},
+            user=consumer.scope["user"],
+            instance=instance,
+        )
+    except ObjectDoesNotExist:
+        return error_command(
+            f"Could not find that object, or you do not have permission to watch it: "
+            f"{app_label}.{model_name} pk={pk} serializer={serializer_name}"
+        )
+    except (LookupError, ValueError) as err:
+        return error_command(str(err))
+    consumer.forget_payload(key)
+    return {
+        "command": f"{app_label}.{model_name}.update.{serializer_name}.{pk}",
+        "payload": consumer.update_payload(key, data),
+        "snapshot": True,
+        "exclude": [],
+    }
+
+
 def flatten_errors(serializer: Serializer):
     return ",".join(
         f"{key}: {','.join(value)}" for key, value in serializer.errors.items()
@@ -372,6 +754,9 @@ async def clear_watch(consumer, payload: Dict):
         payload["serializer"],
         payload["pk"],
     )
+    key = permission_key(app_label, model_name, pk, serializer)
+    consumer.permission_cache.pop(key, None)
+    consumer.forget_payload(key)
     await consumer.channel_layer.group_discard(
         f"{app_label}.{model_name}.update.{serializer}.{pk}",
         consumer.channel_name,
@@ -402,9 +787,8 @@ async def clear_watch_new(consumer, payload: Dict):
     )
 
 
-@database_sync_to_async
-def get_instance(model, pk: Any):
-    return model.objects.get(pk=pk)
+async def get_instance(model, pk: Any):
+    return await model.objects.aget(pk=pk)
 
 
 COMMANDS = {
@@ -414,12 +798,32 @@ COMMANDS = {
     "watch_new": {"func": watch_new, "serializer": WatchNewSpecSerializer},
     "clear_watch": {"func": clear_watch, "serializer": WatchSpecSerializer},
     "clear_watch_new": {"func": clear_watch_new, "serializer": WatchNewSpecSerializer},
+    "resync": {"func": resync, "serializer": WatchSpecSerializer},
 }
 
 
 class EventConsumer(AsyncJsonWebsocketConsumer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Watch permission decisions for this connection. Kept until the permissions
+        # on an object change, or the connection is told to reset.
+        self.permission_cache: Dict[PermissionKey, bool] = {}
+        # The last payload sent for each watched object, and how many updates have
+        # been sent as deltas against the last full one.
+        self.last_payloads: Dict[PermissionKey, dict] = {}
+        self.deltas_sent: Dict[PermissionKey, int] = {}
+
+    def user_group(self) -> Optional[str]:
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            return None
+        return f"client.user.{user.id}"
+
     async def connect(self):
         await self.accept()
+        group = self.user_group()
+        if group:
+            await self.channel_layer.group_add(group, self.channel_name)
 
     async def disconnect(self, code):
         key = self.scope.get("socket_key")
@@ -428,6 +832,58 @@ class EventConsumer(AsyncJsonWebsocketConsumer):
                 f"client.socket_key.{key}",
                 self.channel_name,
             )
+        group = self.user_group()
+        if group:
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    def forget_payload(self, key: PermissionKey):
+        self.last_payloads.pop(key, None)
+        self.deltas_sent.pop(key, None)
+
+    def update_payload(self, key: PermissionKey, data: dict) -> Optional[dict]:
+        """
+        Works out what to send a client for an update. This is the full payload if
+        it hasn't been sent one for the object yet or is due a snapshot, and the
+        fields which changed otherwise. Returns None if nothing changed.
+        """
+        previous = self.last_payloads.get(key)
+        self.last_payloads[key] = data
+        delta = None
+        count = self.deltas_sent.get(key, 0)
+        if previous is not None and count + 1 < settings.WEBSOCKET_SNAPSHOT_INTERVAL:
+            delta = payload_delta(previous, data)
+        if delta is None:
+            self.deltas_sent[key] = 0
+            return data
+        if not delta:
+            return None
+        self.deltas_sent[key] = count + 1
+        return delta
+
+    async def check_watch(
+        self,
+        model: Type[Model],
+        pk: Any,
+        serializer_name: Optional[str],
+        remember: bool = True,
+    ) -> Tuple[bool, Optional[Model]]:
+        """
+        Checks whether this connection's user can watch an instance, reusing earlier
+        decisions. Returns the instance as well if it had to be fetched to decide.
+        Raises ObjectDoesNotExist if it's gone.
+
+        Only decisions about watched objects should be remembered. Others, like new
+        items in a list, would pile up for as long as the connection is open.
+        """
+        key = permission_key(model._meta.app_label, model.__name__, pk, serializer_name)
+        if key in self.permission_cache:
+            return self.permission_cache[key], None
+        instance, allowed = await get_watchable_instance(
+            model, pk, self.scope["user"], serializer_name
+        )
+        if remember:
+            self.permission_cache[key] = allowed
+        return allowed, instance
 
     async def receive_json(self, content, **_kwargs):
         command_name = content.get("command")
@@ -454,8 +910,33 @@ class EventConsumer(AsyncJsonWebsocketConsumer):
         """
         Used to send a command to the client from elsewhere in the codebase.
         """
+        if event["contents"].get("command") == "reset":
+            # The client is about to reconnect, likely as someone else.
+            self.permission_cache.clear()
         await self.send_json(event["contents"])
 
+    async def permissions_changed(self, event):
+        """
+        Throws out cached permission decisions for an instance, or all of them if no
+        instance is given.
+        """
+        contents = event["contents"]
+        if "pk" not in contents:
+            self.permission_cache.clear()
+            # The user's own flags and staff powers may be what changed.
+            user = self.scope.get("user")
+            if user is not None and user.is_authenticated:
+                try:
+                    await user.arefresh_from_db()
+                except ObjectDoesNotExist:
+                    pass
+            return
+        target = permission_key(
+            contents["app_label"], contents["model_name"], contents["pk"], None
+        )[:3]
+        for key in [key for key in self.permission_cache if key[:3] == target]:
+            del self.permission_cache[key]
+
     async def new_item(self, event):
         """
         Broadcasts the existence of a new item in a list.
@@ -465,20 +946,20 @@ class EventConsumer(AsyncJsonWebsocketConsumer):
         serializer_name = contents["serializer"]
         list_name = contents["list_name"]
         try:
-            instance = await get_instance(model, pk=contents["pk"])
+            allowed, instance = await self.check_watch(
+                model, contents["pk"], serializer_name, remember=False
+            )
+            if not allowed:
+                return None
+            data = await broadcast_data(
+                model=model,
+                contents=contents,
+                user=self.scope["user"],
+                instance=instance,
+            )
         except ObjectDoesNotExist:
             # Object deleted between then and now.
             return None
-        if not await can_watch(
-            user=self.scope["user"], instance=instance, serializer_name=serializer_name
-        ):
-            return None
-        serializer_class = BROADCAST_SERIALIZERS[model][contents["serializer"]]
-        data = await get_serializer_data(
-            serializer_class,
-            instance,
-            context={"request": FakeRequest(user=self.scope["user"])},
-        )
         await self.send_json(
             {
                 "command": f"{list_name}.new",
@@ -490,26 +971,48 @@ class EventConsumer(AsyncJsonWebsocketConsumer):
     async def update_model(self, event):
         """
         Used when a model is updated and its serialized data needs to be pushed outward
-        to listening clients.
+        to listening clients. Only the fields which changed are sent, with periodic
+        full snapshots.
         """
         contents = event["contents"]
         model = apps.get_model(contents["app_label"], contents["model_name"])
+        key = permission_key(
+            contents["app_label"],
+            contents["model_name"],
+            contents["pk"],
+            contents["serializer"],
+        )
         try:
-            instance = await get_instance(model, pk=contents["pk"])
+            allowed, instance = await self.check_watch(
+                model, contents["pk"], contents["serializer"]
+            )
+            if not allowed:
+                # Permissions changed since the watch began.
+                await self.channel_layer.group_discard(
+                    f"{contents['app_label']}.{contents['model_name']}.update."
+                    f"{contents['serializer']}.{contents['pk']}",
+                    self.channel_name,
+                )
+                self.forget_payload(key)
+                return None
+            data = await broadcast_data(
+                model=model,
+                contents=contents,
+                user=self.scope["user"],
+                instance=instance,
+            )
         except ObjectDoesNotExist:
             # Object deleted between then and now.
             return None
-        serializer_class = BROADCAST_SERIALIZERS[model][contents["serializer"]]
-        data = await get_serializer_data(
-            serializer_class,
-            instance,
-            context={"request": FakeRequest(user=self.scope["user"])},
-        )
+        payload = self.update_payload(key, data)
+        if payload is None:
+            return None
         await self.send_json(
             {
                 "command": f"{contents['app_label']}.{contents['model_name']}.update."
                 f"{contents['serializer']}.{contents['pk']}",
-                "payload": data,
+                "payload": payload,
+                "snapshot": payload is data,
                 "exclude": event.get("exclude", []),
             },
         )
@@ -520,6 +1023,11 @@ class EventConsumer(AsyncJsonWebsocketConsumer):
         to listening clients.
         """
         contents = event["contents"]
+        target = permission_key(
+            contents["app_label"], contents["model_name"], contents["pk"], None
+        )[:3]
+        for key in [key for key in self.last_payloads if key[:3] == target]:
+            self.forget_payload(key)
         await self.send_json(
             {
                 "command": f"{contents['app_label']}.{contents['model_name']}.delete."
@@ -0,0 +1,268 @@
+import asyncio
+import json
+from threading import Lock
+from time import perf_counter
+from typing import List, Optional
+
+from apps.lib.consumers import send_updated
+from apps.profiles.models import ArtconomyAnonymousUser, User
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.apps import apps
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.utils import timezone
+
+MEMORY_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+class QueryCounter:
+    """
+    Counts the queries run on every database connection it's installed on, whichever
+    thread they belong to.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.lock = Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **_kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def uninstall(self, connection):
+        if self in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self)
+
+    def install_all(self):
+        """
+        Installs the counter on the current thread's connections. Django keeps
+        connections per thread, so this has to run in each thread that makes queries,
+        such as the one database_sync_to_async hands work to.
+        """
+        for connection in connections.all():
+            self.install(connection)
+
+    def uninstall_all(self):
+        for connection in connections.all():
+            self.uninstall(connection)
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Command(BaseCommand):
+    """
+    Load tests the websocket layer. Opens a number of simulated clients against the
+    ASGI application, each of which identifies itself and watches an object, along
+    with the user's notifications if there is a user. Updates to the object are then
+    broadcast at a fixed rate, and the time each takes to reach every client is
+    reported as JSON, along with message throughput and the database queries run per
+    broadcast.
+
+    Every update is sent to clients in full, since the same object is broadcast
+    without changes each time. Nothing is written to the database.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=100)
+        parser.add_argument("--updates", type=int, default=50)
+        parser.add_argument(
+            "--rate", type=float, default=10, help="Updates to send per second."
+        )
+        parser.add_argument(
+            "--user",
+            type=int,
+            help="ID of the user the clients connect as. Anonymous if not set.",
+        )
+        parser.add_argument(
+            "--model",
+            default="profiles.User",
+            help="Model of the object to watch, as app_label.ModelName.",
+        )
+        parser.add_argument(
+            "--pk", help="Primary key of the object to watch. Defaults to the user."
+        )
+        parser.add_argument("--serializer", default="UserInfoSerializer")
+        parser.add_argument(
+            "--layer",
+            choices=["memory", "configured"],
+            default="memory",
+            help="Use an in-memory channel layer, or the one in settings.",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=10,
+            help="Seconds to wait on any one message before giving up on a client.",
+        )
+        parser.add_argument("--output", help="Write the results to this file.")
+
+    def handle(self, *args, **options):
+        if options["clients"] < 1 or options["updates"] < 1 or options["rate"] <= 0:
+            raise CommandError(
+                "At least one client and one update are required, at a positive rate."
+            )
+        user = ArtconomyAnonymousUser()
+        if options["user"] is not None:
+            user = User.objects.filter(id=options["user"]).first()
+            if user is None:
+                raise CommandError(f"No user with ID {options['user']}.")
+        pk = options["pk"] or (user.id if user.is_authenticated else None)
+        if pk is None:
+            raise CommandError("Give the --pk of an object to watch.")
+        try:
+            model = apps.get_model(options["model"])
+        except (LookupError, ValueError) as err:
+            raise CommandError(str(err))
+        instance = model.objects.filter(pk=pk).first()
+        if instance is None:
+            raise CommandError(f"No {options['model']} with pk {pk}.")
+        layers = {}
+        if options["layer"] == "memory":
+            layers["CHANNEL_LAYERS"] = MEMORY_LAYERS
+        counter = QueryCounter()
+        with override_settings(WEBSOCKET_SNAPSHOT_INTERVAL=1, **layers):
+            results = async_to_sync(self.run)(
+                user=user, instance=instance, counter=counter, options=options
+            )
+        report = {
+            "suite": "websockets",
+            "created_on": timezone.now().isoformat(),
+            "unit": "seconds",
+            "layer": options["layer"],
+            **results,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
+
+    async def open_client(self, index: int, user, target: dict, timeout: float):
+        from conf.asgi import application
+
+        com = WebsocketCommunicator(application, "/ws/events/")
+        com.scope["client"] = ("127.0.0.1", str(index))
+        com.scope["user"] = user
+        connected, _subprotocol = await com.connect(timeout=timeout)
+        if not connected:
+            raise CommandError(f"Client {index} could not connect.")
+        await com.send_json_to({"command": "watch", "payload": target})
+        if user.is_authenticated:
+            await com.send_json_to(
+                {
+                    "command": "watch_new",
+                    "payload": {
+                        "app_label": "profiles",
+                        "model_name": "User",
+                        "pk": str(user.id),
+                        "list_name": "community_notifications",
+                        "serializer": "NotificationSerializer",
+                    },
+                }
+            )
+        # Commands are handled in order, so the viewer response means the watches
+        # are in place.
+        await com.send_json_to(
+            {"command": "viewer", "payload": {"socket_key": f"benchmark-{index}"}}
+        )
+        response = await com.receive_json_from(timeout=timeout)
+        if response["command"] == "error":
+            raise CommandError(
+                f"Client {index} failed to subscribe: {response['payload']['message']}"
+            )
+        return com
+
+    async def send_updates(self, instance, serializer: str, options, starts: list):
+        interval = 1 / options["rate"]
+        for _ in range(options["updates"]):
+            started = perf_counter()
+            starts.append(started)
+            await database_sync_to_async(send_updated)(
+                instance, serializers=[serializer]
+            )
+            await asyncio.sleep(max(0.0, interval - (perf_counter() - started)))
+
+    async def receive_updates(
+        self, com, label: str, options, starts: list, latencies: list
+    ) -> int:
+        received = 0
+        while received < options["updates"]:
+            try:
+                message = await com.receive_json_from(timeout=options["timeout"])
+            except asyncio.TimeoutError:
+                break
+            if message["command"] != label:
+                continue
+            latencies.append(perf_counter() - starts[received])
+            received += 1
+        return received
+
+    async def run(self, *, user, instance, counter: QueryCounter, options):
+        model = type(instance)
+        target = {
+            "app_label": model._meta.app_label,
+            "model_name": model.__name__,
+            "pk": str(instance.pk),
+            "serializer": options["serializer"],
+        }
+        label = (
+            f"{target['app_label']}.{target['model_name']}.update."
+            f"{target['serializer']}.{instance.pk}"
+        )
+        connect_start = perf_counter()
+        clients = await asyncio.gather(
+            *(
+                self.open_client(index, user, target, options["timeout"])
+                for index in range(options["clients"])
+            )
+        )
+        connect_time = perf_counter() - connect_start
+        starts = []
+        latencies = []
+        connection_created.connect(counter.install)
+        counter.install_all()
+        await database_sync_to_async(counter.install_all)()
+        try:
+            update_start = perf_counter()
+            _, *received = await asyncio.gather(
+                self.send_updates(instance, options["serializer"], options, starts),
+                *(
+                    self.receive_updates(com, label, options, starts, latencies)
+                    for com in clients
+                ),
+            )
+            elapsed = perf_counter() - update_start
+        finally:
+            connection_created.disconnect(counter.install)
+            counter.uninstall_all()
+            await database_sync_to_async(counter.uninstall_all)()
+        await asyncio.gather(*(com.disconnect() for com in clients))
+        delivered = sum(received)
+        return {
+            "clients": options["clients"],
+            "updates": options["updates"],
+            "rate": options["rate"],
+            "connect_time": connect_time,
+            "delivered": delivered,
+            "missed": options["clients"] * options["updates"] - delivered,
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p99": percentile(latencies, 0.99),
+            "latency_max": max(latencies, default=None),
+            "messages_per_second": delivered / elapsed,
+            "queries_per_broadcast": counter.count / options["updates"],
+        }
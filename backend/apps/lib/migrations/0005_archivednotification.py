@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lib", "0004_asset_redacted_by_asset_redacted_on_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedNotification",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                (
+                    "archived_on",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                (
+                    "event",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_notifications",
+                        to="lib.event",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_notifications",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        # Rows are deleted from the notification table in bulk as they're archived,
+        # so have it vacuumed and analyzed well before the default thresholds.
+        migrations.RunSQL(
+            "ALTER TABLE lib_notification SET ("
+            "autovacuum_vacuum_scale_factor = 0.02, "
+            "autovacuum_analyze_scale_factor = 0.01)",
+            reverse_sql="ALTER TABLE lib_notification RESET ("
+            "autovacuum_vacuum_scale_factor, autovacuum_analyze_scale_factor)",
+        ),
+    ]
@@ -128,6 +128,29 @@ class Event(models.Model):
     recalled = models.BooleanField(default=False, db_index=True)
 
 
+class SubscriptionQuerySet(models.QuerySet):
+    """
+    Bulk creation and updates skip the save signals, so they drop the cached
+    subscriber lists they affect here instead.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from apps.lib.utils import subscriptions_changed
+
+        objs = list(objs)
+        created = super().bulk_create(objs, *args, **kwargs)
+        subscriptions_changed(objs)
+        return created
+
+    def update(self, **kwargs):
+        from apps.lib.utils import invalidate_subscribers
+
+        invalidate_subscribers(
+            self.values_list("type", "content_type_id", "object_id").distinct()
+        )
+        return super().update(**kwargs)
+
+
 class Subscription(models.Model):
     type = models.IntegerField(db_index=True, choices=EVENT_TYPES)
     subscriber = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=CASCADE)
@@ -143,10 +166,26 @@ class Subscription(models.Model):
     removed = models.BooleanField(default=False, db_index=True)
     until = models.DateField(null=True, db_index=True)
 
+    objects = SubscriptionQuerySet.as_manager()
+
     class Meta:
         unique_together = ("type", "subscriber", "object_id", "content_type")
 
 
+@receiver(post_save, sender=Subscription)
+def subscription_saved(sender, instance, **kwargs):
+    from apps.lib.utils import subscriptions_changed
+
+    subscriptions_changed([instance])
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(sender, instance, **kwargs):
+    from apps.lib.utils import subscriptions_changed
+
+    subscriptions_changed([instance])
+
+
 class Notification(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=CASCADE)
     event = models.ForeignKey(Event, on_delete=CASCADE, related_name="notifications")
@@ -157,17 +196,45 @@ class Notification(models.Model):
 
     def announce_channels(self):
         if self.event.type in ORDER_NOTIFICATION_TYPES:
-            return [f"profiles.User.pk.{self.user.id}.sales_notifications"]
+            return [f"profiles.User.pk.{self.user_id}.sales_notifications"]
         else:
-            return [f"profiles.User.pk.{self.user.id}.community_notifications"]
+            return [f"profiles.User.pk.{self.user_id}.community_notifications"]
 
 
 @receiver(post_delete, sender=Notification)
-def recalc_totals(sender, instance, **kwargs):
-    if not instance.read:
-        from apps.lib.consumers import send_updated
+def recalc_totals(sender, instance, origin=None, **kwargs):
+    # Sets of notifications, and those deleted along with their events, are taken out
+    # of the counters all at once by delete_notifications. Those deleted along with
+    # their user don't need counting.
+    if instance.read or origin is not instance:
+        return
+    from apps.lib.consumers import send_updated
+    from apps.lib.utils import shift_unread_counts, unread_counter_field
+
+    event = Event.objects.filter(id=instance.event_id, recalled=False).first()
+    if event:
+        sales = unread_counter_field(event) == "unread_sales_count"
+        shift_unread_counts({instance.user_id: (0, -1) if sales else (-1, 0)})
+    send_updated(instance.user, serializers=["UnreadNotificationsSerializer"])
+
+
+class ArchivedNotification(models.Model):
+    """
+    Read notifications which have been moved out of the Notification table by the
+    archive_notifications task once their events were old enough, so that the table
+    the notification lists page over stays small. They keep their original IDs.
+    """
 
-        send_updated(instance.user, serializers=["UnreadNotificationsSerializer"])
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=CASCADE,
+        related_name="archived_notifications",
+    )
+    event = models.ForeignKey(
+        Event, on_delete=CASCADE, related_name="archived_notifications"
+    )
+    archived_on = models.DateTimeField(default=timezone.now, db_index=True)
 
 
 class EmailPreference(models.Model):
@@ -184,6 +251,20 @@ class EmailPreference(models.Model):
         unique_together = ("user", "type", "content_type")
 
 
+@receiver(post_save, sender=EmailPreference)
+def email_preference_saved(sender, instance, **kwargs):
+    from apps.lib.utils import email_preferences_changed
+
+    email_preferences_changed(instance.user_id, [instance.type])
+
+
+@receiver(post_delete, sender=EmailPreference)
+def email_preference_deleted(sender, instance, **kwargs):
+    from apps.lib.utils import email_preferences_changed
+
+    email_preferences_changed(instance.user_id, [instance.type])
+
+
 class Tag(Model):
     name = SlugField(db_index=True, unique=True, primary_key=True)
 
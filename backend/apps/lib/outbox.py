@@ -0,0 +1,178 @@
+"""
+Collects the websocket broadcasts made during a transaction, and sends them together
+once it commits.
+
+Each broadcast is held back with its own on_commit hook, so broadcasts made inside a
+savepoint which is rolled back are dropped along with it, and nothing is sent if the
+transaction itself is rolled back. The hooks only move their messages into the outbox.
+A flush hook follows each of them, but only sends once no later flush is certain to
+run, so the whole transaction usually goes out in one pass of an event loop.
+Duplicate messages for the same group and object are collapsed first, keeping the
+latest of them in the place of the first.
+
+Outboxes are kept in an asgiref Local, the same way Django keeps its database
+connections, so each thread or async context only ever sees its own.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial
+from threading import Lock
+from typing import Dict, FrozenSet, Hashable, List, Tuple
+
+from asgiref.local import Local
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_state = Local()
+_stats_lock = Lock()
+_stats = {"sent": 0, "dropped": 0}
+
+OutboxKey = Tuple[str, str, Hashable]
+
+
+def message_key(group: str, message: dict) -> OutboxKey:
+    """
+    Messages of the same type, for the same object, sent to the same group, are
+    duplicates of each other.
+    """
+    return group, message["type"], message.get("contents", {}).get("pk")
+
+
+class Outbox:
+    def __init__(self):
+        self.messages: Dict[OutboxKey, Tuple[str, dict]] = {}
+        self.dropped = 0
+
+    def add(self, group: str, message: dict, first: bool = False):
+        key = message_key(group, message)
+        if key in self.messages:
+            # The later message was built from the object's latest save, so it
+            # replaces the earlier one. It keeps the earlier one's place in the queue.
+            self.dropped += 1
+        if first:
+            self.messages.pop(key, None)
+            self.messages = {key: (group, message), **self.messages}
+            return
+        self.messages[key] = (group, message)
+
+    def flush(self):
+        messages = list(self.messages.values())
+        dropped = self.dropped
+        self.messages = {}
+        self.dropped = 0
+        with _stats_lock:
+            _stats["sent"] += len(messages)
+            _stats["dropped"] += dropped
+        if not messages:
+            return
+        logger.debug(
+            "Sending %s websocket message(s), %s duplicate(s) dropped.",
+            len(messages),
+            dropped,
+        )
+        async_to_sync(send_messages)(messages)
+
+
+async def send_messages(messages: List[Tuple[str, dict]]):
+    """
+    Sends a set of messages to their groups concurrently. Messages for the same group
+    are still sent in the order they were made.
+    """
+    layer = get_channel_layer()
+    by_group = defaultdict(list)
+    for group, message in messages:
+        by_group[group].append(message)
+
+    async def send_group(group: str, group_messages: List[dict]):
+        for message in group_messages:
+            await layer.group_send(group, message)
+
+    await asyncio.gather(*(send_group(*item) for item in by_group.items()))
+
+
+def current_outbox() -> Outbox:
+    outbox = getattr(_state, "outbox", None)
+    if outbox is None:
+        outbox = Outbox()
+        _state.outbox = outbox
+    return outbox
+
+
+def pending_flushes() -> List[Tuple[int, FrozenSet[str]]]:
+    pending = getattr(_state, "pending_flushes", None)
+    if pending is None:
+        pending = []
+        _state.pending_flushes = pending
+    return pending
+
+
+def schedule_flush(outbox: Outbox):
+    """
+    Makes sure the outbox is flushed after the commit hooks registered so far have run,
+    and so after every message has been moved into it.
+
+    Every broadcast registers a flush behind its own hook. A flush holds off only if a
+    later one was registered inside no savepoints but its own, since that one can't
+    have been rolled back if this one wasn't. Otherwise every later flush might have
+    been dropped with a savepoint, so it sends what it has rather than leave it behind.
+    """
+    _state.flush_sequence = sequence = getattr(_state, "flush_sequence", 0) + 1
+    savepoints = frozenset(connection.savepoint_ids)
+    pending = pending_flushes()
+    pending.append((sequence, savepoints))
+
+    def flush():
+        # Hooks run in the order they were registered, so any earlier flush which is
+        # still pending was dropped along with its savepoint or transaction.
+        pending[:] = [item for item in pending if item[0] > sequence]
+        if any(later <= savepoints for _, later in pending):
+            return
+        outbox.flush()
+
+    transaction.on_commit(flush)
+
+
+def queue_broadcast(group: str, message: dict, first: bool = False):
+    """
+    Sends a message to a channel layer group once the current transaction commits, or
+    right away if there isn't one. Messages marked first are sent ahead of everything
+    else in the outbox.
+    """
+    outbox = current_outbox()
+    if connection.in_atomic_block:
+        transaction.on_commit(partial(outbox.add, group, message, first))
+        schedule_flush(outbox)
+        return
+    outbox.add(group, message, first)
+    if not getattr(_state, "depth", 0):
+        outbox.flush()
+
+
+@contextmanager
+def batched_broadcasts():
+    """
+    Holds back broadcasts made outside of a transaction until the end of the block, so
+    that they're sent together.
+    """
+    _state.depth = getattr(_state, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+    if not _state.depth:
+        current_outbox().flush()
+
+
+def outbox_stats() -> Dict[str, int]:
+    """
+    Counts of the messages sent, and of those dropped as duplicates, by all outboxes
+    in this process.
+    """
+    with _stats_lock:
+        return dict(_stats)
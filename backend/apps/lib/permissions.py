@@ -1,16 +1,42 @@
 from logging import getLogger
 from typing import Type
 
+from asgiref.sync import sync_to_async
 from django.views import View
 from rest_framework.permissions import SAFE_METHODS, BasePermission, IsAuthenticated
 from rest_framework.request import Request
 
 from apps.profiles.constants import POWER, POWER_LIST
-from apps.profiles.permissions import staff_power
+from apps.profiles.permissions import astaff_power, staff_power
 
 logger = getLogger(__name__)
 
 
+async def acheck_object_permission(perm: BasePermission, request, view, obj) -> bool:
+    """
+    Runs an object permission check from async code.
+
+    Permissions may define an async ahas_object_permission alongside
+    has_object_permission, giving the same answer without blocking, usually by
+    comparing IDs or by using the async ORM. These are awaited directly. Anything
+    else is run in a thread.
+    """
+    check = getattr(perm, "ahas_object_permission", None)
+    if check is not None:
+        return bool(await check(request, view, obj))
+    return bool(await sync_to_async(perm.has_object_permission)(request, view, obj))
+
+
+def async_capable(perm: Type[BasePermission]) -> bool:
+    """
+    Whether a permission's object check can run without a thread. Combined
+    permissions only can if all of their parts can.
+    """
+    if not hasattr(perm, "ahas_object_permission"):
+        return False
+    return all(async_capable(type(part)) for part in getattr(perm, "parts", []))
+
+
 class CommentEditPermission(BasePermission):
     def has_object_permission(self, request, view, obj):
         if obj.deleted:
@@ -108,6 +134,11 @@ def StaffPower(power: POWER):
                 return False
             return getattr(request.user.staff_powers, power)
 
+        async def ahas_object_permission(
+            self, request: Request, view: View, obj: Or
+        ) -> bool:
+            return await astaff_power(request.user, power)
+
     return WrappedPermission
 
 
@@ -155,6 +186,12 @@ class ComboPermission(BasePermission):
             self.message = getattr(perm, "message", self.message)
         return result
 
+    async def arun_object_check(self, perm, request, view, obj):
+        result = await acheck_object_permission(perm, request, view, obj)
+        if not result and not self.message:
+            self.message = getattr(perm, "message", self.message)
+        return result
+
 
 def Or(*perms: Type[BasePermission]) -> Type[ComboPermission]:
     perms = [perm() for perm in perms]
@@ -172,6 +209,14 @@ def Or(*perms: Type[BasePermission]) -> Type[ComboPermission]:
             )
             return result
 
+        async def ahas_object_permission(self, request, view, obj):
+            for perm in perms:
+                if await self.arun_object_check(perm, request, view, obj):
+                    return True
+            return False
+
+    AnyPerm.parts = perms
+
     return AnyPerm
 
 
@@ -191,6 +236,14 @@ def And(*perms: Type[BasePermission]) -> Type[ComboPermission]:
             )
             return result
 
+        async def ahas_object_permission(self, request, view, obj):
+            for perm in perms:
+                if not await self.arun_object_check(perm, request, view, obj):
+                    return False
+            return True
+
+    AllPerms.parts = perms
+
     return AllPerms
 
 
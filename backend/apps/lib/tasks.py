@@ -1,5 +1,7 @@
 import random
 import socket
+from datetime import timedelta
+from typing import List
 
 from celery.signals import task_failure
 
@@ -67,6 +69,72 @@ def check_asset_associations(self, asset_id: str, force: bool = False):
             )
 
 
+@celery_app.task()
+def send_notification_emails(event_id: int, user_ids: List[int]):
+    from apps.lib.models import Event
+    from apps.lib.utils import deliver_notification_emails
+    from apps.profiles.models import User
+
+    event = Event.objects.filter(id=event_id).first()
+    if event is None:
+        return
+    deliver_notification_emails(
+        event, list(User.objects.filter(id__in=user_ids).exclude(email_nulled=True))
+    )
+
+
+@celery_app.task()
+def send_notification_telegrams(event_id: int, user_ids: List[int]):
+    from apps.lib.models import Event
+    from apps.lib.utils import deliver_notification_telegrams
+    from apps.profiles.models import User
+
+    event = Event.objects.filter(id=event_id).first()
+    if event is None:
+        return
+    deliver_notification_telegrams(event, list(User.objects.filter(id__in=user_ids)))
+
+
+@celery_app.task()
+def archive_notifications():
+    """
+    Moves read notifications for events older than NOTIFICATION_ARCHIVE_DAYS into the
+    archive, a batch at a time. Each batch is moved in a single statement and
+    committed separately, so that rows are only locked briefly.
+    """
+    from apps.lib.models import ArchivedNotification, Event, Notification
+    from django.db import connection
+    from django.utils import timezone
+
+    now = timezone.now()
+    cutoff = now - timedelta(days=settings.NOTIFICATION_ARCHIVE_DAYS)
+    batch_size = settings.NOTIFICATION_ARCHIVE_BATCH_SIZE
+    notification_table = Notification._meta.db_table
+    query = f"""
+        WITH moved AS (
+            DELETE FROM {notification_table}
+            WHERE id IN (
+                SELECT notification.id
+                FROM {notification_table} notification
+                JOIN {Event._meta.db_table} event ON event.id = notification.event_id
+                WHERE notification.read AND event.date < %s
+                ORDER BY notification.id
+                LIMIT %s
+                FOR UPDATE OF notification SKIP LOCKED
+            )
+            RETURNING id, user_id, event_id
+        )
+        INSERT INTO {ArchivedNotification._meta.db_table}
+            (id, user_id, event_id, archived_on)
+        SELECT id, user_id, event_id, %s FROM moved
+    """
+    moved = batch_size
+    while moved == batch_size:
+        with connection.cursor() as cursor:
+            cursor.execute(query, [cutoff, batch_size, now])
+            moved = cursor.rowcount
+
+
 @task_failure.connect()
 def celery_task_failure_email(**kwargs):
     """celery 4.0 onward has no method to send emails on failed tasks
@@ -16,10 +16,10 @@ from django.core.cache.backends.locmem import LocMemCache
 
 from apps.profiles.constants import POWER, POWER_LIST
 from apps.sales.constants import CARD, CASH_DEPOSIT
+from apps.sales.line_item_funcs import clear_pricing_data
 from apps.sales.models import ServicePlan, Deliverable
 from ddt import data, ddt
 from django.conf import settings
-from django.core.cache import cache
 from django.db import connections
 from django.test.runner import DiscoverRunner, ParallelTestSuite
 from django.test.utils import setup_test_environment
@@ -63,7 +63,7 @@ class EnsurePlansMixin:
                 "max_simultaneous_orders": 1,
             },
         )[0]
-        cache.delete("price_data")
+        clear_pricing_data()
 
 
 class APITestCase(EnsurePlansMixin, BaseAPITestCase):
@@ -0,0 +1,73 @@
+import json
+from io import StringIO
+
+from apps.lib.test_resources import EnsurePlansMixin
+from apps.profiles.tests.factories import UserFactory
+from apps.sales.tests.factories import DeliverableFactory
+from django.core.management import CommandError, call_command
+from django.test import TransactionTestCase
+
+
+# The clients run through the ASGI application, which uses its own database
+# connections, so these tests need committed data.
+class TestBenchmarkWebsockets(EnsurePlansMixin, TransactionTestCase):
+    def run_benchmark(self, *args):
+        out = StringIO()
+        call_command(
+            "benchmark_websockets",
+            "--clients",
+            "3",
+            "--updates",
+            "2",
+            "--rate",
+            "50",
+            "--timeout",
+            "2",
+            *args,
+            stdout=out,
+        )
+        return json.loads(out.getvalue())
+
+    def test_results(self):
+        user = UserFactory.create()
+        report = self.run_benchmark("--user", str(user.id))
+        self.assertEqual(report["clients"], 3)
+        self.assertEqual(report["delivered"], 6)
+        self.assertEqual(report["missed"], 0)
+        self.assertGreater(report["latency_p50"], 0)
+        self.assertGreaterEqual(report["latency_p99"], report["latency_p50"])
+        self.assertGreater(report["messages_per_second"], 0)
+        self.assertGreaterEqual(report["queries_per_broadcast"], 0)
+
+    def test_watched_object(self):
+        deliverable = DeliverableFactory.create()
+        report = self.run_benchmark(
+            "--user",
+            str(deliverable.order.buyer.id),
+            "--model",
+            "sales.Deliverable",
+            "--pk",
+            str(deliverable.id),
+            "--serializer",
+            "DeliverableSerializer",
+        )
+        self.assertEqual(report["delivered"], 6)
+
+    def test_no_permission(self):
+        deliverable = DeliverableFactory.create()
+        user = UserFactory.create()
+        with self.assertRaises(CommandError):
+            self.run_benchmark(
+                "--user",
+                str(user.id),
+                "--model",
+                "sales.Deliverable",
+                "--pk",
+                str(deliverable.id),
+                "--serializer",
+                "DeliverableSerializer",
+            )
+
+    def test_anonymous_needs_target(self):
+        with self.assertRaises(CommandError):
+            self.run_benchmark()
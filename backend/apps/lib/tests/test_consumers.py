@@ -2,14 +2,48 @@ from pathlib import Path
 from typing import List, Optional, Tuple
 from unittest.mock import patch
 
-from apps.lib.consumers import aprint, git_version
+from apps.lib.consumers import (
+    aprint,
+    broadcast_data,
+    broadcast_roles,
+    can_watch,
+    get_serializer_data,
+    get_watchable_instance,
+    git_version,
+    viewer_class,
+)
+from apps.lib.constants import COMMENT
+from apps.lib.models import Subscription
 from apps.lib.test_resources import EnsurePlansMixin
-from apps.profiles.models import ArtconomyAnonymousUser
-from apps.profiles.serializers import UserSerializer
-from apps.profiles.tests.factories import UserFactory
+from apps.lib.tests.test_utils import create_staffer
+from apps.profiles.models import (
+    ArtconomyAnonymousUser,
+    StaffPowers,
+    Submission,
+    User,
+)
+from apps.profiles.serializers import (
+    ArtistProfileSerializer,
+    SubmissionSerializer,
+    UserSerializer,
+)
+from apps.profiles.tests.factories import (
+    SocialLinkFactory,
+    SocialSettingsFactory,
+    SubmissionFactory,
+    UserFactory,
+)
 from apps.profiles.utils import empty_user
-from apps.sales.tests.factories import DeliverableFactory, LineItemFactory
+from apps.sales.constants import LIMBO, VOID
+from apps.sales.models import Deliverable
+from apps.sales.serializers import DeliverableSerializer
+from apps.sales.tests.factories import (
+    DeliverableFactory,
+    InvoiceFactory,
+    LineItemFactory,
+)
 from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
 from channels.testing import WebsocketCommunicator
 from conf.asgi import application
 from django.test import TransactionTestCase, override_settings
@@ -91,6 +125,354 @@ class TestConsumer(EnsurePlansMixin, TransactionTestCase):
         )
         self.assertEqual(updated["payload"]["details"], "boop")
 
+    async def watch_deliverable(self, user, deliverable):
+        com = self.get_communicator()
+        com.scope["user"] = user
+        await com.send_json_to(
+            {
+                "command": "watch",
+                "payload": {
+                    "app_label": "sales",
+                    "model_name": "Deliverable",
+                    "pk": deliverable.pk,
+                    "serializer": "DeliverableSerializer",
+                },
+            },
+        )
+        await com.receive_nothing(timeout=1)
+        return com
+
+    @patch("apps.lib.consumers.get_serializer_data", wraps=get_serializer_data)
+    async def test_updated_model_shared_payload(self, mock_serializer_data):
+        user = await SA(UserFactory.create)()
+        deliverable = await SA(DeliverableFactory.create)(order__buyer=user)
+        first = await self.watch_deliverable(user, deliverable)
+        second = await self.watch_deliverable(user, deliverable)
+        deliverable.details = "boop"
+        await SA(deliverable.save)()
+        for com in [first, second]:
+            updated = await com.receive_json_from(timeout=1)
+            self.assertEqual(updated["payload"]["details"], "boop")
+        self.assertEqual(mock_serializer_data.call_count, 1)
+
+    @patch("apps.lib.consumers.get_serializer_data", wraps=get_serializer_data)
+    async def test_updated_model_separate_viewers(self, mock_serializer_data):
+        buyer = await SA(UserFactory.create)()
+        deliverable = await SA(DeliverableFactory.create)(order__buyer=buyer)
+        seller = await SA(lambda: deliverable.order.seller)()
+        first = await self.watch_deliverable(buyer, deliverable)
+        second = await self.watch_deliverable(seller, deliverable)
+        deliverable.details = "boop"
+        await SA(deliverable.save)()
+        for com in [first, second]:
+            updated = await com.receive_json_from(timeout=1)
+            self.assertEqual(updated["payload"]["details"], "boop")
+        self.assertEqual(mock_serializer_data.call_count, 2)
+
+    @patch("apps.lib.consumers.get_watchable_instance", wraps=get_watchable_instance)
+    async def test_updated_model_permissions_cached(self, mock_watchable):
+        user = await SA(UserFactory.create)()
+        deliverable = await SA(DeliverableFactory.create)(order__buyer=user)
+        com = await self.watch_deliverable(user, deliverable)
+        for details in ["boop", "beep"]:
+            deliverable.details = details
+            await SA(deliverable.save)()
+            updated = await com.receive_json_from(timeout=1)
+            self.assertEqual(updated["payload"]["details"], details)
+        self.assertEqual(mock_watchable.call_count, 1)
+
+    async def test_updated_model_permissions_revoked(self):
+        buyer = await SA(UserFactory.create)()
+        deliverable = await SA(DeliverableFactory.create)(order__buyer=buyer)
+        seller = await SA(lambda: deliverable.order.seller)()
+        buyer_com = await self.watch_deliverable(buyer, deliverable)
+        seller_com = await self.watch_deliverable(seller, deliverable)
+        deliverable.status = LIMBO
+        await SA(deliverable.save)()
+        updated = await buyer_com.receive_json_from(timeout=1)
+        self.assertEqual(updated["payload"]["status"], LIMBO)
+        self.assertTrue(await seller_com.receive_nothing(timeout=1))
+
+    async def test_order_buyer_changed(self):
+        buyer = await SA(UserFactory.create)()
+        deliverable = await SA(DeliverableFactory.create)(order__buyer=buyer)
+        com = await self.watch_deliverable(buyer, deliverable)
+        order = await SA(lambda: deliverable.order)()
+        order.buyer = await SA(UserFactory.create)()
+        await SA(order.save)()
+        deliverable.details = "boop"
+        await SA(deliverable.save)()
+        self.assertTrue(await com.receive_nothing(timeout=1))
+
+    async def test_social_links_hidden(self):
+        settings = await SA(SocialSettingsFactory.create)()
+        link = await SA(SocialLinkFactory.create)(user_id=settings.user_id)
+        com = self.get_communicator()
+        com.scope["user"] = await SA(UserFactory.create)()
+        await com.send_json_to(
+            {
+                "command": "watch",
+                "payload": {
+                    "app_label": "profiles",
+                    "model_name": "SocialLink",
+                    "pk": link.pk,
+                    "serializer": "SocialLinkSerializer",
+                },
+            },
+        )
+        await com.receive_nothing(timeout=1)
+        link.comment = "beep"
+        await SA(link.save)()
+        updated = await com.receive_json_from(timeout=1)
+        self.assertEqual(updated["payload"]["comment"], "beep")
+        settings.display_socials = False
+        await SA(settings.save)()
+        link.comment = "boop"
+        await SA(link.save)()
+        self.assertTrue(await com.receive_nothing(timeout=1))
+
+    @patch("apps.lib.consumers.get_watchable_instance", wraps=get_watchable_instance)
+    async def test_user_permissions_changed(self, mock_watchable):
+        user = await SA(UserFactory.create)()
+        deliverable = await SA(DeliverableFactory.create)(order__buyer=user)
+        com = self.get_communicator()
+        com.scope["user"] = user
+        connected, _subprotocol = await com.connect()
+        assert connected
+        await com.send_json_to(
+            {
+                "command": "watch",
+                "payload": {
+                    "app_label": "sales",
+                    "model_name": "Deliverable",
+                    "pk": deliverable.pk,
+                    "serializer": "DeliverableSerializer",
+                },
+            },
+        )
+        await com.receive_nothing(timeout=1)
+        await get_channel_layer().group_send(
+            f"client.user.{user.id}",
+            {"type": "permissions_changed", "exclude": [], "contents": {}},
+        )
+        deliverable.details = "boop"
+        await SA(deliverable.save)()
+        updated = await com.receive_json_from(timeout=1)
+        self.assertEqual(updated["payload"]["details"], "boop")
+        self.assertEqual(mock_watchable.call_count, 2)
+        await com.disconnect()
+
+    async def test_staff_power_revoked(self):
+        staffer = await SA(create_staffer)("view_financials")
+        invoice = await SA(InvoiceFactory.create)()
+        com = self.get_communicator()
+        com.scope["user"] = staffer
+        connected, _subprotocol = await com.connect()
+        assert connected
+        await com.send_json_to(
+            {
+                "command": "watch",
+                "payload": {
+                    "app_label": "sales",
+                    "model_name": "Invoice",
+                    "pk": invoice.pk,
+                    "serializer": "InvoiceSerializer",
+                },
+            },
+        )
+        await com.receive_nothing(timeout=1)
+        await SA(invoice.save)()
+        updated = await com.receive_json_from(timeout=1)
+        self.assertEqual(
+            updated["command"], f"sales.Invoice.update.InvoiceSerializer.{invoice.pk}"
+        )
+        # A separate copy, so the connection's user only sees it by reloading.
+        powers = await StaffPowers.objects.aget(user=staffer)
+        powers.view_financials = False
+        await SA(powers.save)()
+        invoice.status = VOID
+        await SA(invoice.save)()
+        self.assertTrue(await com.receive_nothing(timeout=1))
+        await com.disconnect()
+
+    async def test_updated_model_delta(self):
+        user = await SA(UserFactory.create)()
+        deliverable = await SA(DeliverableFactory.create)(order__buyer=user)
+        com = await self.watch_deliverable(user, deliverable)
+        deliverable.details = "boop"
+        await SA(deliverable.save)()
+        updated = await com.receive_json_from(timeout=1)
+        self.assertTrue(updated["snapshot"])
+        self.assertEqual(updated["payload"]["id"], deliverable.id)
+        deliverable.details = "beep"
+        await SA(deliverable.save)()
+        updated = await com.receive_json_from(timeout=1)
+        self.assertFalse(updated["snapshot"])
+        self.assertEqual(updated["payload"]["details"], "beep")
+        self.assertNotIn("id", updated["payload"])
+        # Nothing to send when nothing changed.
+        await SA(deliverable.save)()
+        self.assertTrue(await com.receive_nothing(timeout=1))
+
+    @override_settings(WEBSOCKET_SNAPSHOT_INTERVAL=2)
+    async def test_updated_model_snapshot_interval(self):
+        user = await SA(UserFactory.create)()
+        deliverable = await SA(DeliverableFactory.create)(order__buyer=user)
+        com = await self.watch_deliverable(user, deliverable)
+        snapshots = []
+        for details in ["boop", "beep", "bap"]:
+            deliverable.details = details
+            await SA(deliverable.save)()
+            updated = await com.receive_json_from(timeout=1)
+            self.assertEqual(updated["payload"]["details"], details)
+            snapshots.append(updated["snapshot"])
+        self.assertEqual(snapshots, [True, False, True])
+
+    async def test_resync(self):
+        user = await SA(UserFactory.create)()
+        deliverable = await SA(DeliverableFactory.create)(order__buyer=user)
+        com = await self.watch_deliverable(user, deliverable)
+        payload = {
+            "app_label": "sales",
+            "model_name": "Deliverable",
+            "pk": deliverable.pk,
+            "serializer": "DeliverableSerializer",
+        }
+        await com.send_json_to({"command": "resync", "payload": payload})
+        response = await com.receive_json_from(timeout=1)
+        self.assertEqual(
+            response["command"],
+            f"sales.Deliverable.update.DeliverableSerializer.{deliverable.id}",
+        )
+        self.assertTrue(response["snapshot"])
+        self.assertEqual(response["payload"]["id"], deliverable.id)
+        # Updates after a resync are sent as deltas against it.
+        deliverable.details = "boop"
+        await SA(deliverable.save)()
+        updated = await com.receive_json_from(timeout=1)
+        self.assertFalse(updated["snapshot"])
+        self.assertEqual(updated["payload"]["details"], "boop")
+
+    async def test_resync_no_permissions(self):
+        user = await SA(UserFactory.create)()
+        deliverable = await SA(DeliverableFactory.create)()
+        com = self.get_communicator()
+        com.scope["user"] = user
+        await com.send_json_to(
+            {
+                "command": "resync",
+                "payload": {
+                    "app_label": "sales",
+                    "model_name": "Deliverable",
+                    "pk": deliverable.pk,
+                    "serializer": "DeliverableSerializer",
+                },
+            },
+        )
+        response = await com.receive_json_from()
+        self.assertEqual(response["command"], "error")
+
+    @patch("apps.lib.permissions.sync_to_async")
+    @patch("apps.lib.consumers.database_sync_to_async")
+    async def test_can_watch_on_event_loop(self, mock_db_thread, mock_thread):
+        user = await SA(UserFactory.create)()
+        other = await SA(UserFactory.create)()
+        staff = await SA(UserFactory.create)(is_staff=True)
+        await SA(StaffPowers.objects.update_or_create)(
+            user=staff, defaults={"view_as": True}
+        )
+        # Start without staff powers loaded.
+        staff = await User.objects.aget(id=staff.id)
+        for viewer, expected in [(user, True), (other, False), (staff, True)]:
+            self.assertEqual(
+                await can_watch(
+                    user=viewer,
+                    instance=user,
+                    serializer_name="UnreadNotificationsSerializer",
+                ),
+                expected,
+            )
+        mock_db_thread.assert_not_called()
+        mock_thread.assert_not_called()
+
+    async def test_viewer_class(self):
+        user = await SA(UserFactory.create)()
+        other = await SA(UserFactory.create)()
+        staff = await SA(UserFactory.create)(is_staff=True)
+        anonymous = ArtconomyAnonymousUser()
+        roles = {"viewer_roles": {str(user.id): "buyer"}}
+        self.assertIsNone(viewer_class(DeliverableSerializer, user, {}))
+        self.assertEqual(viewer_class(DeliverableSerializer, user, roles), "role.buyer")
+        self.assertEqual(
+            viewer_class(DeliverableSerializer, other, roles), "role.other"
+        )
+        self.assertIsNone(viewer_class(DeliverableSerializer, staff, roles))
+        self.assertEqual(
+            viewer_class(DeliverableSerializer, anonymous, roles), "anonymous"
+        )
+        self.assertEqual(viewer_class(SubmissionSerializer, user, {}), "all")
+        self.assertEqual(viewer_class(SubmissionSerializer, staff, {}), "all")
+        self.assertEqual(viewer_class(SubmissionSerializer, anonymous, {}), "anonymous")
+        self.assertEqual(viewer_class(ArtistProfileSerializer, anonymous, {}), "all")
+        self.assertEqual(viewer_class(ArtistProfileSerializer, user, {}), "all")
+
+    async def test_deliverable_viewer_roles(self):
+        deliverable = await SA(DeliverableFactory.create)()
+        order = deliverable.order
+        self.assertEqual(
+            await SA(DeliverableSerializer.viewer_roles)(deliverable),
+            {order.seller_id: "seller", order.buyer_id: "buyer"},
+        )
+
+    @patch.object(SubmissionSerializer, "get_comment_count", return_value=0)
+    async def test_broadcast_data_shared(self, mock_comment_count):
+        owner = await SA(UserFactory.create)()
+        other = await SA(UserFactory.create)()
+        submission = await SA(SubmissionFactory.create)(owner=owner)
+        await Subscription.objects.filter(object_id=submission.id).adelete()
+        await SA(Subscription.objects.create)(
+            subscriber=other, target=submission, type=COMMENT
+        )
+        contents = {
+            "app_label": "profiles",
+            "model_name": "Submission",
+            "serializer": "SubmissionSerializer",
+            "pk": submission.id,
+            "broadcast_id": "beep",
+        }
+        first = await broadcast_data(model=Submission, contents=contents, user=owner)
+        second = await broadcast_data(model=Submission, contents=contents, user=other)
+        mock_comment_count.assert_called_once()
+        self.assertFalse(first["subscribed"])
+        self.assertEqual(second, {**first, "subscribed": True})
+
+    @patch.object(SubmissionSerializer, "get_comment_count", return_value=0)
+    async def test_broadcast_data_nested_viewer_fields(self, _mock_comment_count):
+        subscriber = await SA(UserFactory.create)()
+        other = await SA(UserFactory.create)()
+        submission = await SA(SubmissionFactory.create)()
+        deliverable = await SA(DeliverableFactory.create)(
+            product__primary_submission=submission
+        )
+        await Subscription.objects.filter(object_id=submission.id).adelete()
+        await SA(Subscription.objects.create)(
+            subscriber=subscriber, target=submission, type=COMMENT
+        )
+        contents = {
+            "app_label": "sales",
+            "model_name": "Deliverable",
+            "serializer": "DeliverableSerializer",
+            "pk": deliverable.id,
+            "broadcast_id": "beep",
+            **await SA(broadcast_roles)(deliverable, "DeliverableSerializer"),
+        }
+        first = await broadcast_data(
+            model=Deliverable, contents=contents, user=subscriber
+        )
+        second = await broadcast_data(model=Deliverable, contents=contents, user=other)
+        self.assertTrue(first["product"]["primary_submission"]["subscribed"])
+        self.assertFalse(second["product"]["primary_submission"]["subscribed"])
+
     async def test_nonexistent_model(self):
         user = await SA(UserFactory.create)()
         com = self.get_communicator()
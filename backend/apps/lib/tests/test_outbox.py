@@ -0,0 +1,111 @@
+from unittest.mock import patch
+
+from apps.lib.outbox import batched_broadcasts, outbox_stats, queue_broadcast
+from django.db import transaction
+from django.test import TestCase
+
+
+def message(pk, kind="update_model"):
+    return {"type": kind, "contents": {"pk": pk}}
+
+
+@patch("apps.lib.outbox.send_messages")
+class TestOutbox(TestCase):
+    def test_sends_on_commit(self, mock_send):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_broadcast("group", message(1))
+            queue_broadcast("group", message(2))
+            mock_send.assert_not_called()
+        mock_send.assert_called_once_with(
+            [("group", message(1)), ("group", message(2))]
+        )
+
+    def test_drops_duplicates(self, mock_send):
+        before = outbox_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_broadcast("group", message(1))
+            queue_broadcast("group", message(1))
+            queue_broadcast("other", message(1))
+            queue_broadcast("group", message(1, kind="delete_model"))
+        mock_send.assert_called_once_with(
+            [
+                ("group", message(1)),
+                ("other", message(1)),
+                ("group", message(1, kind="delete_model")),
+            ]
+        )
+        after = outbox_stats()
+        self.assertEqual(after["dropped"] - before["dropped"], 1)
+        self.assertEqual(after["sent"] - before["sent"], 3)
+
+    def test_keeps_latest_duplicate(self, mock_send):
+        stale = {"type": "update_model", "contents": {"pk": 1, "name": "Old"}}
+        latest = {"type": "update_model", "contents": {"pk": 1, "name": "New"}}
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_broadcast("group", stale)
+            queue_broadcast("group", message(2))
+            queue_broadcast("group", latest)
+        mock_send.assert_called_once_with([("group", latest), ("group", message(2))])
+
+    def test_savepoint_rollback(self, mock_send):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_broadcast("group", message(1))
+            try:
+                with transaction.atomic():
+                    queue_broadcast("group", message(2))
+                    raise ValueError
+            except ValueError:
+                pass
+            queue_broadcast("group", message(3))
+        mock_send.assert_called_once_with(
+            [("group", message(1)), ("group", message(3))]
+        )
+
+    def test_savepoint_rollback_last(self, mock_send):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_broadcast("group", message(1))
+            queue_broadcast("group", message(3))
+            try:
+                with transaction.atomic():
+                    queue_broadcast("group", message(2))
+                    raise ValueError
+            except ValueError:
+                pass
+        mock_send.assert_called_once_with(
+            [("group", message(1)), ("group", message(3))]
+        )
+        mock_send.reset_mock()
+        # Nothing is left behind for the next transaction to send.
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_broadcast("group", message(4))
+        mock_send.assert_called_once_with([("group", message(4))])
+
+    def test_savepoint_released_last(self, mock_send):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_broadcast("group", message(1))
+            with transaction.atomic():
+                queue_broadcast("group", message(2))
+        sent = [item for call in mock_send.call_args_list for item in call.args[0]]
+        self.assertEqual(sent, [("group", message(1)), ("group", message(2))])
+
+    def test_rollback_sends_nothing(self, mock_send):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    queue_broadcast("group", message(1))
+                    raise ValueError
+            except ValueError:
+                pass
+        mock_send.assert_not_called()
+
+    @patch("apps.lib.outbox.connection")
+    def test_batched_outside_transaction(self, mock_connection, mock_send):
+        mock_connection.in_atomic_block = False
+        with batched_broadcasts():
+            queue_broadcast("group", message(1))
+            with batched_broadcasts():
+                queue_broadcast("group", message(2))
+            mock_send.assert_not_called()
+        mock_send.assert_called_once_with(
+            [("group", message(1)), ("group", message(2))]
+        )
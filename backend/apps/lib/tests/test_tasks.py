@@ -1,12 +1,26 @@
-from unittest.mock import patch
+from datetime import timedelta
+from unittest.mock import AsyncMock, patch
 
-from django.test import TestCase
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
 
-from apps.lib.models import Asset
-from apps.lib.tasks import check_asset_associations
+from apps.lib.constants import COMMISSIONS_OPEN
+from apps.lib.models import ArchivedNotification, Asset, Event, Notification
+from apps.lib.tasks import (
+    archive_notifications,
+    check_asset_associations,
+    send_notification_telegrams,
+)
 from apps.lib.test_resources import EnsurePlansMixin
 from apps.lib.tests.factories import AssetFactory
-from apps.profiles.tests.factories import SubmissionFactory
+from apps.lib.utils import (
+    notification_templates,
+    notify,
+    queue_notification_delivery,
+    subscribe,
+)
+from apps.profiles.tests.factories import SubmissionFactory, UserFactory
 
 
 class TestCheckAssociations(EnsurePlansMixin, TestCase):
@@ -63,3 +77,118 @@ class TestCheckAssociations(EnsurePlansMixin, TestCase):
         submission = SubmissionFactory.create()
         asset_id = submission.file.id
         mock_check.apply_async.asset_called_with(asset_id, countdown=15)
+
+
+class TestNotificationDelivery(EnsurePlansMixin, TestCase):
+    def watchers(self, artist, count=3, telegram=False):
+        watchers = UserFactory.create_batch(count)
+        for watcher in watchers:
+            subscription, _ = subscribe(COMMISSIONS_OPEN, watcher, artist)
+            subscription.telegram = telegram
+            subscription.save()
+        return watchers
+
+    def test_template_keys(self):
+        templates = notification_templates()
+        self.assertEqual(templates["4"].name, "4_new_comment.html")
+        self.assertEqual(templates["TG_7"].name, "TG_7_commissions_open.md")
+        self.assertNotIn("TG", templates)
+
+    @override_settings(NOTIFICATION_BATCH_SIZE=2)
+    def test_sends_emails(self):
+        artist = UserFactory.create()
+        watchers = self.watchers(artist)
+        mail.outbox = []
+        notify(COMMISSIONS_OPEN, target=artist)
+        recipients = [message.to[0] for message in mail.outbox]
+        for watcher in watchers:
+            self.assertIn(watcher.email, recipients)
+        self.assertEqual(
+            mail.outbox[0].subject, f"Commissions are open for {artist.username}!"
+        )
+
+    def test_silent_broadcast(self):
+        artist = UserFactory.create()
+        self.watchers(artist)
+        mail.outbox = []
+        notify(COMMISSIONS_OPEN, target=artist, silent_broadcast=True)
+        self.assertEqual(mail.outbox, [])
+
+    @override_settings(NOTIFICATION_BATCH_SIZE=2)
+    @patch("apps.lib.tasks.send_notification_telegrams")
+    @patch("apps.lib.tasks.send_notification_emails")
+    def test_batches(self, mock_emails, mock_telegrams):
+        queue_notification_delivery(5, email_user_ids=[1, 2, 3], telegram_user_ids=[4])
+        self.assertEqual(
+            [call.args for call in mock_emails.delay.call_args_list],
+            [(5, [1, 2]), (5, [3])],
+        )
+        mock_telegrams.delay.assert_called_once_with(5, [4])
+
+    @override_settings(CELERY_ALWAYS_EAGER=False)
+    @patch("apps.lib.tasks.send_notification_emails")
+    def test_waits_for_commit(self, mock_emails):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_notification_delivery(5, email_user_ids=[1], telegram_user_ids=[])
+            mock_emails.delay.assert_not_called()
+        mock_emails.delay.assert_called_once_with(5, [1])
+
+    @override_settings(TELEGRAM_RATE_LIMIT=1000)
+    @patch("apps.lib.utils.get_bot")
+    def test_sends_telegrams(self, mock_get_bot):
+        bot = mock_get_bot.return_value.__aenter__.return_value
+        bot.send_message = AsyncMock(side_effect=[RuntimeError("Flood"), None, None])
+        artist = UserFactory.create()
+        watchers = self.watchers(artist, telegram=True)
+        for index, watcher in enumerate(watchers):
+            watcher.tg_chat_id = str(index + 1)
+            watcher.save()
+        notify(COMMISSIONS_OPEN, target=artist, silent_broadcast=True)
+        event = Event.objects.get(type=COMMISSIONS_OPEN, object_id=artist.id)
+        send_notification_telegrams(event.id, [watcher.id for watcher in watchers])
+        # One failure shouldn't stop the rest from going out.
+        self.assertEqual(bot.send_message.await_count, 3)
+        self.assertEqual(
+            sorted(call.kwargs["chat_id"] for call in bot.send_message.await_args_list),
+            ["1", "2", "3"],
+        )
+        self.assertIn(
+            f"/profile/{artist.username}/products/",
+            bot.send_message.await_args_list[0].kwargs["text"],
+        )
+
+
+class TestArchiveNotifications(EnsurePlansMixin, TestCase):
+    @override_settings(NOTIFICATION_ARCHIVE_DAYS=30, NOTIFICATION_ARCHIVE_BATCH_SIZE=1)
+    def test_archives_old_read_notifications(self):
+        old_artist = UserFactory.create()
+        new_artist = UserFactory.create()
+        watchers = UserFactory.create_batch(3)
+        for watcher in watchers:
+            subscribe(COMMISSIONS_OPEN, watcher, old_artist)
+            subscribe(COMMISSIONS_OPEN, watcher, new_artist)
+        notify(COMMISSIONS_OPEN, target=old_artist, silent_broadcast=True)
+        notify(COMMISSIONS_OPEN, target=new_artist, silent_broadcast=True)
+        old_event = Event.objects.get(object_id=old_artist.id, type=COMMISSIONS_OPEN)
+        Event.objects.filter(id=old_event.id).update(
+            date=timezone.now() - timedelta(days=31)
+        )
+        Notification.objects.filter(user__in=watchers[:2]).update(read=True)
+        read_old = list(
+            Notification.objects.filter(
+                event=old_event, user__in=watchers[:2]
+            ).values_list("id", flat=True)
+        )
+        archive_notifications()
+        self.assertCountEqual(
+            ArchivedNotification.objects.values_list("id", flat=True), read_old
+        )
+        self.assertFalse(Notification.objects.filter(id__in=read_old).exists())
+        # Unread, or too new.
+        self.assertEqual(Notification.objects.filter(event=old_event).count(), 1)
+        self.assertEqual(
+            Notification.objects.filter(
+                event__object_id=new_artist.id, event__type=COMMISSIONS_OPEN
+            ).count(),
+            3,
+        )
@@ -1,19 +1,30 @@
+from io import StringIO
 from unittest.mock import patch
 
 import ddt
 from apps.lib.models import (
     Comment,
+    EmailPreference,
     Event,
     Notification,
     Subscription,
 )
-from apps.lib.constants import SYSTEM_ANNOUNCEMENT, FAVORITE, NEW_JOURNAL
+from apps.lib.constants import (
+    SYSTEM_ANNOUNCEMENT,
+    FAVORITE,
+    NEW_JOURNAL,
+    ORDER_UPDATE,
+    COMMISSIONS_OPEN,
+)
 from apps.lib.test_resources import EnsurePlansMixin, SignalsDisabledMixin
 from apps.lib.tests.factories_interdepend import CommentFactory
 from apps.lib.tests.fixtures.ip_checks import ip_result_sets
 from apps.lib.utils import (
     check_read,
     clear_events_subscriptions_and_comments,
+    delete_events,
+    delete_notifications,
+    mark_all_read,
     mark_modified,
     mark_read,
     notify,
@@ -22,12 +33,20 @@ from apps.lib.utils import (
     shift_position,
     subscribe,
     check_theocratic_ban,
+    get_matching_subscribers,
+    load_subscribers,
+    subscribers_generation_key,
+    unread_counts_kept,
 )
 from apps.profiles.constants import POWER, POWER_LIST
-from apps.profiles.models import ArtconomyAnonymousUser, Submission
+from apps.profiles.models import ArtconomyAnonymousUser, Submission, User
 from apps.profiles.tests.factories import SubmissionFactory, UserFactory, JournalFactory
+from apps.sales.tests.factories import DeliverableFactory
 from django.contrib.contenttypes.models import ContentType
-from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
 from freezegun import freeze_time
 
@@ -331,6 +350,215 @@ class NotificationsTestCase(EnsurePlansMixin, SignalsDisabledMixin, TestCase):
         send_transaction_email("Test transaction", "registration_code.html", user, {})
 
 
+class TestUnreadCounts(EnsurePlansMixin, TestCase):
+    def assertCounts(self, user, community, sales):
+        user.refresh_from_db()
+        self.assertEqual(
+            (user.unread_community_count, user.unread_sales_count), (community, sales)
+        )
+        # Should agree with a full recount.
+        call_command("rebuild_unread_counts", user.username, stdout=StringIO())
+        user.refresh_from_db()
+        self.assertEqual(
+            (user.unread_community_count, user.unread_sales_count), (community, sales)
+        )
+
+    def test_notify(self):
+        submission = SubmissionFactory.create()
+        user = submission.owner
+        subscribe(FAVORITE, user, submission)
+        notify(FAVORITE, target=submission, data={"users": []})
+        self.assertCounts(user, 1, 0)
+        deliverable = DeliverableFactory.create()
+        subscribe(ORDER_UPDATE, user, deliverable)
+        notify(ORDER_UPDATE, target=deliverable, silent_broadcast=True)
+        self.assertCounts(user, 1, 1)
+        mark_read(obj=submission, user=user)
+        self.assertCounts(user, 0, 1)
+
+    def test_mark_unread(self):
+        submission = SubmissionFactory.create()
+        user = submission.owner
+        subscribe(FAVORITE, user, submission)
+        notify(FAVORITE, target=submission, data={"users": []})
+        mark_read(obj=submission, user=user)
+        self.assertCounts(user, 0, 0)
+        notify(FAVORITE, target=submission, unique=True, mark_unread=True)
+        self.assertCounts(user, 1, 0)
+
+    def test_recall(self):
+        submission = SubmissionFactory.create()
+        user = submission.owner
+        subscribe(FAVORITE, user, submission)
+        notify(FAVORITE, target=submission, data={"users": []})
+        recall_notification(FAVORITE, submission)
+        self.assertCounts(user, 0, 0)
+        notify(FAVORITE, target=submission, unique=True)
+        self.assertCounts(user, 1, 0)
+
+    def test_mark_all_read(self):
+        submission = SubmissionFactory.create()
+        user = submission.owner
+        subscribe(FAVORITE, user, submission)
+        notify(FAVORITE, target=submission, data={"users": []})
+        deliverable = DeliverableFactory.create()
+        subscribe(ORDER_UPDATE, user, deliverable)
+        notify(ORDER_UPDATE, target=deliverable, silent_broadcast=True)
+        mark_all_read(user)
+        self.assertEqual((user.unread_community_count, user.unread_sales_count), (0, 0))
+        self.assertFalse(Notification.objects.filter(user=user, read=False).exists())
+        self.assertCounts(user, 0, 0)
+
+    def test_delete(self):
+        submission = SubmissionFactory.create()
+        user = submission.owner
+        subscribe(FAVORITE, user, submission)
+        notify(FAVORITE, target=submission, data={"users": []})
+        delete_notifications(Notification.objects.filter(user=user))
+        self.assertCounts(user, 0, 0)
+
+    def test_delete_single(self):
+        submission = SubmissionFactory.create()
+        user = submission.owner
+        subscribe(FAVORITE, user, submission)
+        notify(FAVORITE, target=submission, data={"users": []})
+        Notification.objects.get(user=user).delete()
+        self.assertCounts(user, 0, 0)
+
+    def test_delete_events(self):
+        submission = SubmissionFactory.create()
+        user = submission.owner
+        other_user = UserFactory.create()
+        subscribe(FAVORITE, user, submission)
+        subscribe(FAVORITE, other_user, submission)
+        notify(FAVORITE, target=submission, data={"users": []})
+        self.assertCounts(other_user, 1, 0)
+        delete_events(Event.objects.filter(type=FAVORITE))
+        self.assertCounts(user, 0, 0)
+        self.assertCounts(other_user, 0, 0)
+
+    def test_transfer(self):
+        submission = SubmissionFactory.create()
+        user = submission.owner
+        other_user = UserFactory.create()
+        subscribe(FAVORITE, user, submission)
+        notify(FAVORITE, target=submission, data={"users": []})
+        notifications = Notification.objects.filter(user=user)
+        with unread_counts_kept(notifications):
+            notifications.update(user=other_user)
+        self.assertCounts(user, 0, 0)
+        self.assertCounts(other_user, 1, 0)
+
+    def test_rebuild(self):
+        submission = SubmissionFactory.create()
+        user = submission.owner
+        subscribe(FAVORITE, user, submission)
+        notify(FAVORITE, target=submission, data={"users": []})
+        User.objects.filter(id=user.id).update(
+            unread_community_count=10, unread_sales_count=5
+        )
+        self.assertCounts(user, 1, 0)
+
+    def test_stale_save(self):
+        submission = SubmissionFactory.create()
+        user = submission.owner
+        stale = User.objects.get(id=user.id)
+        subscribe(FAVORITE, user, submission)
+        notify(FAVORITE, target=submission, data={"users": []})
+        stale.biography = "Still here."
+        stale.save()
+        self.assertCounts(user, 1, 0)
+        stale.refresh_from_db()
+        self.assertEqual(stale.biography, "Still here.")
+
+
+# Cached subscriber lists are only dropped once changes are committed.
+class TestSubscribersCache(EnsurePlansMixin, TransactionTestCase):
+    def get_subscribers(self, target, event_type=COMMISSIONS_OPEN):
+        return get_matching_subscribers(
+            event_type, target.id, ContentType.objects.get_for_model(target)
+        )
+
+    @patch("apps.lib.utils.load_subscribers", wraps=load_subscribers)
+    def test_cached(self, mock_load):
+        artist = UserFactory.create()
+        watcher = UserFactory.create()
+        subscribe(COMMISSIONS_OPEN, watcher, artist)
+        self.assertEqual(
+            [subscriber.id for subscriber in self.get_subscribers(artist)],
+            [watcher.id],
+        )
+        self.assertEqual(
+            [subscriber.id for subscriber in self.get_subscribers(artist)],
+            [watcher.id],
+        )
+        self.assertEqual(mock_load.call_count, 1)
+
+    @patch("apps.lib.utils.load_subscribers", wraps=load_subscribers)
+    def test_generations_evicted(self, mock_load):
+        artist = UserFactory.create()
+        content_type_id = ContentType.objects.get_for_model(artist).id
+        self.assertEqual(self.get_subscribers(artist), [])
+        cache.delete_many(
+            [
+                subscribers_generation_key(COMMISSIONS_OPEN),
+                subscribers_generation_key(
+                    COMMISSIONS_OPEN, content_type_id, artist.id
+                ),
+            ]
+        )
+        self.assertEqual(self.get_subscribers(artist), [])
+        self.assertEqual(self.get_subscribers(artist), [])
+        self.assertEqual(mock_load.call_count, 2)
+
+    def test_subscription_changes(self):
+        artist = UserFactory.create()
+        watcher = UserFactory.create()
+        self.assertEqual(self.get_subscribers(artist), [])
+        subscription, _ = subscribe(COMMISSIONS_OPEN, watcher, artist)
+        self.assertEqual(len(self.get_subscribers(artist)), 1)
+        subscription.removed = True
+        subscription.save()
+        self.assertEqual(self.get_subscribers(artist), [])
+        subscription.delete()
+        Subscription.objects.bulk_create(
+            [
+                Subscription(
+                    type=COMMISSIONS_OPEN,
+                    subscriber=watcher,
+                    content_type=ContentType.objects.get_for_model(artist),
+                    object_id=artist.id,
+                    telegram=True,
+                )
+            ]
+        )
+        (subscriber,) = self.get_subscribers(artist)
+        self.assertTrue(subscriber.telegram)
+
+    def test_email_preferences(self):
+        artist = UserFactory.create()
+        watcher = UserFactory.create()
+        subscribe(COMMISSIONS_OPEN, watcher, artist)
+        (subscriber,) = self.get_subscribers(artist)
+        self.assertTrue(subscriber.email)
+        preference = EmailPreference.objects.get(user=watcher, type=COMMISSIONS_OPEN)
+        preference.enabled = False
+        preference.save()
+        (subscriber,) = self.get_subscribers(artist)
+        self.assertFalse(subscriber.email)
+
+    def test_uncommitted_changes(self):
+        artist = UserFactory.create()
+        watcher = UserFactory.create()
+        self.assertEqual(self.get_subscribers(artist), [])
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                subscribe(COMMISSIONS_OPEN, watcher, artist)
+                self.assertEqual(len(self.get_subscribers(artist)), 1)
+                raise ValueError
+        self.assertEqual(self.get_subscribers(artist), [])
+
+
 class TestMarkers(EnsurePlansMixin, TestCase):
     def test_edit_marker(self):
         user = UserFactory.create()
@@ -1,21 +1,35 @@
+import asyncio
 import logging
 import os
 from datetime import datetime, date
 from datetime import timezone
-from functools import partial
+from contextlib import contextmanager
+from functools import lru_cache, partial
 from hashlib import sha256
 from itertools import chain
 from pathlib import Path
-from typing import TYPE_CHECKING, List, Optional, Type, Union
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
 from uuid import uuid4
 
 import markdown
 import geoip2.errors as geoip_errors
 from django.contrib.gis.geoip2 import GeoIP2
 
+from apps.lib.cache_generations import get_cached, invalidate_generations
 from apps.lib.models import (
     Asset,
     Comment,
+    EmailPreference,
     Event,
     ModifiedMarker,
     Notification,
@@ -31,15 +45,28 @@ from apps.lib.constants import (
     STREAMING,
     NEW_JOURNAL,
     EMAIL_SUBJECTS,
+    ORDER_NOTIFICATION_TYPES,
 )
 from asgiref.sync import async_to_sync
 from bs4 import BeautifulSoup
 from channels.layers import get_channel_layer
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.core.mail import EmailMultiAlternatives
+from django.contrib.postgres.expressions import ArraySubquery
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.db import IntegrityError, connection, transaction
-from django.db.models import IntegerField, Model, Q, Subquery
+from django.db.models import (
+    Count,
+    Exists,
+    F,
+    IntegerField,
+    Model,
+    OuterRef,
+    Q,
+    QuerySet,
+    Subquery,
+)
+from django.db.models.functions import Coalesce, Greatest
 from django.db.models.signals import pre_delete
 from django.db.transaction import atomic
 from django.dispatch import receiver
@@ -132,13 +159,34 @@ def recall_notification(event_type, target, data=None, unique_data=False):
     content_type = target and ContentType.objects.get_for_model(target)
     object_id = target and target.id
     events = get_matching_events(event_type, content_type, object_id, data, unique_data)
-    events.update(recalled=True)
+    with unread_counts_kept(Notification.objects.filter(event__in=events, read=False)):
+        events.update(recalled=True)
     for notification in Notification.objects.filter(event__in=events):
         send_updated(notification)
 
 
 def update_event(
-    event, data, subscriptions, mark_unread, time_override=None, transform=None
+    event, data, subscriber_ids, mark_unread, time_override=None, transform=None
+):
+    # Recalling or restoring the event changes whether its unread notifications are
+    # counted, and marking it unread changes its subscribers' notifications. Read
+    # notifications of anyone else are left alone, so they needn't be locked.
+    affected = Q(read=False)
+    if mark_unread:
+        affected |= Q(user__in=subscriber_ids)
+    with unread_counts_kept(Notification.objects.filter(affected, event=event)):
+        apply_event_update(
+            event,
+            data,
+            subscriber_ids,
+            mark_unread,
+            time_override=time_override,
+            transform=transform,
+        )
+
+
+def apply_event_update(
+    event, data, subscriber_ids, mark_unread, time_override=None, transform=None
 ):
     event.recalled = False
     if mark_unread or time_override:
@@ -154,12 +202,169 @@ def update_event(
     event.data = data
     event.save()
     if mark_unread:
-        subscribers = subscriptions.values_list("subscriber_id", flat=True)
-        Notification.objects.filter(user__in=subscribers, event=event).update(
+        Notification.objects.filter(user__in=subscriber_ids, event=event).update(
             read=False
         )
 
 
+def sales_notifications_q() -> Q:
+    """
+    Matches the notifications which belong in the sales notification list, rather
+    than the community one.
+    """
+    return Q(event__type__in=ORDER_NOTIFICATION_TYPES) | Q(
+        event__type=COMMENT, event__content_type__in=order_comment_types()
+    )
+
+
+def unread_counter_field(event: Event) -> str:
+    """
+    The user field counting unread notifications for this event.
+    """
+    if event.type in ORDER_NOTIFICATION_TYPES or (
+        event.type == COMMENT
+        and event.content_type_id in [item.id for item in order_comment_types()]
+    ):
+        return "unread_sales_count"
+    return "unread_community_count"
+
+
+UnreadCounts = Dict[int, Tuple[int, int]]
+
+
+def unread_counts(notifications: QuerySet) -> UnreadCounts:
+    """
+    Counts the unread notifications in a set, as (community, sales) by user ID.
+    Notifications for recalled events aren't counted.
+    """
+    rows = (
+        notifications.filter(read=False)
+        .exclude(event__recalled=True)
+        .order_by()
+        .values("user_id")
+        .annotate(total=Count("id"), sales=Count("id", filter=sales_notifications_q()))
+    )
+    return {row["user_id"]: (row["total"] - row["sales"], row["sales"]) for row in rows}
+
+
+def shift_unread_counts(changes: UnreadCounts):
+    """
+    Adds (community, sales) changes to users' unread counters. Users who share the
+    same changes are updated together.
+    """
+    from apps.profiles.models import User
+
+    by_change = {}
+    for user_id, change in changes.items():
+        if change != (0, 0):
+            by_change.setdefault(change, []).append(user_id)
+    for (community, sales), user_ids in by_change.items():
+        User.objects.filter(id__in=user_ids).update(
+            unread_community_count=Greatest(F("unread_community_count") + community, 0),
+            unread_sales_count=Greatest(F("unread_sales_count") + sales, 0),
+        )
+
+
+@contextmanager
+def unread_counts_kept(notifications: QuerySet):
+    """
+    Keeps unread counters in step with whatever is done to a set of notifications
+    inside the block, whether they're marked read or unread, recalled, or handed to
+    another user. The notifications are locked until the block ends, so concurrent
+    changes can't count them twice.
+    """
+    with transaction.atomic():
+        ids = list(
+            notifications.select_for_update(of=("self",))
+            .order_by()
+            .values_list("id", flat=True)
+        )
+        locked = Notification.objects.filter(id__in=ids)
+        before = unread_counts(locked)
+        yield
+        after = unread_counts(locked)
+        shift_unread_counts(
+            {
+                user_id: tuple(
+                    new - old
+                    for new, old in zip(
+                        after.get(user_id, (0, 0)), before.get(user_id, (0, 0))
+                    )
+                )
+                for user_id in {*before, *after}
+            }
+        )
+
+
+def delete_notifications(notifications: QuerySet):
+    """
+    Deletes a set of notifications, taking the unread ones out of their users'
+    counters all at once. The post_delete receiver only adjusts them for
+    notifications deleted one at a time.
+    """
+    from apps.lib.consumers import send_updated
+    from apps.profiles.models import User
+
+    with unread_counts_kept(notifications):
+        user_ids = set(
+            notifications.filter(read=False).values_list("user_id", flat=True)
+        )
+        notifications.delete()
+    for user in User.objects.filter(id__in=user_ids):
+        send_updated(user, serializers=["UnreadNotificationsSerializer"])
+
+
+@atomic
+def delete_events(events: QuerySet):
+    """
+    Deletes a set of events along with their notifications. Use this rather than
+    deleting events directly, so that unread counters stay in step.
+    """
+    delete_notifications(Notification.objects.filter(event__in=events))
+    events.delete()
+
+
+@atomic
+def mark_all_read(user: "User"):
+    """
+    Marks all of a user's notifications read and empties their unread counters.
+
+    The user is updated first. A notification created concurrently either commits
+    before the notifications are updated, and so is marked read here, or has its count
+    added once this commits.
+    """
+    from apps.profiles.models import User
+
+    User.objects.filter(id=user.id).update(
+        unread_community_count=0, unread_sales_count=0
+    )
+    Notification.objects.filter(user=user, read=False).update(read=True)
+    user.unread_community_count = 0
+    user.unread_sales_count = 0
+
+
+def rebuild_unread_counts(users: QuerySet):
+    """
+    Recounts the unread notifications of a set of users from scratch.
+    """
+    unread = (
+        Notification.objects.filter(user=OuterRef("pk"), read=False)
+        .exclude(event__recalled=True)
+        .order_by()
+        .values("user")
+    )
+
+    def count(queryset):
+        return Coalesce(
+            Subquery(queryset.annotate(total=Count("id")).values("total")), 0
+        )
+
+    users.update(
+        unread_community_count=count(unread.exclude(sales_notifications_q())),
+        unread_sales_count=count(unread.filter(sales_notifications_q())),
+    )
+
+
 def target_params(object_id, content_type):
     query = Q(object_id__isnull=True, content_type__isnull=True)
     if content_type:
@@ -167,15 +372,115 @@ def target_params(object_id, content_type):
     return query
 
 
-def get_matching_subscriptions(event_type, object_id, content_type, exclude=None):
-    exclude = exclude or []
+SUBSCRIBERS_CACHE_PREFIX = "notification_subscribers"
+
+
+class Subscriber(NamedTuple):
+    id: int
+    until: Optional[date]
+    email: bool
+    telegram: bool
+
+
+def subscribers_generation_key(event_type, content_type_id=None, object_id=None):
+    if content_type_id is None:
+        return f"{SUBSCRIBERS_CACHE_PREFIX}.{event_type}.generation"
     return (
+        f"{SUBSCRIBERS_CACHE_PREFIX}.{event_type}.{content_type_id}.{object_id}"
+        ".generation"
+    )
+
+
+def invalidate_subscribers(keys: Iterable[Tuple[int, Optional[int], Optional[int]]]):
+    """
+    Drops cached subscriber lists once the current transaction commits. Keys are
+    (event type, content type ID, object ID). A key without a content type drops the
+    lists for every target of its event type, since subscriptions without a target
+    are included in all of them.
+    """
+    invalidate_generations(subscribers_generation_key(*key) for key in keys)
+
+
+def subscriptions_changed(subscriptions: Iterable[Subscription]):
+    invalidate_subscribers(
+        (subscription.type, subscription.content_type_id, subscription.object_id)
+        for subscription in subscriptions
+    )
+
+
+def email_preferences_changed(user_id: int, event_types: Iterable[int]):
+    """
+    Drops the cached subscriber lists a user's email preferences for these event
+    types could affect.
+    """
+    invalidate_subscribers(
         Subscription.objects.filter(
+            subscriber_id=user_id, type__in=event_types
+        ).values_list("type", "content_type_id", "object_id")
+    )
+
+
+def load_subscribers(event_type, object_id, content_type) -> List[Subscriber]:
+    email_enabled = EmailPreference.objects.filter(
+        user=OuterRef("subscriber_id"),
+        type=event_type,
+        content_type=content_type,
+        enabled=True,
+    )
+    return [
+        Subscriber(*row)
+        for row in Subscription.objects.filter(
             Q(type=event_type, removed=False) & target_params(object_id, content_type)
         )
-        .exclude(subscriber__in=exclude)
-        .filter(Q(until__isnull=True) | Q(until__gte=current_timezone.now().date()))
+        .annotate(email_enabled=Exists(email_enabled))
+        .order_by("id")
+        .values_list("subscriber_id", "until", "email_enabled", "telegram")
+    ]
+
+
+def get_matching_subscribers(
+    event_type, object_id, content_type, exclude=None
+) -> List[Subscriber]:
+    """
+    Everyone subscribed to an event type on a target, along with whether they get it
+    by email or Telegram. The full list is cached for each target, and kept until
+    subscriptions or email preferences which affect it change. Expired subscriptions
+    and excluded users are filtered out afterwards.
+
+    Users who've had their email nulled, or haven't linked Telegram, are left in.
+    The delivery tasks skip them.
+    """
+    content_type_id = content_type.id if content_type else None
+    subscribers = get_cached(
+        f"{SUBSCRIBERS_CACHE_PREFIX}.{event_type}.{content_type_id}.{object_id}",
+        [
+            subscribers_generation_key(event_type),
+            subscribers_generation_key(event_type, content_type_id, object_id),
+        ],
+        partial(load_subscribers, event_type, object_id, content_type),
+        settings.NOTIFICATION_SUBSCRIBERS_CACHE_TIMEOUT,
     )
+    return filter_subscribers(subscribers, exclude)
+
+
+def filter_subscribers(subscribers: List[Subscriber], exclude=None) -> List[Subscriber]:
+    excluded = {getattr(user, "id", user) for user in exclude or []}
+    today = current_timezone.now().date()
+    matching = {}
+    for subscriber in subscribers:
+        if subscriber.id in excluded:
+            continue
+        if subscriber.until is not None and subscriber.until < today:
+            continue
+        previous = matching.get(subscriber.id)
+        if previous:
+            # Subscribed both to the target and to the event type as a whole.
+            subscriber = subscriber._replace(
+                email=subscriber.email or previous.email,
+                telegram=subscriber.telegram or previous.telegram,
+            )
+        matching[subscriber.id] = subscriber
+    return list(matching.values())
 
 
 def get_matching_events(event_type, content_type, object_id, data, unique_data=None):
@@ -300,6 +605,155 @@ class FakeRequest:
         return make_url(value)
 
 
+@lru_cache
+def notification_templates() -> Dict[str, Path]:
+    """
+    Notification templates by event type, with Telegram templates keyed as
+    TG_<event type>. Read from disk once per process.
+    """
+    path = Path(settings.BACKEND_ROOT) / "templates" / "notifications"
+    templates = {}
+    for file in sorted(os.listdir(str(path))):
+        parts = file.split("_")
+        key = "_".join(parts[:2]) if parts[0] == "TG" else parts[0]
+        templates.setdefault(key, path / file)
+    return templates
+
+
+def notification_context(event: Event, user: "User") -> dict:
+    from apps.lib.serializers import NOTIFICATION_TYPE_MAP, notification_serialize
+
+    req_context = {"request": FakeRequest(user)}
+    return {
+        "data": NOTIFICATION_TYPE_MAP.get(event.type, lambda x, _: x.data)(
+            event, req_context
+        ),
+        "target": notification_serialize(event.target, req_context),
+        "user": user,
+    }
+
+
+def batches(items: List, size: int) -> List[List]:
+    return [items[index : index + size] for index in range(0, len(items), size)]
+
+
+def queue_notification_delivery(
+    event_id: int, *, email_user_ids: List[int], telegram_user_ids: List[int]
+):
+    """
+    Hands the emails and Telegram messages for an event to Celery once the current
+    transaction commits, in batches of NOTIFICATION_BATCH_SIZE subscribers, so that
+    nobody waits on them while holding the transaction open.
+    """
+    from apps.lib.tasks import send_notification_emails, send_notification_telegrams
+
+    size = settings.NOTIFICATION_BATCH_SIZE
+    jobs = [
+        (send_notification_emails, batch) for batch in batches(email_user_ids, size)
+    ] + [
+        (send_notification_telegrams, batch)
+        for batch in batches(telegram_user_ids, size)
+    ]
+    if not jobs:
+        return
+
+    def dispatch():
+        for task, user_ids in jobs:
+            task.delay(event_id, user_ids)
+
+    if settings.CELERY_ALWAYS_EAGER:
+        # Only set in tests, where commit hooks never run. The tasks would run right
+        # away regardless.
+        dispatch()
+        return
+    transaction.on_commit(dispatch)
+
+
+def render_notification_emails(
+    event: Event, users: List["User"]
+) -> List[EmailMultiAlternatives]:
+    template_path = notification_templates().get(str(event.type))
+    if template_path is None:
+        logger.error("No email template for notification type %s.", event.type)
+        return []
+    template = get_template(template_path)
+    subject_template = Template(EMAIL_SUBJECTS[event.type])
+    messages = []
+    for user in users:
+        ctx = {**notification_context(event, user), "raw_target": event.target}
+        message = template.render(ctx)
+        msg = EmailMultiAlternatives(
+            subject_template.render(Context(ctx)),
+            gen_textifier().handle(message),
+            to=[user.guest_email or user.email],
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            headers={"Return-Path": settings.RETURN_PATH_EMAIL},
+        )
+        msg.attach_alternative(message, "text/html")
+        messages.append(msg)
+    return messages
+
+
+def deliver_notification_emails(event: Event, users: List["User"]):
+    """
+    Renders and sends the emails for an event, over a single connection.
+    """
+    messages = render_notification_emails(event, users)
+    if messages:
+        get_connection().send_messages(messages)
+
+
+def render_notification_telegrams(event: Event, users: List["User"]) -> List[dict]:
+    template_path = notification_templates().get(f"TG_{event.type}")
+    if template_path is None:
+        logger.error("No Telegram template for notification type %s.", event.type)
+        return []
+    template = get_template(template_path)
+    return [
+        {
+            "chat_id": user.tg_chat_id,
+            "parse_mode": "Markdown",
+            "text": template.render(
+                {**notification_context(event, user), "base_url": make_url("")}
+            ),
+        }
+        for user in users
+        if user.tg_chat_id
+    ]
+
+
+async def send_telegram_messages(messages: List[dict]):
+    """
+    Sends Telegram messages concurrently. No more than TELEGRAM_MAX_CONCURRENCY are in
+    flight at once, and no more than TELEGRAM_RATE_LIMIT are started per second, to
+    stay under Telegram's flood limits.
+    """
+    semaphore = asyncio.Semaphore(settings.TELEGRAM_MAX_CONCURRENCY)
+    interval = 1 / settings.TELEGRAM_RATE_LIMIT
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async with get_bot() as bot:
+
+        async def send(index: int, message: dict):
+            await asyncio.sleep(max(0.0, start + index * interval - loop.time()))
+            async with semaphore:
+                try:
+                    await bot.send_message(**message)
+                except Exception as err:
+                    logger.exception(err)
+
+        await asyncio.gather(
+            *(send(index, message) for index, message in enumerate(messages))
+        )
+
+
+def deliver_notification_telegrams(event: Event, users: List["User"]):
+    messages = render_notification_telegrams(event, users)
+    if messages:
+        async_to_sync(send_telegram_messages)(messages)
+
+
 @atomic
 def notify(
     event_type,
@@ -346,18 +800,16 @@ def notify(
     otherwise would have been generated.
     """
     from apps.lib.consumers import send_new, send_updated
-    from apps.lib.serializers import NOTIFICATION_TYPE_MAP, notification_serialize
     from apps.profiles.models import User
 
     if data is None:
         data = {}
     content_type = target and ContentType.objects.get_for_model(target)
     object_id = target and target.id
-    subscriptions = get_matching_subscriptions(
-        event_type, object_id, content_type, exclude
-    )
+    subscribers = get_matching_subscribers(event_type, object_id, content_type, exclude)
+    subscriber_ids = [subscriber.id for subscriber in subscribers]
 
-    if not subscriptions.exists() and not force_create:
+    if not subscribers and not force_create:
         return
 
     event = None
@@ -370,7 +822,7 @@ def notify(
             update_event(
                 event,
                 data,
-                subscriptions,
+                subscriber_ids,
                 mark_unread=mark_unread,
                 time_override=time_override,
                 transform=transform,
@@ -383,86 +835,27 @@ def notify(
             data=data,
         )
 
-    # Send email notifications if needed.
-    # email_subscriptions = subscriptions.filter(email=True)
-    email_subscriptions = subscriptions.filter(
-        subscriber__email_preferences__content_type=content_type,
-        subscriber__email_preferences__type=event_type,
-        subscriber__email_preferences__enabled=True,
-    )
-    email_subscriptions = email_subscriptions.exclude(subscriber__email_nulled=True)
-    if not silent_broadcast and email_subscriptions.exists():
-        path = Path(settings.BACKEND_ROOT) / "templates" / "notifications"
-        template = [
-            file for file in os.listdir(str(path)) if file.startswith(str(event_type))
-        ][0]
-        template_path = path / template
-        for subscription in email_subscriptions:
-            subject = EMAIL_SUBJECTS[event_type]
-            req_context = {"request": FakeRequest(subscription.subscriber)}
-            ctx = {
-                "data": NOTIFICATION_TYPE_MAP.get(event_type, lambda x, _: x.data)(
-                    event, req_context
-                ),
-                "target": notification_serialize(event.target, req_context),
-                "user": subscription.subscriber,
-                "raw_target": event.target,
-            }
-            subject = Template(subject).render(Context(ctx))
-            to = [subscription.subscriber.guest_email or subscription.subscriber.email]
-            from_email = settings.DEFAULT_FROM_EMAIL
-            message = get_template(template_path).render(ctx)
-            textifier = gen_textifier()
-            msg = EmailMultiAlternatives(
-                subject,
-                textifier.handle(message),
-                to=to,
-                from_email=from_email,
-                headers={"Return-Path": settings.RETURN_PATH_EMAIL},
-            )
-            msg.attach_alternative(message, "text/html")
-            msg.send()
-
-    telegram_subscriptions = subscriptions.filter(telegram=True)
-    if not silent_broadcast and telegram_subscriptions.exists():
-        path = Path(settings.BACKEND_ROOT) / "templates" / "notifications"
-        template = [
-            file
-            for file in os.listdir(str(path))
-            if file.startswith("TG_" + str(event_type))
-        ][0]
-        template_path = path / template
-        for subscription in telegram_subscriptions:
-            if not subscription.subscriber.tg_chat_id:
-                continue
-            req_context = {"request": FakeRequest(subscription.subscriber)}
-            ctx = {
-                "data": NOTIFICATION_TYPE_MAP.get(event_type, lambda x, _: x.data)(
-                    event, req_context
-                ),
-                "target": notification_serialize(event.target, req_context),
-                "user": subscription.subscriber,
-                "base_url": make_url(""),
-            }
-            message = get_template(template_path).render(ctx)
-            try:
-                get_bot().send_message(
-                    chat_id=subscription.subscriber.tg_chat_id,
-                    parse_mode="Markdown",
-                    text=message,
-                )
-            except Exception as err:
-                logger.exception(err)
+    # Send emails and Telegram messages if needed.
+    if not silent_broadcast:
+        queue_notification_delivery(
+            event.id,
+            email_user_ids=[
+                subscriber.id for subscriber in subscribers if subscriber.email
+            ],
+            telegram_user_ids=[
+                subscriber.id for subscriber in subscribers if subscriber.telegram
+            ],
+        )
 
     # We need to make sure anyone who was previously ineligible for a notification who
     # is now eligible can get one. To do that, we must avoid creating any that already
     # exist if we want to leverage bulk_create. This should be a minority case that
     # won't require too much overhead when it happens, but I suppose we will see.
-    existing_user_ids = []
+    existing_user_ids = set()
     existing_resolved = []
     existing = Notification.objects.filter(event=event.id).prefetch_related("user")
     for existing in existing:
-        existing_user_ids.append(existing.user_id)
+        existing_user_ids.add(existing.user_id)
         existing_resolved.append(existing)
 
     def update_existing():
@@ -474,26 +867,27 @@ def notify(
             send_updated(user, serializers=["UnreadNotificationsSerializer"])
 
     transaction.on_commit(update_existing)
-    subscriptions = subscriptions.exclude(subscriber_id__in=existing_user_ids)
     notifications = Notification.objects.bulk_create(
         (
-            Notification(event_id=event.id, user_id=subscriber_id)
-            for subscriber_id in subscriptions.values_list("subscriber_id", flat=True)
+            Notification(event=event, user_id=subscriber_id)
+            for subscriber_id in subscriber_ids
+            if subscriber_id not in existing_user_ids
         ),
         batch_size=1000,
     )
 
+    user_ids = [notification.user_id for notification in notifications]
+    if not event.recalled:
+        field = unread_counter_field(event)
+        User.objects.filter(id__in=user_ids).update(**{field: F(field) + 1})
+
     def send_new_notifications():
         # The post_save hooks aren't called in bulk_create, so we send them here.
-        user_ids = []
         for notification in notifications:
             send_new(notification)
-            user_ids.append(notification.user_id)
-            send_updated(
-                notification.user,
-            )
+        # Includes UnreadNotificationsSerializer.
         for user in User.objects.filter(id__in=user_ids):
-            send_updated(user, serializers=["UnreadNotificationsSerializer"])
+            send_updated(user)
 
     transaction.on_commit(send_new_notifications)
 
@@ -517,9 +911,12 @@ def clear_events(sender, instance, **_kwargs):
     To be used as a signal handler elsewhere on models to make sure any events that
     existed with this instance as the target are removed. Use in pre_delete.
     """
-    Event.objects.filter(
-        object_id=instance.id, content_type=ContentType.objects.get_for_model(instance)
-    ).delete()
+    delete_events(
+        Event.objects.filter(
+            object_id=instance.id,
+            content_type=ContentType.objects.get_for_model(instance),
+        )
+    )
 
 
 # This receiver is not in models where it would normally be, since we want to have
@@ -661,6 +1058,34 @@ def remove_tags(request, target, field_name="tags"):
     return True, None
 
 
+def refresh_tag_names(qs: QuerySet):
+    """
+    Copies the tags of each object in a queryset into its tag_names array, which tag
+    searches and blacklists filter against. Tags are keyed by name, so the array holds
+    their primary keys.
+    """
+    field = qs.model.tags.field
+    tag_field = field.m2m_reverse_field_name()
+    qs.update(
+        tag_names=ArraySubquery(
+            field.remote_field.through.objects.filter(
+                **{field.m2m_field_name(): OuterRef("pk")}
+            )
+            .order_by(tag_field)
+            .values(tag_field)
+        )
+    )
+
+
+def tag_name_list(tags: Union[QuerySet, Iterable]) -> List[str]:
+    """
+    Names of a set of tags, for comparing against tag_names arrays.
+    """
+    if isinstance(tags, QuerySet):
+        return list(tags.values_list("name", flat=True))
+    return [getattr(tag, "name", tag) for tag in tags]
+
+
 # https://www.caktusgroup.com/blog/2009/05/26/explicit-table-locking-with
 # -postgresql-and-django/
 LOCK_MODES = (
@@ -705,6 +1130,34 @@ def require_lock(model, lock):
     return require_lock_decorator
 
 
+def advisory_lock_key(name: str) -> int:
+    """
+    Derives a stable, signed 64-bit key from a lock name, for use with PostgreSQL's
+    advisory lock functions.
+    """
+    digest = sha256(name.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+
+def advisory_lock(name: str):
+    """
+    Takes a PostgreSQL advisory lock on a name until the end of the current
+    transaction. Unlike require_lock, this only blocks other transactions asking for
+    the same name, so work on unrelated records continues unhindered.
+
+    Example:
+        with transaction.atomic():
+            advisory_lock(f"payout_user__{user.id}")
+            ...
+    """
+    if not connection.in_atomic_block:
+        raise transaction.TransactionManagementError(
+            "Advisory locks must be taken inside a transaction."
+        )
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", [advisory_lock_key(name)])
+
+
 def translate_related_names(names):
     new_names = []
     for related_name in names:
@@ -764,7 +1217,7 @@ def get_client_ip(request):
     return ip
 
 
-def send_transaction_email(subject, template_name, user, context):
+def send_transaction_email(subject, template_name, user, context, attachments=None):
     template_path = (
         Path(settings.BACKEND_ROOT) / "templates" / "transactional" / template_name
     )
@@ -783,6 +1236,8 @@ def send_transaction_email(subject, template_name, user, context):
         headers={"Return-Path": settings.RETURN_PATH_EMAIL},
     )
     msg.attach_alternative(message, "text/html")
+    for attachment in attachments or []:
+        msg.attach(*attachment)
     msg.send()
 
 
@@ -884,9 +1339,11 @@ def mark_read(*, obj: Model, user: "User"):
         content_type=ContentType.objects.get_for_model(obj),
         object_id=obj.id,
     )
-    Notification.objects.filter(
-        event__content_type=content_type, event__object_id=obj.id, user=user
-    ).update(read=True)
+    notifications = Notification.objects.filter(
+        event__content_type=content_type, event__object_id=obj.id, user=user, read=False
+    )
+    with unread_counts_kept(notifications):
+        notifications.update(read=True)
 
 
 def mark_modified(
@@ -919,7 +1376,7 @@ def clear_markers(sender: Type[Model], instance: Model, **kwargs):
 def clear_events_subscriptions_and_comments(target: Model):
     content_type = ContentType.objects.get_for_model(target)
     Subscription.objects.filter(content_type=content_type, object_id=target.id).delete()
-    Event.objects.filter(content_type=content_type, object_id=target.id).delete()
+    delete_events(Event.objects.filter(content_type=content_type, object_id=target.id))
     for comment in Comment.objects.filter(
         top_content_type=content_type, top_object_id=target.id
     ):
@@ -927,11 +1384,13 @@ def clear_events_subscriptions_and_comments(target: Model):
 
 
 def clear_comments_by_content_obj_ref(*, content_type, target_id):
-    Event.objects.filter(
-        content_type=content_type,
-        object_id=target_id,
-        type=COMMENT,
-    ).delete()
+    delete_events(
+        Event.objects.filter(
+            content_type=content_type,
+            object_id=target_id,
+            type=COMMENT,
+        )
+    )
     for comment in Comment.objects.filter(
         top_content_type=content_type,
         top_object_id=target_id,
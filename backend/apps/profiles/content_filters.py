@@ -0,0 +1,97 @@
+"""
+Caches what each viewer should have filtered out of listings: the users on either
+side of a block, and the tags on their blacklists. Listings turn these into plain
+ID and tag array checks, rather than joining through the block and blacklist tables
+on every request.
+
+Each viewer's filter is cached against a generation key, which is replaced once a
+transaction changing their blocks or blacklists commits. See
+apps.lib.cache_generations.
+"""
+
+from functools import partial
+from typing import Iterable, NamedTuple, Tuple
+
+from apps.lib.cache_generations import get_cached, invalidate_generations
+from django.conf import settings
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db.models import OuterRef
+
+CONTENT_FILTER_CACHE_PREFIX = "content_filter"
+
+
+class ContentFilter(NamedTuple):
+    # Users who have blocked the viewer.
+    blocked_by: Tuple[int, ...]
+    # Users the viewer has blocked.
+    blocking: Tuple[int, ...]
+    blacklist: Tuple[str, ...]
+    nsfw_blacklist: Tuple[str, ...]
+
+    @property
+    def blocks(self) -> Tuple[int, ...]:
+        """
+        Users blocked in either direction.
+        """
+        return self.blocked_by + self.blocking
+
+
+EMPTY_FILTER = ContentFilter((), (), (), ())
+
+
+def content_filter_key(user_id: int) -> str:
+    return f"{CONTENT_FILTER_CACHE_PREFIX}.{user_id}"
+
+
+def content_filter_generation_key(user_id: int) -> str:
+    return f"{CONTENT_FILTER_CACHE_PREFIX}.{user_id}.generation"
+
+
+def invalidate_content_filters(user_ids: Iterable[int]):
+    """
+    Drops the cached filters for these users once the current transaction commits.
+    """
+    invalidate_generations(
+        content_filter_generation_key(user_id) for user_id in user_ids
+    )
+
+
+def load_content_filter(user_id: int) -> ContentFilter:
+    from apps.profiles.models import User
+
+    blocks = User.blocking.through.objects
+    blacklist = User.blacklist.through.objects
+    nsfw_blacklist = User.nsfw_blacklist.through.objects
+    row = (
+        User.objects.filter(id=user_id)
+        .values_list(
+            ArraySubquery(
+                blocks.filter(to_user_id=OuterRef("id")).values("from_user_id")
+            ),
+            ArraySubquery(
+                blocks.filter(from_user_id=OuterRef("id")).values("to_user_id")
+            ),
+            ArraySubquery(blacklist.filter(user_id=OuterRef("id")).values("tag_id")),
+            ArraySubquery(
+                nsfw_blacklist.filter(user_id=OuterRef("id")).values("tag_id")
+            ),
+        )
+        .first()
+    )
+    if row is None:
+        return EMPTY_FILTER
+    return ContentFilter(*(tuple(sorted(values)) for values in row))
+
+
+def get_content_filter(user) -> ContentFilter:
+    """
+    The content filter for a viewer. Anonymous viewers have nothing to filter.
+    """
+    if not user.is_authenticated:
+        return EMPTY_FILTER
+    return get_cached(
+        content_filter_key(user.id),
+        [content_filter_generation_key(user.id)],
+        partial(load_content_filter, user.id),
+        settings.CONTENT_FILTER_CACHE_TIMEOUT,
+    )
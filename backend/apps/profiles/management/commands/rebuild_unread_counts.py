@@ -0,0 +1,38 @@
+from apps.lib.utils import rebuild_unread_counts
+from apps.profiles.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds users' unread notification counters from their notifications. They're
+    normally kept in step as notifications change, so this is only needed if they've
+    drifted, or when they're first introduced.
+    """
+
+    help = "Recounts unread notifications for all users, or the given ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("usernames", nargs="*")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of users to update at a time.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("Batch size must be at least one.")
+        users = User.objects.all()
+        if options["usernames"]:
+            users = users.filter(username__in=options["usernames"])
+        user_ids = list(users.order_by("id").values_list("id", flat=True))
+        size = options["batch_size"]
+        for index in range(0, len(user_ids), size):
+            rebuild_unread_counts(
+                User.objects.filter(id__in=user_ids[index : index + size])
+            )
+        self.stdout.write(
+            f"Recounted unread notifications for {len(user_ids)} user(s)."
+        )
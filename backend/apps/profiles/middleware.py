@@ -2,6 +2,7 @@ from datetime import date
 
 from apps.lib.abstract_models import ADULT, EXTREME, GENERAL, MATURE
 from apps.lib.utils import check_theocratic_ban
+from apps.profiles.content_filters import get_content_filter
 from apps.profiles.models import User
 from django.shortcuts import get_object_or_404
 
@@ -18,8 +19,9 @@ def derive_session_settings(*, user, session, ip):
         verified_adult = user.verified_adult
         if not sfw_mode:
             rating = user.rating
-            blacklist = user.blacklist.all()
-            nsfw_blacklist = user.nsfw_blacklist.all()
+            content_filter = get_content_filter(user)
+            blacklist = list(content_filter.blacklist)
+            nsfw_blacklist = list(content_filter.nsfw_blacklist)
     else:
         rating = session.get("rating", GENERAL)
         if rating not in [GENERAL, MATURE, ADULT, EXTREME]:
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:00
+
+from apps.lib.constants import COMMENT, ORDER_NOTIFICATION_TYPES
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_unread_counts(apps, schema):
+    User = apps.get_model("profiles", "User")
+    Notification = apps.get_model("lib", "Notification")
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    order_comment_types = ContentType.objects.filter(
+        app_label="sales", model__in=["order", "reference", "revision", "deliverable"]
+    )
+    sales = Q(event__type__in=ORDER_NOTIFICATION_TYPES) | Q(
+        event__type=COMMENT, event__content_type__in=order_comment_types
+    )
+    unread = (
+        Notification.objects.filter(user=OuterRef("pk"), read=False)
+        .exclude(event__recalled=True)
+        .order_by()
+        .values("user")
+    )
+
+    def count(queryset):
+        return Coalesce(
+            Subquery(queryset.annotate(total=Count("id")).values("total")), 0
+        )
+
+    User.objects.update(
+        unread_community_count=count(unread.exclude(sales)),
+        unread_sales_count=count(unread.filter(sales)),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        (
+            "profiles",
+            "0004_alter_socialsettings_options_submission_removed_by_and_more",
+        ),
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("lib", "0003_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="unread_community_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="unread_sales_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(
+            populate_unread_counts,
+            reverse_code=lambda x, y: None,
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:00
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db import migrations, models
+from django.db.models import OuterRef
+
+
+def populate_tag_names(apps, schema):
+    for model_name, field_name in (
+        ("Submission", "submission"),
+        ("Character", "character"),
+    ):
+        model = apps.get_model("profiles", model_name)
+        through = model.tags.through
+        model.objects.update(
+            tag_names=ArraySubquery(
+                through.objects.filter(**{field_name: OuterRef("pk")})
+                .order_by("tag")
+                .values("tag")
+            )
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("profiles", "0005_user_unread_community_count_user_unread_sales_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="submission",
+            name="tag_names",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.SlugField(),
+                blank=True,
+                default=list,
+                editable=False,
+                size=None,
+            ),
+        ),
+        migrations.AddField(
+            model_name="character",
+            name="tag_names",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.SlugField(),
+                blank=True,
+                default=list,
+                editable=False,
+                size=None,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="submission",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["tag_names"], name="profiles_submission_tags"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="character",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["tag_names"], name="profiles_character_tags"
+            ),
+        ),
+        migrations.RunPython(
+            populate_tag_names,
+            reverse_code=lambda x, y: None,
+        ),
+    ]
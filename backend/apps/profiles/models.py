@@ -58,10 +58,13 @@ from apps.lib.permissions import Or, StaffPower
 from apps.lib.utils import (
     clear_events,
     clear_events_subscriptions_and_comments,
+    delete_events,
+    email_preferences_changed,
     exclude_request,
     notify,
     preview_rating,
     recall_notification,
+    refresh_tag_names,
     remove_watch_subscriptions,
     send_transaction_email,
     tag_list_cleaner,
@@ -96,6 +99,8 @@ from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, RegexValidator, URLValidator
 from django.db import ProgrammingError, models, transaction
@@ -115,10 +120,17 @@ from django.db.models import (
     ManyToManyField,
     Model,
     OneToOneField,
+    SlugField,
     TextField,
     URLField,
 )
-from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.db.models.signals import (
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.encoding import force_bytes
@@ -320,6 +332,11 @@ class User(AbstractEmailUser, HitsMixin):
     current_intent = CharField(max_length=30, db_index=True, default="", blank=True)
     rating_count = IntegerField(default=0, blank=True)
     notifications = ManyToManyField("lib.Event", through="lib.Notification")
+    # Kept in step with the user's notifications as they change. Rebuild them with the
+    # rebuild_unread_counts command if they ever drift. Only ever changed by queryset
+    # updates, so full saves leave them out. See UNREAD_COUNT_FIELDS.
+    unread_community_count = IntegerField(default=0)
+    unread_sales_count = IntegerField(default=0)
     # Random default value to make extra sure it will never be invoked by mistake.
     reset_token = CharField(max_length=36, blank=True, default=uuid.uuid4)
     # Currently only used to make sure sellers can't change the email on an order which
@@ -384,6 +401,19 @@ class User(AbstractEmailUser, HitsMixin):
     def save(self, *args, **kwargs):
         self.email = self.email and self.email.lower()
         self.next_service_plan = self.next_service_plan or self.service_plan
+        if (
+            not self._state.adding
+            and not kwargs.get("force_insert")
+            and kwargs.get("update_fields") is None
+        ):
+            # A copy loaded before a notification arrived would otherwise write its
+            # stale counters back over the ones updated in the database.
+            excluded = {*UNREAD_COUNT_FIELDS, *self.get_deferred_fields()}
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in excluded
+            ]
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -415,6 +445,9 @@ class User(AbstractEmailUser, HitsMixin):
         return self.watched_by.all().count()
 
 
+UNREAD_COUNT_FIELDS = ("unread_community_count", "unread_sales_count")
+
+
 class ArtconomyAnonymousUser(AnonymousUser):
     @property
     def is_registered(self):
@@ -613,6 +646,7 @@ class SocialSettings(Model):
             Or(ObjectControls, StaffPower("view_social_data"), SocialsVisible)
         ],
     }
+    watch_permission_fields = ("display_socials",)
     user = OneToOneField(User, on_delete=CASCADE, related_name="social_settings")
     allow_promotion = BooleanField(
         default=False,
@@ -652,6 +686,10 @@ class SocialSettings(Model):
     class Meta:
         ordering = ("-id",)
 
+    def watch_permission_dependents(self):
+        # SocialsVisible checks social links against these settings.
+        return SocialLink.objects.filter(user_id=self.user_id)
+
 
 class SocialLink(Model):
     watch_permissions = {
@@ -729,6 +767,8 @@ class Submission(ImageModel, HitsMixin):
     characters__max = 50
     tags = ManyToManyField("lib.Tag", related_name="submissions", blank=True)
     tags__max = 200
+    # Maintained from tags, so that searches can filter on them without joining.
+    tag_names = ArrayField(SlugField(), default=list, blank=True, editable=False)
     comments = GenericRelation(
         Comment,
         related_query_name="order",
@@ -781,12 +821,16 @@ class Submission(ImageModel, HitsMixin):
 
     comment_view_permissions = [SubmissionViewPermission]
     watch_permissions = {"SubmissionSerializer": [SubmissionViewPermission]}
+    watch_permission_fields = ("owner", "private")
     comment_permissions = [
         IsRegistered,
         SubmissionViewPermission,
         SubmissionCommentPermission,
     ]
 
+    class Meta(ImageModel.Meta):
+        indexes = [GinIndex(fields=["tag_names"], name="profiles_submission_tags")]
+
     def __str__(self):
         return f"{repr(self.title)} owned by {self.owner and self.owner.username}"
 
@@ -852,7 +896,7 @@ def auto_remove_image_subscriptions(sender, instance, **kwargs):
             SUBMISSION_KILLED,
         ],
     ).delete()
-    Event.objects.filter(data__submission=instance.id).delete()
+    delete_events(Event.objects.filter(data__submission=instance.id))
 
 
 remove_submission_events = receiver(pre_delete, sender=Submission)(clear_events)
@@ -967,6 +1011,8 @@ class Character(Model, HitsMixin):
     user = ForeignKey("User", related_name="characters", on_delete=CASCADE)
     created_on = DateTimeField(auto_now_add=True)
     tags = ManyToManyField("lib.Tag", related_name="characters", blank=True)
+    # Maintained from tags, so that searches can filter on them without joining.
+    tag_names = ArrayField(SlugField(), default=list, blank=True, editable=False)
     nsfw = BooleanField(
         db_index=True,
         default=False,
@@ -990,6 +1036,7 @@ class Character(Model, HitsMixin):
     class Meta:
         unique_together = (("name", "user"),)
         ordering = ("-created_on",)
+        indexes = [GinIndex(fields=["tag_names"], name="profiles_character_tags")]
 
     def preview_image(self, request):
         if not self.primary_submission:
@@ -1123,12 +1170,16 @@ def auto_remove_character(sender, instance, **kwargs):
         object_id=instance.id,
         type=CHAR_TAG,
     ).delete()
-    Event.objects.filter(
-        content_type=ContentType.objects.get_for_model(model=sender),
-        object_id=instance.id,
-        type__in=[CHAR_TAG, NEW_CHARACTER],
-    ).delete()
-    Event.objects.filter(type=SUBMISSION_CHAR_TAG, data__character=instance.id).delete()
+    delete_events(
+        Event.objects.filter(
+            content_type=ContentType.objects.get_for_model(model=sender),
+            object_id=instance.id,
+            type__in=[CHAR_TAG, NEW_CHARACTER],
+        )
+    )
+    delete_events(
+        Event.objects.filter(type=SUBMISSION_CHAR_TAG, data__character=instance.id)
+    )
 
 
 # noinspection PyUnusedLocal
@@ -1380,18 +1431,15 @@ def auto_unsubscribe_journal(sender, instance, **kwargs):
         object_id=instance.id,
         content_type=ContentType.objects.get_for_model(Journal),
     ).delete()
-    # Need to trigger the cleanup handlers.
-    for event in Event.objects.filter(
-        content_type=ContentType.objects.get_for_model(model=sender),
-        object_id=instance.id,
-        type=COMMENT,
-    ):
-        event.delete()
-    for event in Event.objects.filter(
-        type=NEW_JOURNAL,
-        data__journal=instance.id,
-    ):
-        event.delete()
+    # Takes their notifications out of the unread counters, too.
+    delete_events(
+        Event.objects.filter(
+            content_type=ContentType.objects.get_for_model(model=sender),
+            object_id=instance.id,
+            type=COMMENT,
+        )
+    )
+    delete_events(Event.objects.filter(type=NEW_JOURNAL, data__journal=instance.id))
 
 
 class StaffPowers(models.Model):
@@ -1422,6 +1470,36 @@ for power in POWER_LIST:
     assert hasattr(StaffPowers, power)
 
 
+@receiver(post_save, sender=StaffPowers)
+@receiver(post_delete, sender=StaffPowers)
+def staff_powers_changed(sender, instance, **kwargs):
+    from apps.lib.consumers import invalidate_user_watch_permissions
+
+    invalidate_user_watch_permissions(instance.user_id)
+
+
+# Flags which staff powers and other watch permissions are checked against.
+USER_PERMISSION_FIELDS = ("is_staff", "is_superuser", "is_active")
+
+
+@receiver(post_init, sender=User)
+def remember_permission_flags(sender, instance, **kwargs):
+    instance._permission_flags = tuple(
+        instance.__dict__.get(name) for name in USER_PERMISSION_FIELDS
+    )
+
+
+@receiver(post_save, sender=User)
+def permission_flags_changed(sender, instance, created=False, **kwargs):
+    from apps.lib.consumers import invalidate_user_watch_permissions
+
+    previous = instance._permission_flags
+    flags = tuple(instance.__dict__.get(name) for name in USER_PERMISSION_FIELDS)
+    instance._permission_flags = flags
+    if not created and flags != previous:
+        invalidate_user_watch_permissions(instance.id)
+
+
 @receiver(post_save, sender=StaffPowers)
 def power_subscriptions(sender, instance, **kwargs):
     user = instance.user
@@ -1493,10 +1571,104 @@ def favorite_notification(sender, instance, **kwargs):
             )
 
 
+@disable_on_load
+def block_list_changed(sender, instance, **kwargs):
+    from apps.lib.consumers import invalidate_user_watch_permissions
+    from apps.profiles.content_filters import invalidate_content_filters
+
+    action = kwargs.get("action")
+    if action == "pre_clear":
+        # The users on the other side aren't given once the list is cleared.
+        related = instance.blocked_by if kwargs.get("reverse") else instance.blocking
+        related_ids = list(related.values_list("id", flat=True))
+        invalidate_content_filters(related_ids)
+        for pk in related_ids:
+            invalidate_user_watch_permissions(pk)
+        return
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+    invalidate_content_filters([instance.id, *(kwargs.get("pk_set") or [])])
+    invalidate_user_watch_permissions(instance.id)
+    for pk in kwargs.get("pk_set") or set():
+        invalidate_user_watch_permissions(pk)
+
+
+@disable_on_load
+def submission_sharing_changed(sender, instance, **kwargs):
+    from apps.lib.consumers import invalidate_watch_permissions
+
+    if kwargs.get("action") not in ["post_add", "post_remove", "post_clear"]:
+        return
+    if isinstance(instance, Submission):
+        invalidate_watch_permissions(instance)
+        return
+    # Changed from the user's side.
+    for submission in Submission.objects.filter(pk__in=kwargs.get("pk_set") or []):
+        invalidate_watch_permissions(submission)
+
+
+@disable_on_load
+def blacklist_changed(sender, instance, action, **kwargs):
+    from apps.profiles.content_filters import invalidate_content_filters
+
+    if isinstance(instance, User):
+        if action in ["post_add", "post_remove", "post_clear"]:
+            invalidate_content_filters([instance.id])
+        return
+    # Changed from the tag's side.
+    if action == "pre_clear":
+        invalidate_content_filters(
+            sender.objects.filter(tag=instance).values_list("user_id", flat=True)
+        )
+    elif action in ["post_add", "post_remove"]:
+        invalidate_content_filters(kwargs.get("pk_set") or [])
+
+
 models.signals.m2m_changed.connect(subscribe_watching, User.watching.through)
+models.signals.m2m_changed.connect(blacklist_changed, User.blacklist.through)
+models.signals.m2m_changed.connect(blacklist_changed, User.nsfw_blacklist.through)
+models.signals.m2m_changed.connect(block_list_changed, User.blocking.through)
+models.signals.m2m_changed.connect(
+    submission_sharing_changed, Submission.shared_with.through
+)
 models.signals.m2m_changed.connect(favorite_notification, User.favorites.through)
 
 
+@disable_on_load
+def tags_changed(sender, instance, action, model, pk_set, **kwargs):
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+    if not isinstance(instance, Tag):
+        refresh_tag_names(type(instance).objects.filter(pk=instance.pk))
+        return
+    # Changed from the tag's side.
+    if action == "post_clear":
+        refresh_tag_names(model.objects.filter(tag_names__contains=[instance.name]))
+        return
+    refresh_tag_names(model.objects.filter(pk__in=pk_set or []))
+
+
+models.signals.m2m_changed.connect(tags_changed, Submission.tags.through)
+models.signals.m2m_changed.connect(tags_changed, Character.tags.through)
+
+
+@receiver(post_save, sender=Submission)
+@receiver(post_save, sender=Character)
+@disable_on_load
+def keep_tag_names(sender, instance, created=False, update_fields=None, **kwargs):
+    # A full save writes back whatever tag names the instance was loaded with, which
+    # may be stale by now.
+    if created or (update_fields is not None and "tag_names" not in update_fields):
+        return
+    refresh_tag_names(sender.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Tag)
+def remove_tag_names(sender, instance, **kwargs):
+    for model in (Submission, Character):
+        refresh_tag_names(model.objects.filter(tag_names__contains=[instance.name]))
+
+
 def create_email_preferences(user: User):
     """
     Creates email preferences for a user.
@@ -1644,3 +1816,4 @@ def create_email_preferences(user: User):
             ]
         )
     EmailPreference.objects.bulk_create(preferences, ignore_conflicts=True)
+    email_preferences_changed(user.id, {preference.type for preference in preferences})
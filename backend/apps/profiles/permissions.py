@@ -1,6 +1,8 @@
-from typing import TYPE_CHECKING, Iterable
+from typing import TYPE_CHECKING, Any, Iterable
 
+from asgiref.sync import sync_to_async
 from dateutil.relativedelta import relativedelta
+from django.core.exceptions import FieldDoesNotExist
 from django.utils import timezone
 from django.views import View
 from rest_framework.permissions import BasePermission
@@ -12,6 +14,23 @@ if TYPE_CHECKING:
     from apps.sales.models import Invoice
     from apps.profiles.models import User
 
+# Returned by foreign_key_id when there's no such foreign key.
+MISSING = object()
+
+
+def foreign_key_id(obj: Any, name: str) -> Any:
+    """
+    The ID a foreign key on a model instance points to, read without a query. Returns
+    MISSING if the instance has no foreign key by that name.
+    """
+    try:
+        field = obj._meta.get_field(name)
+    except (AttributeError, FieldDoesNotExist):
+        return MISSING
+    if not (field.many_to_one or (field.one_to_one and field.concrete)):
+        return MISSING
+    return getattr(obj, field.attname)
+
 
 class ObjectControls(BasePermission):
     """
@@ -31,6 +50,30 @@ class ObjectControls(BasePermission):
             if obj.owner == request.user:
                 return True
 
+    async def ahas_object_permission(self, request, view, obj):
+        """
+        Compares foreign key IDs rather than fetching the related users, so that the
+        check doesn't need the database.
+        """
+        from apps.profiles.models import User
+
+        if request.user.is_superuser:
+            return True
+        if not request.user.is_authenticated:
+            return False
+        user_id = foreign_key_id(obj, "user")
+        owner_id = foreign_key_id(obj, "owner")
+        if (user_id is MISSING and hasattr(type(obj), "user")) or (
+            owner_id is MISSING and hasattr(type(obj), "owner")
+        ):
+            # Not a plain foreign key, so we can't tell without loading it.
+            return bool(
+                await sync_to_async(self.has_object_permission)(request, view, obj)
+            )
+        if user_id is MISSING and isinstance(obj, User):
+            user_id = obj.pk
+        return request.user.pk in (user_id, owner_id)
+
 
 class SharedWith(BasePermission):
     """
@@ -237,6 +280,9 @@ class IsRegistered(BasePermission):
     def has_object_permission(self, request, view, obj):
         return request.user.is_registered
 
+    async def ahas_object_permission(self, request, view, obj):
+        return request.user.is_registered
+
     def has_permission(self, request, view):
         return request.user.is_registered
 
@@ -274,6 +320,25 @@ def staff_power(user: "User", *powers: Iterable["POWER"]):
     return all((getattr(user.staff_powers, power) for power in powers))
 
 
+async def astaff_power(user: "User", *powers: Iterable["POWER"]):
+    """
+    Async version of staff_power, which loads the user's staff powers with the async
+    ORM if they haven't been loaded already.
+    """
+    from apps.profiles.models import StaffPowers, User
+
+    if user.is_superuser:
+        return True
+    if not user.is_staff:
+        return False
+    if not User.staff_powers.is_cached(user):
+        try:
+            user.staff_powers = await StaffPowers.objects.aget(user_id=user.id)
+        except StaffPowers.DoesNotExist:
+            return False
+    return all((getattr(user.staff_powers, power) for power in powers))
+
+
 class SocialsVisible(BasePermission):
     """
     Return True if the 'display_socials' flag is true.
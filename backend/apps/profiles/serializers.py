@@ -20,7 +20,6 @@ from apps.lib.serializers import (
     UserListField,
     UserRelationField,
 )
-from apps.lib.utils import order_comment_types
 from apps.profiles.constants import POWER_LIST
 from apps.profiles.models import (
     ArtistProfile,
@@ -174,6 +173,9 @@ class SubmissionSerializer(IdWritable, RelatedAtomicMixin, serializers.ModelSeri
     subscribed = SubscribedField(required=False)
     tags = TagListField()
     private = serializers.BooleanField(default=False)
+    # Only the subscription status differs between viewers of a broadcast.
+    viewer_independent = True
+    viewer_fields = ("subscribed",)
 
     # noinspection PyMethodMayBeStatic
     def get_comment_count(self, obj):
@@ -583,6 +585,9 @@ class SubmissionManagementSerializer(
 
 @register_serializer
 class ArtistProfileSerializer(serializers.ModelSerializer):
+    # Output is the same for everyone, so broadcasts can share one payload.
+    viewer_independent = True
+
     class Meta:
         model = ArtistProfile
         fields = (
@@ -686,6 +691,8 @@ class CredentialsSerializer(serializers.ModelSerializer):
 
 @register_serializer
 class StaffPowersSerializer(serializers.ModelSerializer):
+    viewer_independent = True
+
     class Meta:
         model = StaffPowers
         fields = ("id",) + POWER_LIST
@@ -1184,47 +1191,14 @@ class UnreadNotificationsSerializer(serializers.ModelSerializer):
     Used for displaying the number of unread messages a user has.
     """
 
+    viewer_independent = True
+
     count = serializers.SerializerMethodField()
-    community_count = serializers.SerializerMethodField()
-    sales_count = serializers.SerializerMethodField()
+    community_count = serializers.IntegerField(source="unread_community_count")
+    sales_count = serializers.IntegerField(source="unread_sales_count")
 
     def get_count(self, obj):
-        from apps.lib.models import Notification
-
-        return (
-            Notification.objects.filter(user=obj, read=False)
-            .exclude(event__recalled=True)
-            .count()
-        )
-
-    def get_community_count(self, obj):
-        from apps.lib.models import Notification
-        from apps.lib.constants import ORDER_NOTIFICATION_TYPES
-        from apps.lib.constants import COMMENT
-
-        return (
-            Notification.objects.filter(user=obj, read=False)
-            .exclude(event__recalled=True)
-            .exclude(event__type__in=ORDER_NOTIFICATION_TYPES)
-            .exclude(event__type=COMMENT, event__content_type__in=order_comment_types())
-            .count()
-        )
-
-    def get_sales_count(self, obj):
-        from apps.lib.models import Notification
-        from apps.lib.constants import ORDER_NOTIFICATION_TYPES
-        from apps.lib.constants import COMMENT
-
-        Notification.objects.filter(
-            user=obj,
-            read=False,
-        ).exclude(event__recalled=True).filter(
-            Q(event__type__in=ORDER_NOTIFICATION_TYPES)
-            | Q(
-                event__type=COMMENT,
-                event__content_type__in=order_comment_types(),
-            )
-        ).count()
+        return obj.unread_community_count + obj.unread_sales_count
 
     class Meta:
         model = User
@@ -1238,6 +1212,8 @@ class SocialSettingsSerializer(serializers.ModelSerializer):
     Serializer for social settings.
     """
 
+    viewer_independent = True
+
     class Meta:
         model = SocialSettings
         fields = (
@@ -1280,6 +1256,8 @@ class SocialLinkSerializer(serializers.ModelSerializer):
     Serializer for social link
     """
 
+    viewer_independent = True
+
     class Meta:
         model = SocialLink
         fields = (
@@ -1,3 +1,5 @@
+import random
+
 from requests import HTTPError
 from rest_framework import status
 
@@ -70,15 +72,16 @@ def drip_tag(self, user_id):
         "custom_fields": {},
     }
     # Randomly pick from the user's characters without showcase submissions.
-    character = (
+    character_ids = list(
         Character.objects.filter(
             user=user,
             submissions__isnull=True,
             private=False,
-        )
-        .order_by("?")
-        .first()
+        ).values_list("id", flat=True)
     )
+    character = None
+    if character_ids:
+        character = Character.objects.get(id=random.choice(character_ids))
     if character:
         # These custom fields are defined within Drip's dashboard.
         # If they're not present, these calls might fail, or maybe this info will be
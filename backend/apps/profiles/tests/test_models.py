@@ -1,12 +1,13 @@
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 import apps.lib.constants
-from apps.lib.models import Event, Subscription
+from apps.lib.models import Event, Subscription, Tag
 from apps.lib.constants import COMMENT, DISPUTE
 from apps.lib.test_resources import EnsurePlansMixin
 from apps.lib.tests.test_utils import create_staffer
-from apps.profiles.models import Character
+from apps.profiles.models import Character, StaffPowers, Submission, User
 from apps.profiles.tests.factories import (
+    CharacterFactory,
     ConversationFactory,
     SubmissionFactory,
     UserFactory,
@@ -115,6 +116,49 @@ class TestCharacter(EnsurePlansMixin, TestCase):
         character.full_clean()
 
 
+class TestTagNames(EnsurePlansMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Tag.objects.bulk_create([Tag(name="stuff"), Tag(name="wat")])
+
+    def test_follows_tags(self):
+        submission = SubmissionFactory.create()
+        submission.tags.add("wat", "stuff")
+        submission.refresh_from_db()
+        self.assertEqual(submission.tag_names, ["stuff", "wat"])
+        submission.tags.remove("wat")
+        submission.refresh_from_db()
+        self.assertEqual(submission.tag_names, ["stuff"])
+        submission.tags.clear()
+        submission.refresh_from_db()
+        self.assertEqual(submission.tag_names, [])
+
+    def test_follows_tags_reverse(self):
+        character = CharacterFactory.create()
+        tag = Tag.objects.get(name="stuff")
+        tag.characters.add(character)
+        character.refresh_from_db()
+        self.assertEqual(character.tag_names, ["stuff"])
+        tag.characters.clear()
+        character.refresh_from_db()
+        self.assertEqual(character.tag_names, [])
+
+    def test_stale_save(self):
+        submission = SubmissionFactory.create()
+        Submission.objects.get(id=submission.id).tags.add("stuff")
+        submission.title = "Renamed"
+        submission.save()
+        submission.refresh_from_db()
+        self.assertEqual(submission.tag_names, ["stuff"])
+
+    def test_tag_deleted(self):
+        submission = SubmissionFactory.create()
+        submission.tags.add("stuff", "wat")
+        Tag.objects.filter(name="wat").delete()
+        submission.refresh_from_db()
+        self.assertEqual(submission.tag_names, ["stuff"])
+
+
 class TestConversation(EnsurePlansMixin, TestCase):
     def test_comment_removal(self):
         conversation = ConversationFactory.create()
@@ -122,3 +166,34 @@ class TestConversation(EnsurePlansMixin, TestCase):
         self.assertTrue(Event.objects.filter(type=COMMENT).exists())
         conversation.delete()
         self.assertFalse(Event.objects.filter(type=COMMENT).exists())
+
+
+@patch("apps.lib.consumers.invalidate_user_watch_permissions")
+class TestWatchPermissions(EnsurePlansMixin, TestCase):
+    def test_staff_powers_changed(self, mock_invalidate):
+        staffer = create_staffer("view_financials")
+        mock_invalidate.reset_mock()
+        powers = StaffPowers.objects.get(user=staffer)
+        powers.view_financials = False
+        powers.save()
+        mock_invalidate.assert_called_once_with(staffer.id)
+
+    def test_flags_changed(self, mock_invalidate):
+        user = UserFactory.create(is_staff=True)
+        mock_invalidate.reset_mock()
+        user.biography = "Unrelated"
+        user.save()
+        mock_invalidate.assert_not_called()
+        user = User.objects.get(id=user.id)
+        user.is_staff = False
+        user.save()
+        mock_invalidate.assert_called_once_with(user.id)
+
+    def test_block_list_cleared(self, mock_invalidate):
+        user = UserFactory.create()
+        other = UserFactory.create()
+        other.blocking.add(user)
+        mock_invalidate.reset_mock()
+        user.blocked_by.clear()
+        mock_invalidate.assert_any_call(other.id)
+        mock_invalidate.assert_any_call(user.id)
@@ -4,8 +4,14 @@ from uuid import UUID
 
 
 from apps.lib.abstract_models import ADULT, GENERAL
+from apps.lib.models import Tag
 from apps.lib.test_resources import APITestCase, EnsurePlansMixin
 from apps.lib.tests.factories_interdepend import CommentFactory
+from apps.profiles.content_filters import (
+    EMPTY_FILTER,
+    get_content_filter,
+    load_content_filter,
+)
 from apps.profiles.models import ArtconomyAnonymousUser
 from apps.profiles.tests.factories import (
     AvatarFactory,
@@ -39,7 +45,8 @@ from apps.sales.tests.factories import (
     TransactionRecordFactory,
 )
 from django.core.exceptions import ObjectDoesNotExist
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 from freezegun import freeze_time
 from moneyed import Money
 
@@ -266,3 +273,52 @@ class TestClearUser(EnsurePlansMixin, TestCase):
         self.assertEqual(user.watching.count(), 0)
         self.assertEqual(user.watched_by.count(), 0)
         self.assertEqual(user.subscription_set.count(), 0)
+
+
+class TestContentFilter(EnsurePlansMixin, TransactionTestCase):
+    @patch(
+        "apps.profiles.content_filters.load_content_filter",
+        wraps=load_content_filter,
+    )
+    def test_cached(self, mock_load):
+        user = UserFactory.create()
+        other = UserFactory.create()
+        user.blocking.add(other)
+        self.assertEqual(get_content_filter(user).blocking, (other.id,))
+        self.assertEqual(get_content_filter(user).blocking, (other.id,))
+        self.assertEqual(mock_load.call_count, 1)
+
+    def test_anonymous(self):
+        self.assertEqual(get_content_filter(ArtconomyAnonymousUser()), EMPTY_FILTER)
+
+    def test_block_changes(self):
+        user = UserFactory.create()
+        other = UserFactory.create()
+        self.assertEqual(get_content_filter(other).blocks, ())
+        user.blocking.add(other)
+        self.assertEqual(get_content_filter(user).blocking, (other.id,))
+        self.assertEqual(get_content_filter(other).blocked_by, (user.id,))
+        other.blocked_by.clear()
+        self.assertEqual(get_content_filter(user).blocks, ())
+        self.assertEqual(get_content_filter(other).blocks, ())
+
+    def test_blacklist_changes(self):
+        user = UserFactory.create()
+        Tag.objects.bulk_create([Tag(name="stuff"), Tag(name="wat")])
+        self.assertEqual(get_content_filter(user).blacklist, ())
+        user.blacklist.add("stuff")
+        user.nsfw_blacklist.add("wat")
+        content_filter = get_content_filter(user)
+        self.assertEqual(content_filter.blacklist, ("stuff",))
+        self.assertEqual(content_filter.nsfw_blacklist, ("wat",))
+        Tag.objects.get(name="wat").nsfw_blacklisting_users.clear()
+        self.assertEqual(get_content_filter(user).nsfw_blacklist, ())
+
+    def test_uncommitted_changes(self):
+        user = UserFactory.create()
+        other = UserFactory.create()
+        self.assertEqual(get_content_filter(user).blocks, ())
+        with transaction.atomic():
+            user.blocking.add(other)
+            self.assertEqual(get_content_filter(user).blocking, (other.id,))
+        self.assertEqual(get_content_filter(user).blocking, (other.id,))
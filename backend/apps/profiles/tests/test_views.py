@@ -843,6 +843,18 @@ class TestSubmissionSearch(APITestCase):
         self.assertIDInList(submission_nsfw, response.data["results"])
         self.assertEqual(len(response.data["results"]), 2)
 
+    def test_multiple_terms(self):
+        Tag.objects.bulk_create([Tag(name="stuff"), Tag(name="wat"), Tag(name="thing")])
+        both = SubmissionFactory.create()
+        both.tags.add("stuff", "wat")
+        SubmissionFactory.create().tags.add("stuff")
+        SubmissionFactory.create().tags.add("stuff", "wat", "thing")
+        response = self.client.get(
+            "/api/profiles/v1/search/submission/?q=Stuff wat !thing"
+        )
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertIDInList(both, response.data["results"])
+
 
 class TestCharacterSearch(APITestCase):
     def test_query_not_logged_in(self):
@@ -4,9 +4,11 @@ from django.db.models.functions import Collate
 
 from apps.lib.abstract_models import GENERAL
 from apps.lib.models import Comment
-from apps.lib.utils import destroy_comment
+from apps.lib.utils import delete_events, destroy_comment, tag_name_list
+from apps.profiles.content_filters import get_content_filter
 from apps.profiles.middleware import derive_session_settings
 from apps.profiles.models import (
+    ArtistTag,
     Character,
     Conversation,
     ConversationParticipant,
@@ -53,13 +55,24 @@ def char_ordering(qs, requester, query=""):
             When(name__iexact=query, then=0), default=1, output_field=IntegerField()
         ),
         tag_matches=Case(
-            When(tags__name__iexact=query, then=0),
+            When(tag_names__contains=[query.lower()], then=0),
             default=1,
             output_field=IntegerField(),
         ),
     ).order_by("matches", "mine", "tag_matches")
 
 
+def exclude_tags(qs: QuerySet, tags, **conditions) -> QuerySet:
+    """
+    Excludes anything tagged with any of the given tags, optionally only where the
+    other conditions also hold.
+    """
+    names = tag_name_list(tags)
+    if not names:
+        return qs
+    return qs.exclude(tag_names__overlap=names, **conditions)
+
+
 def available_chars(
     requester,
     query="",
@@ -75,12 +88,13 @@ def available_chars(
             or staff_power(requester, "view_as")
         )
     ) and requester.is_authenticated:
-        exclude |= Q(user__blocking=requester)
-        exclude |= Q(user__blocked_by=requester)
+        blocks = get_content_filter(requester).blocks
+        if blocks:
+            exclude |= Q(user_id__in=blocks)
     if commissions:
         exclude |= Q(open_requests=False)
     if query:
-        q = Q(name__istartswith=query) | Q(tags__name__iexact=query)
+        q = Q(name__istartswith=query) | Q(tag_names__contains=[query.lower()])
     else:
         q = Q()
     q = Character.objects.filter(q)
@@ -96,8 +110,9 @@ def available_chars(
         if not self_search:
             # Never make our blacklist exclude our own characters, lest we lose track of
             # them.
-            qs = qs.exclude(tags__in=requester.blacklist.all())
-            qs = qs.exclude(tags__in=requester.nsfw_blacklist.all(), nsfw=True)
+            content_filter = get_content_filter(requester)
+            qs = exclude_tags(qs, content_filter.blacklist)
+            qs = exclude_tags(qs, content_filter.nsfw_blacklist, nsfw=True)
 
     else:
         qs = q.exclude(exclude)
@@ -109,7 +124,7 @@ def available_chars(
 def available_artists(requester):
     qs = User.objects.filter(Q(id=requester.id) | Q(taggable=True), is_active=True)
     if not staff_power(requester, "administrate_users") and requester.is_authenticated:
-        qs = qs.exclude(blocking=requester)
+        qs = qs.exclude(id__in=get_content_filter(requester).blocked_by)
     return qs
 
 
@@ -121,24 +136,25 @@ def available_submissions(request, requester, show_all=False):
         not staff_power(request.user, "moderate_content")
         and request.user.is_authenticated
     ):
-        exclude |= Q(owner__blocking=requester)
-        exclude |= Q(owner__blocked_by=requester)
-        exclude |= Q(artists__blocking=requester)
-        exclude |= Q(artists__blocked_by=requester)
+        blocks = get_content_filter(requester).blocks
+        if blocks:
+            exclude |= Q(owner_id__in=blocks)
+            exclude |= Q(
+                id__in=ArtistTag.objects.filter(user_id__in=blocks).values(
+                    "submission_id"
+                )
+            )
     if request.user.is_authenticated and show_all:
         exclude &= ~(Q(owner=requester) | Q(shared_with=requester))
-    return (
-        Submission.objects.exclude(exclude)
-        .exclude(rating__gt=request.max_rating)
-        .exclude(tags__in=request.blacklist)
-        .exclude(rating__gt=GENERAL, tags__in=request.nsfw_blacklist)
-    )
+    qs = Submission.objects.exclude(exclude).exclude(rating__gt=request.max_rating)
+    qs = exclude_tags(qs, request.blacklist)
+    return exclude_tags(qs, request.nsfw_blacklist, rating__gt=GENERAL)
 
 
 def available_users(user):
     if staff_power(user, "administrate_users") or not user.is_authenticated:
         return User.objects.exclude(is_active=False)
-    return User.objects.exclude(id__in=user.blocked_by.all().values("id")).exclude(
+    return User.objects.exclude(id__in=get_content_filter(user).blocked_by).exclude(
         is_active=False
     )
 
@@ -262,7 +278,7 @@ def clear_user(user: User):
     for product in user.products.all():
         product.delete()
     # These can just be straight up cleared.
-    user.notifications.all().delete()
+    delete_events(user.notifications.all())
     user.username = f"__deleted{user.id}"
     user.set_password(str(uuid4()))
     user.email = f"{uuid4()}@local"
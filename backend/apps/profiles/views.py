@@ -60,10 +60,12 @@ from apps.lib.utils import (
     add_check,
     count_hit,
     demark,
+    mark_all_read,
     notify,
     preview_rating,
     recall_notification,
     order_comment_types,
+    unread_counts_kept,
 )
 from apps.lib.views import BasePreview, PositionShift
 from apps.profiles.models import (
@@ -148,6 +150,7 @@ from apps.profiles.utils import (
     char_ordering,
     clear_user,
     empty_user,
+    exclude_tags,
     user_query,
     available_users,
 )
@@ -230,7 +233,7 @@ class Register(CreateAPIView):
         instance = serializer.save(guest=False, guest_email="")
         instance.set_password(instance.password)
         # Guests may have historical comments to be concerned with.
-        instance.notification_set.all().update(read=True)
+        mark_all_read(instance)
         # noinspection SpellCheckingInspection
         instance.offered_mailchimp = True
         add_to_newsletter = serializer.validated_data.get("mail")
@@ -789,7 +792,7 @@ class CharacterSearch(ListAPIView):
             if tagging:
                 return char_ordering(base_query, user, query=query)
             return base_query.order_by("-created_on")
-        q = Q(name__istartswith=query) | Q(tags__name__iexact=query)
+        q = Q(name__istartswith=query) | Q(tag_names__contains=[query.lower()])
         if self.request.rating:
             nsfw_filter = Q()
         else:
@@ -866,18 +869,21 @@ class SubmissionSearch(ListAPIView):
         search_serializer = SearchQuerySerializer(data=self.request.GET)
         search_serializer.is_valid(raise_exception=True)
         qs = available_submissions(self.request, self.request.user)
-        query = self.request.GET.get("q", "")
-        query = query.split()
-        for q in query:
-            if q.startswith("!"):
-                qs = qs.exclude(tags__name__iexact=q[1:])
-            else:
-                qs = qs.filter(tags__name__iexact=q)
+        query = self.request.GET.get("q", "").lower().split()
+        included = [term for term in query if not term.startswith("!")]
+        excluded = [term[1:] for term in query if term.startswith("!")]
+        if included:
+            qs = qs.filter(tag_names__contains=included)
+        qs = exclude_tags(qs, excluded)
         if (
             search_serializer.validated_data.get("watch_list", False)
             and self.request.user.is_authenticated
         ):
-            qs = qs.filter(artists__in=self.request.user.watching.all())
+            qs = qs.filter(
+                id__in=ArtistTag.objects.filter(
+                    user__in=self.request.user.watching.all()
+                ).values("submission_id")
+            )
         if search_serializer.validated_data.get("content_ratings", False):
             qs = qs.filter(
                 rating__in=search_serializer.validated_data["content_ratings"]
@@ -896,7 +902,7 @@ class SubmissionSearch(ListAPIView):
                 .distinct("file")
             )
             qs = Submission.objects.filter(id__in=Subquery(qs.values("pk")))
-        return qs.order_by("-created_on").distinct()
+        return qs.order_by("-created_on")
 
     def get(self, *args, **kwargs):
         query = self.request.GET.get("q", "")
@@ -1300,6 +1306,15 @@ class MarkNotificationsRead(BulkUpdateAPIView):
         self.check_object_permissions(self.request, user)
         return queryset.filter(user=user)
 
+    def perform_bulk_update(self, serializer):
+        with unread_counts_kept(
+            Notification.objects.filter(
+                id__in=[item["id"] for item in serializer.validated_data],
+                user=self.get_object(),
+            )
+        ):
+            super().perform_bulk_update(serializer)
+
     def bulk_update(self, request, *args, **kwargs):
         result = super().bulk_update(request, *args, **kwargs)
         send_updated(self.get_object(), serializers=["UnreadNotificationsSerializer"])
@@ -1311,8 +1326,8 @@ class MarkNotificationsRead(BulkUpdateAPIView):
         """
         user = self.get_object()
         self.check_object_permissions(self.request, user)
-        Notification.objects.filter(user=user).update(read=True)
-        send_updated(user, serializers=["UnreadNotificationSerializer"])
+        mark_all_read(user)
+        send_updated(user, serializers=["UnreadNotificationsSerializer"])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -1,5 +1,4 @@
 from django.apps import AppConfig
-from django.core.cache import cache
 
 
 class SalesConfig(AppConfig):
@@ -10,6 +9,14 @@ class SalesConfig(AppConfig):
         # consumer.
         import apps.sales.serializers  # noqa: F401
 
+        from apps.lib.consumers import track_watch_permissions
+        from apps.sales.models import Order
+
+        # Orders aren't broadcast, so they aren't tracked by register_serializer.
+        track_watch_permissions(Order)
+
+        from apps.sales.line_item_funcs import clear_pricing_data
+
         # Clear out any existing pricing cache on startup so that if settings changed
         # we get the new values.
-        cache.delete("price_data")
+        clear_pricing_data()
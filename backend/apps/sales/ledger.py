@@ -0,0 +1,350 @@
+"""
+Running balances for the TransactionRecord ledger.
+
+Every saved TransactionRecord contributes its amount to the balance of its payee's
+destination account and removes it from its payer's source account. Rather than
+summing the whole ledger each time a balance is needed, changes in those
+contributions are added as LedgerBalance rows as records change. Nothing updates
+these rows in place, so payments never queue up behind a lock on a busy balance,
+like the platform's own accounts, and never deadlock on each other's balances.
+fold_ledger_balances periodically sums each balance's rows into one.
+
+LedgerCheckpoints freeze the balances of everything finalized before a point in time
+so that historical balances only need to aggregate the records since the nearest
+checkpoint.
+
+The original aggregate queries are kept in apps.sales.utils as
+aggregate_account_balance, and are used to verify these balances when
+settings.LEDGER_VERIFY_BALANCES is set, as well as by the reconcile_ledger command,
+which also runs nightly.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, QuerySet, Sum
+
+from apps.sales.constants import PENDING, SUCCESS
+from apps.sales.models import (
+    LedgerBalance,
+    LedgerCheckpoint,
+    LedgerCheckpointBalance,
+    TransactionRecord,
+)
+
+# Statuses which count toward any balance. Failed transactions never do.
+TRACKED_STATUSES = (SUCCESS, PENDING)
+
+# (user_id, account, status)
+LedgerKey = Tuple[Optional[int], int, int]
+LedgerTotals = Dict[LedgerKey, Decimal]
+
+
+class LedgerMismatchError(Exception):
+    """
+    Raised when verification finds that the running balances disagree with the
+    ledger itself.
+    """
+
+
+class LedgerState(NamedTuple):
+    payer_id: Optional[int]
+    payee_id: Optional[int]
+    source: int
+    destination: int
+    status: int
+    amount: Decimal
+    finalized_on: Optional[datetime]
+
+
+STATE_FIELDS = LedgerState._fields
+
+
+def record_state(record: TransactionRecord) -> LedgerState:
+    return LedgerState(
+        payer_id=record.payer_id,
+        payee_id=record.payee_id,
+        source=record.source,
+        destination=record.destination,
+        status=record.status,
+        amount=record.amount.amount,
+        finalized_on=record.finalized_on,
+    )
+
+
+def stored_state(record_id: str) -> Optional[LedgerState]:
+    """
+    Get the state of a record as it currently exists in the database, locking the
+    row so that concurrent changes can't be applied against the same old state.
+    """
+    row = (
+        TransactionRecord.objects.filter(id=record_id)
+        .select_for_update()
+        .order_by()
+        .values_list(*STATE_FIELDS)
+        .first()
+    )
+    if row is None:
+        return None
+    return LedgerState(*row)
+
+
+def contributions(state: Optional[LedgerState]) -> LedgerTotals:
+    totals = defaultdict(Decimal)
+    if state is None or state.status not in TRACKED_STATUSES:
+        return totals
+    totals[(state.payee_id, state.destination, state.status)] += state.amount
+    totals[(state.payer_id, state.source, state.status)] -= state.amount
+    return totals
+
+
+def invalidate_checkpoints(*states: Optional[LedgerState]):
+    """
+    Remove any checkpoints which would have included a record in one of these
+    states. They'll be rebuilt the next time checkpoints are created.
+    """
+    finalized = [
+        state.finalized_on
+        for state in states
+        if state is not None
+        and state.status in TRACKED_STATUSES
+        and state.finalized_on is not None
+    ]
+    if not finalized:
+        return
+    LedgerCheckpoint.objects.filter(as_of__gt=min(finalized)).delete()
+
+
+def apply_ledger_change(old: Optional[LedgerState], new: Optional[LedgerState]):
+    """
+    Move the running balances from reflecting a record in its old state to its new
+    one. Either state may be None, for creation and deletion.
+    """
+    apply_ledger_changes([(old, new)])
+
+
+def apply_ledger_changes(
+    changes: Iterable[Tuple[Optional[LedgerState], Optional[LedgerState]]],
+):
+    """
+    Batch version of apply_ledger_change, for records written in bulk, which skips
+    their save method. Each balance only gets one new row, however many of the
+    records touch it.
+    """
+    changes = [(old, new) for old, new in changes if old != new]
+    if not changes:
+        return
+    deltas = defaultdict(Decimal)
+    for old, new in changes:
+        for key, amount in contributions(new).items():
+            deltas[key] += amount
+        for key, amount in contributions(old).items():
+            deltas[key] -= amount
+    with transaction.atomic():
+        LedgerBalance.objects.bulk_create(
+            LedgerBalance(
+                user_id=user_id, account=account, status=status, amount=amount
+            )
+            for (user_id, account, status), amount in deltas.items()
+            if amount
+        )
+        invalidate_checkpoints(*(state for change in changes for state in change))
+
+
+def fold_ledger_balances():
+    """
+    Replace the rows of each balance which has more than one with a single row
+    holding their sum, so that reading a balance stays cheap.
+
+    Only the rows read here are locked and deleted. Rows added by transactions which
+    commit in the meantime are left for the next fold.
+    """
+    keys = (
+        LedgerBalance.objects.order_by()
+        .values("user_id", "account", "status")
+        .annotate(rows=Count("id"))
+        .filter(rows__gt=1)
+        .values_list("user_id", "account", "status")
+    )
+    query = Q()
+    for user_id, account, status in keys:
+        query |= Q(user_id=user_id, account=account, status=status)
+    if not query:
+        return
+    with transaction.atomic():
+        rows = list(
+            LedgerBalance.objects.filter(query)
+            .select_for_update()
+            .values_list("id", "user_id", "account", "status", "amount")
+        )
+        LedgerBalance.objects.filter(id__in=[row[0] for row in rows]).delete()
+        LedgerBalance.objects.bulk_create(
+            LedgerBalance(
+                user_id=user_id, account=account, status=status, amount=amount
+            )
+            for (user_id, account, status), amount in sum_totals(
+                row[1:] for row in rows
+            ).items()
+            if amount
+        )
+
+
+def ledger_totals(records: QuerySet) -> LedgerTotals:
+    """
+    Sum up the contributions of a set of records, by user, account, and status.
+    """
+    totals = defaultdict(Decimal)
+    records = records.filter(status__in=TRACKED_STATUSES).order_by()
+    for user_field, account_field, sign in (
+        ("payee_id", "destination", 1),
+        ("payer_id", "source", -1),
+    ):
+        grouped = (
+            records.values(user_field, account_field, "status")
+            .annotate(total=Sum("amount"))
+            .values_list(user_field, account_field, "status", "total")
+        )
+        for user_id, account, status, total in grouped:
+            totals[(user_id, account, status)] += sign * total
+    return totals
+
+
+def sum_totals(
+    rows: Iterable[Tuple[Optional[int], int, int, Decimal]],
+) -> LedgerTotals:
+    totals = defaultdict(Decimal)
+    for user_id, account, status, amount in rows:
+        totals[(user_id, account, status)] += amount
+    return totals
+
+
+def stored_totals() -> LedgerTotals:
+    return sum_totals(
+        LedgerBalance.objects.values_list("user_id", "account", "status", "amount")
+    )
+
+
+def checkpoint_totals(checkpoint: Optional[LedgerCheckpoint]) -> LedgerTotals:
+    if checkpoint is None:
+        return defaultdict(Decimal)
+    return sum_totals(
+        checkpoint.balances.values_list("user_id", "account", "status", "amount")
+    )
+
+
+def lock_ledger():
+    """
+    Block writes to the ledger until the end of the current transaction, so that
+    the balances being rebuilt can't miss a change made while they're calculated.
+    """
+    if connection.vendor != "postgresql":  # pragma: no cover
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"LOCK TABLE {TransactionRecord._meta.db_table} IN SHARE MODE",
+        )
+
+
+def rebuild_ledger_balances():
+    """
+    Recalculate all running balances from the ledger itself. Needed after
+    TransactionRecords are changed in ways which skip their save method, such as
+    queryset updates.
+    """
+    with transaction.atomic():
+        lock_ledger()
+        LedgerBalance.objects.all().delete()
+        LedgerBalance.objects.bulk_create(
+            LedgerBalance(
+                user_id=user_id, account=account, status=status, amount=amount
+            )
+            for (user_id, account, status), amount in ledger_totals(
+                TransactionRecord.objects.all()
+            ).items()
+            if amount
+        )
+        LedgerCheckpoint.objects.all().delete()
+
+
+def ledger_balance(
+    user_id: Optional[int], account: int, statuses: Iterable[int], all_users=False
+) -> Decimal:
+    """
+    Current balance of an account, read from the running balances.
+    """
+    balances = LedgerBalance.objects.filter(account=account, status__in=statuses)
+    if not all_users:
+        balances = balances.filter(user_id=user_id)
+    return Decimal(balances.aggregate(total=Sum("amount"))["total"] or "0.00")
+
+
+def nearest_checkpoint(as_of: datetime) -> Optional[LedgerCheckpoint]:
+    return LedgerCheckpoint.objects.filter(as_of__lte=as_of).order_by("-as_of").first()
+
+
+def balance_as_of(
+    user_id: Optional[int],
+    account: int,
+    statuses: Iterable[int],
+    as_of: datetime,
+    all_users=False,
+) -> Decimal:
+    """
+    Balance of an account counting only the records finalized before as_of. Reads
+    the nearest earlier checkpoint and adds the records finalized since.
+    """
+    statuses = list(statuses)
+    checkpoint = nearest_checkpoint(as_of)
+    base = Decimal("0.00")
+    records = TransactionRecord.objects.filter(
+        finalized_on__lt=as_of, status__in=statuses
+    )
+    if checkpoint is not None:
+        balances = checkpoint.balances.filter(account=account, status__in=statuses)
+        if not all_users:
+            balances = balances.filter(user_id=user_id)
+        base = balances.aggregate(total=Sum("amount"))["total"] or base
+        records = records.filter(finalized_on__gte=checkpoint.as_of)
+    if all_users:
+        credits = records.filter(destination=account)
+        debits = records.filter(source=account)
+    else:
+        credits = records.filter(destination=account, payee_id=user_id)
+        debits = records.filter(source=account, payer_id=user_id)
+    credit = credits.order_by().aggregate(total=Sum("amount"))["total"] or 0
+    debit = debits.order_by().aggregate(total=Sum("amount"))["total"] or 0
+    return Decimal(base + credit - debit)
+
+
+def create_ledger_checkpoint(as_of: datetime) -> LedgerCheckpoint:
+    """
+    Freeze the balances of all records finalized before as_of, building on the
+    nearest earlier checkpoint where there is one.
+    """
+    with transaction.atomic():
+        existing = LedgerCheckpoint.objects.filter(as_of=as_of).first()
+        if existing:
+            return existing
+        previous = LedgerCheckpoint.objects.filter(as_of__lt=as_of).first()
+        totals = checkpoint_totals(previous)
+        records = TransactionRecord.objects.filter(finalized_on__lt=as_of)
+        if previous is not None:
+            records = records.filter(finalized_on__gte=previous.as_of)
+        for key, amount in ledger_totals(records).items():
+            totals[key] += amount
+        checkpoint = LedgerCheckpoint.objects.create(as_of=as_of)
+        LedgerCheckpointBalance.objects.bulk_create(
+            LedgerCheckpointBalance(
+                checkpoint=checkpoint,
+                user_id=user_id,
+                account=account,
+                status=status,
+                amount=amount,
+            )
+            for (user_id, account, status), amount in totals.items()
+            if amount
+        )
+    return checkpoint
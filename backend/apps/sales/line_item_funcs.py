@@ -7,25 +7,59 @@ from decimal import (
     localcontext,
     ROUND_HALF_UP,
 )
-from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Union
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from uuid import uuid4
 
-from django.conf import settings
+from django.core.cache import cache
+from django.db.models import QuerySet
 from moneyed import Currency, Money, get_currency
 
 from line_items import (
-    py_get_totals,
-    py_reckon_lines,
+    PricingEngine,
+    py_get_totals_compact,
+    py_get_totals_many,
+    py_reckon_lines_compact,
+    py_reckon_many,
     py_divide_amount,
-    py_deliverable_lines,
-    py_tip_fee_lines,
 )
 
 if TYPE_CHECKING:  # pragma: no cover
-    from apps.sales.models import LineItem, LineItemSim
+    from apps.sales.models import Invoice, LineItem, LineItemSim
 
     Line = Union[LineItem, LineItemSim]
     LineMoneyMap = Dict[Line, Money]
 
+# The layout the calculator expects for compact line items. These are fed to it as
+# tuples built directly from model attributes or query results, which is much cheaper
+# than running them through a serializer first.
+COMPACT_LINE_FIELDS = (
+    "id",
+    "priority",
+    "type",
+    "amount",
+    "percentage",
+    "frozen_value",
+    "back_into_percentage",
+    "category",
+    "destination_account",
+    "destination_user_id",
+    "description",
+)
+
+CompactLine = Tuple[
+    int, int, int, str, str, Optional[str], bool, int, int, Optional[int], str
+]
+
 
 def down_context(wrapped: Callable):
     def wrapper(*args, **kwargs):
@@ -75,15 +109,68 @@ def lines_by_priority(
     return [priority_set for _, priority_set in sorted(priority_sets.items())]
 
 
+def amount_string(value) -> str:
+    """
+    Line amounts may be Money, Decimal, or (on simulated lines) strings. The calculator
+    wants strings.
+    """
+    if isinstance(value, Money):
+        value = value.amount
+    return str(value)
+
+
+def compact_row(row: tuple) -> "CompactLine":
+    """
+    Converts a row of values, ordered per COMPACT_LINE_FIELDS, into a compact line.
+    """
+    (
+        line_id,
+        priority,
+        line_type,
+        amount,
+        percentage,
+        frozen_value,
+        back_into_percentage,
+        category,
+        destination_account,
+        destination_user_id,
+        description,
+    ) = row
+    return (
+        line_id,
+        priority,
+        line_type,
+        amount_string(amount),
+        str(percentage),
+        None if frozen_value is None else amount_string(frozen_value),
+        back_into_percentage,
+        category,
+        destination_account,
+        destination_user_id,
+        description,
+    )
+
+
+def compact_line(line: "Line") -> "CompactLine":
+    return compact_row(tuple(getattr(line, field) for field in COMPACT_LINE_FIELDS))
+
+
+def compact_lines(lines: Iterable["Line"]) -> List["CompactLine"]:
+    """
+    Builds compact lines for the calculator. Querysets which haven't been evaluated yet
+    are read with values_list, so no model instances need to be built at all.
+    """
+    if isinstance(lines, QuerySet) and lines._result_cache is None:
+        return [compact_row(row) for row in lines.values_list(*COMPACT_LINE_FIELDS)]
+    return [compact_line(line) for line in lines]
+
+
 @down_context
 def get_totals(
     lines: Iterator["Line"], currency=get_currency("USD")
 ) -> (Money, Money, "LineMoneyMap"):
-    from apps.sales.serializers import LineItemCalculationSerializer
-
-    result = py_get_totals(
-        LineItemCalculationSerializer(many=True, instance=lines).data, digits(currency)
-    )
+    lines = list(lines)
+    result = py_get_totals_compact(compact_lines(lines), digits(currency))
     return (
         Money(result["total"], currency),
         Money(result["discount"], currency),
@@ -95,14 +182,84 @@ def reckon_lines(lines, currency=get_currency("USD")) -> Money:
     """
     Reckons all line items to produce a total value.
     """
-    from apps.sales.serializers import LineItemCalculationSerializer
-
-    result = py_reckon_lines(
-        LineItemCalculationSerializer(many=True, instance=lines).data, digits(currency)
-    )
+    result = py_reckon_lines_compact(compact_lines(lines), digits(currency))
     return Money(result, currency)
 
 
+def invoice_line_groups(
+    invoices: "QuerySet[Invoice]",
+) -> Tuple[Dict[str, Currency], Dict[str, List["LineItem"]]]:
+    """
+    Fetches the line items for a whole queryset of invoices in a single query. Returns
+    the currency of each invoice, and its line items, both keyed by invoice ID. Invoices
+    without line items are included with an empty list.
+    """
+    from apps.sales.models import LineItem
+
+    currencies = {
+        invoice_id: get_currency(currency)
+        for invoice_id, currency in invoices.order_by().values_list("id", "currency")
+    }
+    lines = {invoice_id: [] for invoice_id in currencies}
+    line_items = LineItem.objects.filter(
+        invoice__in=invoices.order_by().values("id"),
+    ).order_by("id")
+    for line in line_items:
+        if line.invoice_id in lines:
+            lines[line.invoice_id].append(line)
+    return currencies, lines
+
+
+def calculation_groups(
+    currencies: Dict[str, Currency], lines: Dict[str, List["LineItem"]]
+) -> Dict[int, Dict[str, list]]:
+    """
+    Builds grouped compact lines for the calculator. Since quantization is set per call,
+    the groups are further split by the number of digits in each invoice's currency.
+    """
+    groups = defaultdict(dict)
+    for invoice_id, currency in currencies.items():
+        groups[digits(currency)][invoice_id] = compact_lines(lines[invoice_id])
+    return groups
+
+
+@down_context
+def get_totals_many(
+    invoices: "QuerySet[Invoice]",
+) -> Dict[str, Tuple[Money, Money, "LineMoneyMap"]]:
+    """
+    Batch version of get_totals. Tabulates every invoice in the queryset, crossing into
+    the calculator once per currency quantization rather than once per invoice.
+    """
+    currencies, lines = invoice_line_groups(invoices)
+    results = {}
+    for quantization, groups in calculation_groups(currencies, lines).items():
+        for invoice_id, result in py_get_totals_many(groups, quantization).items():
+            currency = currencies[invoice_id]
+            results[invoice_id] = (
+                Money(result["total"], currency),
+                Money(result["discount"], currency),
+                {
+                    line: Money(result["subtotals"][line.id], currency)
+                    for line in lines[invoice_id]
+                },
+            )
+    return results
+
+
+def reckon_many(invoices: "QuerySet[Invoice]") -> Dict[str, Money]:
+    """
+    Batch version of reckon_lines. Returns the total of each invoice in the queryset,
+    keyed by invoice ID.
+    """
+    currencies, lines = invoice_line_groups(invoices)
+    results = {}
+    for quantization, groups in calculation_groups(currencies, lines).items():
+        for invoice_id, total in py_reckon_many(groups, quantization).items():
+            results[invoice_id] = Money(total, currencies[invoice_id])
+    return results
+
+
 def penny_amount(currency: Currency):
     if not digits(currency):
         return Money("1", currency)
@@ -121,16 +278,38 @@ def zero_amount(currency: Currency):
     )
 
 
-def tip_lines(*, international: bool):
+PRICING_VERSION_KEY = "price_data_version"
+
+# The engine this process last built, along with the pricing version it was built for.
+_pricing_engine: Optional[Tuple[str, PricingEngine]] = None
+
+
+def pricing_engine() -> PricingEngine:
+    """
+    Get this process's PricingEngine, which holds the parsed pricing spec so that it
+    isn't handed over to the calculator on every call. Clearing the pricing cache
+    changes the pricing version, which has every process rebuild its engine.
+    """
+    global _pricing_engine
     from apps.sales.utils import pricing_spec
 
-    return py_tip_fee_lines(
-        {
-            "pricing": pricing_spec(),
-            "international": international,
-            "quantization": digits(settings.PROCESSING_STATIC.currency),
-        }
-    )
+    version = cache.get_or_set(PRICING_VERSION_KEY, lambda: uuid4().hex)
+    if _pricing_engine is None or _pricing_engine[0] != version:
+        _pricing_engine = (version, PricingEngine(pricing_spec()))
+    return _pricing_engine[1]
+
+
+def clear_pricing_data():
+    """
+    Drop the cached pricing spec, and have every process rebuild its PricingEngine.
+    """
+    global _pricing_engine
+    cache.delete_many(["price_data", PRICING_VERSION_KEY])
+    _pricing_engine = None
+
+
+def tip_lines(*, international: bool):
+    return pricing_engine().tip_fee_lines(international)
 
 
 @down_context
@@ -165,22 +344,13 @@ def deliverable_lines(
     user_id: int,
     plan_name: str,
 ):
-    from apps.sales.serializers import LineItemCalculationSerializer
-    from apps.sales.utils import pricing_spec
-
-    return py_deliverable_lines(
-        {
-            "base_price": str(base_price.amount),
-            "table_product": table_product,
-            "escrow_enabled": escrow_enabled,
-            "international": international,
-            "user_id": user_id,
-            "extra_lines": LineItemCalculationSerializer(
-                many=True, instance=extra_lines
-            ).data,
-            "allow_soft_failure": False,
-            "pricing": pricing_spec(),
-            "plan_name": plan_name,
-            "quantization": digits(base_price.currency),
-        }
+    return pricing_engine().deliverable_lines(
+        base_price=str(base_price.amount),
+        table_product=table_product,
+        escrow_enabled=escrow_enabled,
+        international=international,
+        user_id=user_id,
+        plan_name=plan_name,
+        quantization=digits(base_price.currency),
+        extra_lines=compact_lines(extra_lines),
     )
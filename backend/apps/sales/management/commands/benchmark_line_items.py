@@ -0,0 +1,185 @@
+import json
+import statistics
+from decimal import Decimal
+from time import perf_counter
+from typing import Callable, List
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+from moneyed import Money, get_currency
+
+from apps.sales.constants import ADD_ON, BASE_PRICE, ESCROW, ESCROW_HOLD
+from apps.sales.line_item_funcs import (
+    compact_lines,
+    deliverable_lines,
+    digits,
+    get_totals,
+    pricing_engine,
+    reckon_lines,
+)
+from apps.sales.models import LineItem
+from line_items import py_get_totals_compact
+
+# How many lines share a priority tier on generated invoices.
+LINES_PER_TIER = 3
+
+
+def generated_lines(size: int) -> List[LineItem]:
+    """
+    Unsaved line items for an invoice of the given size. A base price is followed by
+    add-ons and percentage fees, with a new priority tier every few lines.
+    """
+    lines = [
+        LineItem(
+            id=1,
+            type=BASE_PRICE,
+            priority=0,
+            amount=Money("100.00", settings.DEFAULT_CURRENCY),
+            category=ESCROW_HOLD,
+            destination_account=ESCROW,
+            destination_user_id=1,
+        )
+    ]
+    for index in range(1, size):
+        percentage = not index % LINES_PER_TIER
+        lines.append(
+            LineItem(
+                id=index + 1,
+                type=ADD_ON,
+                priority=index // LINES_PER_TIER * 100,
+                amount=Money(
+                    "0.00" if percentage else "1.25", settings.DEFAULT_CURRENCY
+                ),
+                percentage=Decimal("0.5" if percentage else "0"),
+                category=ESCROW_HOLD,
+                destination_account=ESCROW,
+                destination_user_id=1,
+            )
+        )
+    return lines
+
+
+def time_calls(func: Callable, iterations: int) -> List[float]:
+    timings = []
+    for _ in range(iterations):
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+    return timings
+
+
+class Command(BaseCommand):
+    """
+    Times the line item functions end to end on generated invoices, including the
+    conversion of line items for the calculator, and writes the results as JSON.
+    calculator_get_totals times the calculator alone on lines converted beforehand,
+    so the difference from get_totals is the cost of the Python side.
+
+    Given the results of an earlier run as a baseline, exits with an error if any
+    median timing has grown by more than the tolerance.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[5, 50, 500])
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument(
+            "--plan",
+            default=settings.DEFAULT_SERVICE_PLAN_NAME,
+            help="Service plan to generate deliverable lines for.",
+        )
+        parser.add_argument("--output", help="Write the results to this file.")
+        parser.add_argument(
+            "--baseline", help="Results of an earlier run to compare against."
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed slowdown against the baseline, as a fraction.",
+        )
+
+    def cases(self, size: int, plan_name: str):
+        lines = generated_lines(size)
+        compacted = compact_lines(lines)
+        quantization = digits(get_currency(settings.DEFAULT_CURRENCY))
+        base_price = Money("25.00", settings.DEFAULT_CURRENCY)
+        # The base price is generated for deliverables, so only pass the add-ons.
+        extra_lines = lines[1:]
+        return {
+            "compact_lines": lambda: compact_lines(lines),
+            "calculator_get_totals": lambda: py_get_totals_compact(
+                compacted, quantization
+            ),
+            "get_totals": lambda: get_totals(lines),
+            "reckon_lines": lambda: reckon_lines(lines),
+            "deliverable_lines": lambda: deliverable_lines(
+                base_price=base_price,
+                table_product=False,
+                escrow_enabled=True,
+                international=False,
+                extra_lines=extra_lines,
+                user_id=1,
+                plan_name=plan_name,
+            ),
+        }
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 1:
+            raise CommandError("At least one iteration is required.")
+        # Build the engine ahead of time so that its setup isn't counted.
+        pricing_engine()
+        results = []
+        for size in options["sizes"]:
+            for name, func in self.cases(size, options["plan"]).items():
+                try:
+                    func()
+                except ValueError as err:
+                    raise CommandError(f"{name} failed for {size} line(s): {err}")
+                timings = time_calls(func, options["iterations"])
+                results.append(
+                    {
+                        "name": name,
+                        "lines": size,
+                        "iterations": options["iterations"],
+                        "min": min(timings),
+                        "median": statistics.median(timings),
+                        "mean": statistics.mean(timings),
+                        "stdev": statistics.pstdev(timings),
+                    }
+                )
+        report = {
+            "suite": "line_items",
+            "created_on": timezone.now().isoformat(),
+            "unit": "seconds",
+            "results": results,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["tolerance"])
+
+    def compare(self, results, baseline_path: str, tolerance: float):
+        with open(baseline_path) as baseline_file:
+            baseline = {
+                (entry["name"], entry["lines"]): entry
+                for entry in json.load(baseline_file)["results"]
+            }
+        regressions = []
+        for entry in results:
+            previous = baseline.get((entry["name"], entry["lines"]))
+            if previous is None:
+                continue
+            if entry["median"] > previous["median"] * (1 + tolerance):
+                regressions.append(
+                    f"{entry['name']} ({entry['lines']} lines): median "
+                    f"{entry['median']:.6f}s, baseline {previous['median']:.6f}s"
+                )
+        if regressions:
+            raise CommandError(
+                "Line item performance regressed:\n" + "\n".join(regressions)
+            )
@@ -16,6 +16,7 @@ from apps.sales.constants import (
     PAYOUT_ACCOUNT,
     PENDING,
 )
+from apps.sales.ledger import rebuild_ledger_balances
 from apps.sales.models import TransactionRecord, Invoice, LineItem
 from django.core.management import BaseCommand
 
@@ -83,3 +84,6 @@ class Command(BaseCommand):
             destination=PAYOUT_ACCOUNT,
             status=SUCCESS,
         ).update(finalized_on=F("created_on"))
+        # The updates above skip TransactionRecord.save, so the running balances
+        # won't have followed them.
+        rebuild_ledger_balances()
@@ -0,0 +1,63 @@
+from django.core.management import BaseCommand, CommandError
+
+from apps.sales.ledger import (
+    checkpoint_totals,
+    ledger_totals,
+    rebuild_ledger_balances,
+    stored_totals,
+)
+from apps.sales.models import LedgerCheckpoint, TransactionRecord
+
+
+def differences(stored, expected):
+    return sorted(
+        (
+            (key, stored.get(key, 0), expected.get(key, 0))
+            for key in set(stored) | set(expected)
+            if stored.get(key, 0) != expected.get(key, 0)
+        ),
+        key=lambda item: (item[0][0] or 0, *item[0][1:]),
+    )
+
+
+class Command(BaseCommand):
+    """
+    Checks the running ledger balances and checkpoints against a full aggregate of
+    the transaction records. Exits with an error if any disagree, unless asked to
+    rebuild them.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Rebuild the running balances from the ledger if they disagree.",
+        )
+
+    def handle(self, *args, **options):
+        mismatched = 0
+        for key, stored, expected in differences(
+            stored_totals(), ledger_totals(TransactionRecord.objects.all())
+        ):
+            mismatched += 1
+            self.stdout.write(
+                f"Balance {key} is recorded as {stored}, expected {expected}."
+            )
+        for checkpoint in LedgerCheckpoint.objects.all():
+            for key, stored, expected in differences(
+                checkpoint_totals(checkpoint),
+                ledger_totals(
+                    TransactionRecord.objects.filter(finalized_on__lt=checkpoint.as_of)
+                ),
+            ):
+                mismatched += 1
+                self.stdout.write(
+                    f"{checkpoint} has balance {key} recorded as {stored}, "
+                    f"expected {expected}."
+                )
+        if mismatched and options["repair"]:
+            rebuild_ledger_balances()
+            self.stdout.write("Rebuilt ledger balances.")
+        elif mismatched:
+            raise CommandError(f"{mismatched} ledger balance(s) were incorrect.")
+        self.stdout.write("Ledger reconciled.")
@@ -0,0 +1,57 @@
+from django.core.management import BaseCommand, CommandError
+
+from apps.sales.line_item_funcs import get_totals_many
+from apps.sales.models import (
+    INVOICE_TOTAL_FIELDS,
+    Invoice,
+    invoice_total_values,
+    store_invoice_totals,
+)
+
+
+class Command(BaseCommand):
+    """
+    Checks the cached totals stored on invoices against a fresh calculation of their
+    line items. Exits with an error if any disagree, unless asked to repair them.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Overwrite incorrect cached totals, and fill in missing ones.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        queryset = Invoice.objects.all()
+        if not options["repair"]:
+            queryset = queryset.filter(cached_total__isnull=False)
+        invoice_ids = list(queryset.order_by("id").values_list("id", flat=True))
+        batch_size = options["batch_size"]
+        mismatched = 0
+        for start in range(0, len(invoice_ids), batch_size):
+            batch = Invoice.objects.filter(
+                id__in=invoice_ids[start : start + batch_size]
+            )
+            results = get_totals_many(batch)
+            cached = batch.values_list("id", *INVOICE_TOTAL_FIELDS)
+            for invoice_id, *values in cached:
+                total, discount, _ = results[invoice_id]
+                expected = invoice_total_values(total, discount)
+                expected_values = [expected[field] for field in INVOICE_TOTAL_FIELDS]
+                if expected_values == values:
+                    continue
+                if values[0] is not None:
+                    mismatched += 1
+                    self.stdout.write(
+                        f"Invoice {invoice_id} has cached values {values}, "
+                        f"expected {expected_values}."
+                    )
+                if options["repair"]:
+                    # Tabulated again under lock, in case the line items have changed
+                    # since this batch was calculated.
+                    store_invoice_totals(invoice_id)
+        if mismatched and not options["repair"]:
+            raise CommandError(f"{mismatched} invoice(s) had incorrect cached totals.")
+        self.stdout.write(f"Checked {len(invoice_ids)} invoice(s).")
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sales", "0008_cascade_from"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="invoice",
+            name="cached_discount",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, default=None, max_digits=12, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="cached_subtotal",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, default=None, max_digits=12, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="cached_total",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, default=None, max_digits=12, null=True
+            ),
+        ),
+    ]
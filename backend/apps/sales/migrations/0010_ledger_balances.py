@@ -0,0 +1,181 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:00
+
+from collections import defaultdict
+from decimal import Decimal
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+ACCOUNT_CHOICES = [
+    (313, "Fund"),
+    (300, "Credit Card"),
+    (301, "Bank Account"),
+    (302, "Escrow"),
+    (303, "Finalized Earnings, available for withdraw"),
+    (500, "(Local Currency) Finalized Earnings, available for withdraw"),
+    (501, "(Local Currency) Bank Account"),
+    (304, "Contingency reserve"),
+    (306, "Card transaction fees"),
+    (307, "Other card fees"),
+    (407, "Cash deposit"),
+    (308, "ACH Transaction fees"),
+    (309, "Other ACH fees"),
+    (310, "Tax staging"),
+    (311, "Tax"),
+    (312, "Fraud loss"),
+]
+
+STATUS_CHOICES = [(0, "Successful"), (1, "Failed"), (2, "Pending")]
+
+
+def populate_balances(apps, schema):
+    TransactionRecord = apps.get_model("sales", "TransactionRecord")
+    LedgerBalance = apps.get_model("sales", "LedgerBalance")
+    totals = defaultdict(Decimal)
+    # Successful and pending records.
+    records = TransactionRecord.objects.filter(status__in=[0, 2]).order_by()
+    for user_field, account_field, sign in (
+        ("payee_id", "destination", 1),
+        ("payer_id", "source", -1),
+    ):
+        grouped = (
+            records.values(user_field, account_field, "status")
+            .annotate(total=Sum("amount"))
+            .values_list(user_field, account_field, "status", "total")
+        )
+        for user_id, account, status, total in grouped:
+            totals[(user_id, account, status)] += sign * total
+    LedgerBalance.objects.bulk_create(
+        LedgerBalance(user_id=user_id, account=account, status=status, amount=amount)
+        for (user_id, account, status), amount in totals.items()
+        if amount
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sales", "0009_invoice_cached_totals"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LedgerBalance",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("account", models.IntegerField(choices=ACCOUNT_CHOICES)),
+                ("status", models.IntegerField(choices=STATUS_CHOICES)),
+                (
+                    "amount",
+                    models.DecimalField(
+                        decimal_places=2, default=Decimal("0.00"), max_digits=14
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "account", "status"),
+                        name="unique_ledger_balance",
+                        nulls_distinct=False,
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="LedgerCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("as_of", models.DateTimeField(db_index=True, unique=True)),
+                (
+                    "created_on",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+            options={
+                "ordering": ("-as_of",),
+            },
+        ),
+        migrations.CreateModel(
+            name="LedgerCheckpointBalance",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("account", models.IntegerField(choices=ACCOUNT_CHOICES)),
+                ("status", models.IntegerField(choices=STATUS_CHOICES)),
+                (
+                    "amount",
+                    models.DecimalField(
+                        decimal_places=2, default=Decimal("0.00"), max_digits=14
+                    ),
+                ),
+                (
+                    "checkpoint",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="balances",
+                        to="sales.ledgercheckpoint",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("checkpoint", "user", "account", "status"),
+                        name="unique_ledger_checkpoint_balance",
+                        nulls_distinct=False,
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(
+            populate_balances,
+            reverse_code=lambda x, y: None,
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:00
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+from django.db.models import Value
+
+CONFIG = "english"
+
+
+def populate_search(apps, schema):
+    Product = apps.get_model("sales", "Product")
+    for product in (
+        Product.objects.select_related("user")
+        .prefetch_related("tags")
+        .only("id", "name", "description", "user__username")
+    ):
+        tags = " ".join(tag.name for tag in product.tags.all())
+        username = product.user.username
+        Product.objects.filter(id=product.id).update(
+            search_document=(
+                SearchVector(Value(product.name), weight="A", config=CONFIG)
+                + SearchVector(Value(f"{tags} {username}"), weight="B", config=CONFIG)
+                + SearchVector(Value(product.description), weight="C", config=CONFIG)
+            ),
+            search_text=f"{product.name} {tags} {username}".lower(),
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sales", "0010_ledger_balances"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name="product",
+            name="search_document",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="search_text",
+            field=models.TextField(default="", editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_document"], name="sales_product_search_doc"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_text"],
+                name="sales_product_search_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        migrations.RunPython(
+            populate_search,
+            reverse_code=lambda x, y: None,
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("sales", "0012_productsimilarity"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="ledgerbalance",
+            name="unique_ledger_balance",
+        ),
+        migrations.AddIndex(
+            model_name="ledgerbalance",
+            index=models.Index(
+                fields=["user", "account", "status"], name="sales_ledger_balance_key"
+            ),
+        ),
+    ]
@@ -1,7 +1,7 @@
+from collections import defaultdict
 from contextlib import contextmanager
 from dataclasses import dataclass
 from decimal import Decimal
-from django.core.cache import cache
 from math import ceil
 from typing import List, Union, Optional
 
@@ -19,6 +19,7 @@ from apps.lib.models import (
     Comment,
     Event,
     Subscription,
+    Tag,
     note_for_text,
     ref_for_instance,
 )
@@ -35,10 +36,12 @@ from apps.lib.constants import (
     PRODUCT_KILLED,
 )
 from apps.lib.permissions import Or, StaffPower
+from apps.lib.signals import broadcast_update, send_update
 from apps.lib.utils import (
     clear_events,
     clear_events_subscriptions_and_comments,
     clear_markers,
+    delete_events,
     demark,
     mark_modified,
     mark_read,
@@ -82,7 +85,12 @@ from apps.sales.constants import (
     ADD_ON,
 )
 from apps.profiles.constants import UNSET
-from apps.sales.line_item_funcs import reckon_lines, deliverable_lines
+from apps.sales.line_item_funcs import (
+    clear_pricing_data,
+    deliverable_lines,
+    get_totals,
+    reckon_lines,
+)
 from apps.sales.permissions import (
     OrderViewPermission,
     ReferenceViewPermission,
@@ -96,6 +104,7 @@ from apps.sales.utils import (
     lines_for_product,
     order_context,
     order_context_to_link,
+    refresh_product_search,
     set_service_plan,
     update_availability,
     mark_adult,
@@ -104,6 +113,8 @@ from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import IntegrityError, models, transaction
@@ -129,11 +140,18 @@ from django.db.models import (
     SlugField,
     Sum,
     TextField,
+    UniqueConstraint,
     URLField,
 )
 
 # Create your models here.
-from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.db.models.signals import (
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 from django.dispatch import receiver
 from django.utils import timezone
 from djmoney.models.fields import MoneyField, CurrencyField
@@ -273,6 +291,20 @@ class Product(ImageModel, HitsMixin):
     display_position = FloatField(
         db_index=True, default=get_next_product_position, unique=True
     )
+    # Maintained by refresh_product_search whenever the product's name, description,
+    # tags or seller's username change.
+    search_document = SearchVectorField(null=True, editable=False)
+    search_text = TextField(default="", editable=False)
+
+    class Meta(ImageModel.Meta):
+        indexes = [
+            GinIndex(fields=["search_document"], name="sales_product_search_doc"),
+            GinIndex(
+                fields=["search_text"],
+                name="sales_product_search_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ]
 
     @property
     def preview_link(self):
@@ -389,10 +421,13 @@ def auto_subscribe_product(sender, instance, created=False, **kwargs):
 @receiver(post_delete, sender=Product)
 @disable_on_load
 def auto_remove_product_notifications(sender, instance, **kwargs):
-    Event.objects.filter(data__product=instance.id).delete()
-    Event.objects.filter(
-        object_id=instance.id, content_type=ContentType.objects.get_for_model(instance)
-    ).delete()
+    delete_events(Event.objects.filter(data__product=instance.id))
+    delete_events(
+        Event.objects.filter(
+            object_id=instance.id,
+            content_type=ContentType.objects.get_for_model(instance),
+        )
+    )
 
 
 clear_product_events = receiver(post_save, sender=Product)(
@@ -401,6 +436,75 @@ clear_product_events = receiver(post_save, sender=Product)(
 product_thumbnailer = receiver(post_save, sender=Product)(thumbnail_hook)
 
 
+@receiver(post_save, sender=Product)
+@disable_on_load
+def update_product_search(
+    sender, instance, created=False, update_fields=None, **kwargs
+):
+    if created or update_fields is None or {"name", "description"} & update_fields:
+        refresh_product_search(Product.objects.filter(id=instance.id))
+
+
+@disable_on_load
+def product_tags_changed(sender, instance, action, pk_set, **kwargs):
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+    from apps.sales.recommendations import queue_similarity_refresh
+
+    if isinstance(instance, Product):
+        product_ids = [instance.id]
+    else:
+        # Changed from the tag's side.
+        product_ids = list(pk_set or [])
+    refresh_product_search(Product.objects.filter(id__in=product_ids))
+    queue_similarity_refresh(product_ids)
+
+
+models.signals.m2m_changed.connect(product_tags_changed, Product.tags.through)
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_products(sender, instance, **kwargs):
+    # The tag's links to products are gone by the time it's been deleted.
+    instance._product_ids = list(
+        Product.objects.filter(tags=instance).values_list("id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+def update_tagged_product_search(sender, instance, **kwargs):
+    from apps.sales.recommendations import queue_similarity_refresh
+
+    product_ids = getattr(instance, "_product_ids", [])
+    refresh_product_search(Product.objects.filter(id__in=product_ids))
+    queue_similarity_refresh(product_ids)
+
+
+@receiver(post_init, sender=User)
+def remember_username(sender, instance, **kwargs):
+    instance._search_username = instance.__dict__.get("username")
+
+
+@receiver(post_save, sender=User)
+@disable_on_load
+def update_seller_product_search(
+    sender, instance, created=False, update_fields=None, **kwargs
+):
+    previous = instance._search_username
+    username = instance.__dict__.get("username")
+    instance._search_username = username
+    if created or (update_fields is not None and "username" not in update_fields):
+        return
+    if username is None or username == previous:
+        return
+    # The username is always the last word of the search text.
+    refresh_product_search(
+        Product.objects.filter(user=instance).exclude(
+            search_text__endswith=f" {username.lower()}"
+        )
+    )
+
+
 @receiver(post_save, sender=Product)
 @disable_on_load
 def apply_inventory(sender, instance, **kwargs):
@@ -410,6 +514,27 @@ def apply_inventory(sender, instance, **kwargs):
         InventoryTracker.objects.filter(product=instance).delete()
 
 
+class ProductSimilarity(Model):
+    """
+    How closely one product resembles another, for recommendations. Only the closest
+    neighbors of each product are kept. Maintained by apps.sales.recommendations.
+    """
+
+    product = ForeignKey(Product, on_delete=CASCADE, related_name="similarities")
+    similar = ForeignKey(Product, on_delete=CASCADE, related_name="similar_to")
+    score = FloatField()
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["product", "similar"], name="unique_product_similarity"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["product", "-score"], name="sales_similar_score"),
+        ]
+
+
 class InventoryTracker(Model):
     product = models.OneToOneField(
         "Product", on_delete=CASCADE, related_name="inventory"
@@ -462,6 +587,8 @@ class Deliverable(Model):
         "DeliverableSerializer": [OrderViewPermission, LimboCheck],
         None: [OrderViewPermission, LimboCheck],
     }
+    # LimboCheck hides deliverables from their sellers depending on their status.
+    watch_permission_fields = ("status",)
     processor = models.CharField(
         choices=PROCESSOR_CHOICES,
         db_index=True,
@@ -789,9 +916,19 @@ class Order(Model):
         db_index=True, default=get_next_case_position, unique=True
     )
 
+    # Orders aren't watched themselves, but OrderViewPermission checks their
+    # deliverables and line items against these.
+    watch_permission_fields = ("buyer", "seller")
+
     def __str__(self):
         return f"#{self.id} by {self.seller} for {self.buyer}"
 
+    def watch_permission_dependents(self):
+        return [
+            *self.deliverables.all(),
+            *LineItem.objects.filter(invoice__deliverables__order=self),
+        ]
+
     def modified_kwargs(self, _data):
         return {"order": self}
 
@@ -866,19 +1003,41 @@ def delete(queryset):
         item.delete()
 
 
-# TODO: Lock invoice while we do this.
+def line_key(kind: int, category: int, account: int, user_id: Optional[int]):
+    """
+    Identifies a generated line item on a deliverable. There's only ever one generated
+    line of each kind going to each destination.
+    """
+    return kind, category, account, user_id
+
+
+@transaction.atomic
 def idempotent_lines(instance: Deliverable):
     """
-    This is the previous version of the idempotent lines function, currently shimmed
-    back in while we test revising its functionality via the rust functions.
+    Synchronizes the generated line items of a deliverable with what the line item
+    functions say they should be.
+
+    Works out the difference against the existing lines in memory and applies it
+    in bulk, so the number of queries doesn't grow with the number of lines. Bulk
+    operations skip signals, so broadcasts for changed lines are sent here, and
+    the invoice totals are refreshed at the end.
+
+    The invoice stays locked from reading the lines through storing the totals, so
+    that two syncs of the same deliverable can't both create the lines they each
+    find missing.
     """
     if instance.status not in [WAITING, NEW, PAYMENT_PENDING]:
         return
-    if instance.status == PAYMENT_PENDING and instance.invoice.paypal_token:
+    invoice = instance.invoice
+    if instance.status == PAYMENT_PENDING and invoice.paypal_token:
         # Line items are synced remotely.
         return
-    main_qs = instance.invoice.lines_for(instance)
-    extra_lines = list(main_qs.filter(type__in=[ADD_ON, EXTRA, BASE_PRICE]))
+    Invoice.objects.select_for_update().filter(id=invoice.id).first()
+    ref = ref_for_instance(instance)
+    existing = list(invoice.line_items.filter(targets=ref))
+    extra_lines = [
+        line for line in existing if line.type in [ADD_ON, EXTRA, BASE_PRICE]
+    ]
     if instance.product:
         base_price = instance.product.base_price
     else:
@@ -892,40 +1051,96 @@ def idempotent_lines(instance: Deliverable):
         international=instance.international,
         plan_name=instance.order.seller.service_plan.name,
     )
-    to_retain = []
-    for line in lines:
-        if line["id"] >= 0:
-            # Should be all the extra lines that we provided earlier.
-            # All the generated lines per spec have negative IDs.
-            to_retain.append(line["id"])
-            continue
-        db_line, created = main_qs.update_or_create(
-            defaults={
-                "percentage": line["percentage"],
-                "amount": Money(line["amount"], settings.DEFAULT_CURRENCY),
-                "priority": line["priority"],
-                "description": line["description"],
-                "back_into_percentage": line["back_into_percentage"],
+    # Should be all the extra lines that we provided earlier.
+    # All the generated lines per spec have negative IDs.
+    retained = {line["id"] for line in lines if line["id"] >= 0}
+    current = [line for line in existing if line.id in retained]
+    # Normally only one line per key, but any duplicates left over from before are
+    # deleted with the rest of the unclaimed lines.
+    unclaimed = defaultdict(list)
+    for line in existing:
+        if line.id not in retained:
+            unclaimed[
+                line_key(
+                    line.type,
+                    line.category,
+                    line.destination_account,
+                    line.destination_user_id,
+                )
+            ].append(line)
+    to_create = []
+    to_update = []
+    generated = [line for line in lines if line["id"] < 0]
+    for line in generated:
+        values = {
+            "percentage": Decimal(line["percentage"]),
+            "amount": Money(line["amount"], settings.DEFAULT_CURRENCY),
+            "priority": line["priority"],
+            "description": line["description"],
+            "back_into_percentage": line["back_into_percentage"],
+        }
+        candidates = unclaimed[
+            line_key(
+                line["kind"],
+                line["category"],
+                line["destination_account"],
+                line["destination_user_id"],
+            )
+        ]
+        db_line = candidates.pop() if candidates else None
+        if db_line is None:
+            db_line = LineItem(
+                type=line["kind"],
+                category=line["category"],
+                destination_account=line["destination_account"],
+                destination_user_id=line["destination_user_id"],
+                invoice=invoice,
                 # These fields no longer used but not yet removed from the DB.
-                "cascade_under": 201,
-                "cascade_amount": False,
-                "cascade_percentage": False,
-            },
-            type=line["kind"],
-            category=line["category"],
-            destination_account=line["destination_account"],
-            destination_user_id=line["destination_user_id"],
-            invoice=instance.invoice,
+                cascade_under=201,
+                cascade_amount=False,
+                cascade_percentage=False,
+                **values,
+            )
+            to_create.append(db_line)
+        elif any(getattr(db_line, key) != value for key, value in values.items()):
+            for key, value in values.items():
+                setattr(db_line, key, value)
+            to_update.append(db_line)
+        current.append(db_line)
+    if to_create:
+        LineItem.objects.bulk_create(to_create)
+        LineItemAnnotation.objects.bulk_create(
+            LineItemAnnotation(target=ref, line_item=db_line) for db_line in to_create
         )
-        db_line.annotate(instance)
-        to_retain.append(db_line.id)
-    main_qs.exclude(id__in=to_retain).delete()
-    if instance.status == PAYMENT_PENDING and instance.invoice.status == DRAFT:
-        instance.invoice.status = OPEN
-    total = reckon_lines(main_qs.filter(priority__lt=PRIORITY_MAP[SHIELD]))
+    if to_update:
+        LineItem.objects.bulk_update(
+            to_update,
+            [
+                "percentage",
+                "amount",
+                "amount_currency",
+                "priority",
+                "description",
+                "back_into_percentage",
+            ],
+        )
+    leftover = [db_line.id for group in unclaimed.values() for db_line in group]
+    if leftover:
+        LineItem.objects.filter(id__in=leftover).delete()
+    for db_line in to_create:
+        send_update.send(sender=LineItem, instance=db_line, pk=db_line.pk, created=True)
+    for db_line in to_update:
+        broadcast_update(db_line)
+    if instance.status == PAYMENT_PENDING and invoice.status == DRAFT:
+        invoice.status = OPEN
+    total = reckon_lines(
+        [db_line for db_line in current if db_line.priority < PRIORITY_MAP[SHIELD]]
+    )
     escrow_enabled = instance.escrow_enabled and total
-    instance.invoice.record_only = not instance.table_order and not escrow_enabled
-    instance.invoice.save()
+    invoice.record_only = not instance.table_order and not escrow_enabled
+    invoice.save()
+    # We've just changed the lines, and the invoice total is about to be shown.
+    invoice.update_totals()
 
 
 @receiver(pre_save, sender=Deliverable)
@@ -1249,9 +1464,87 @@ class TransactionRecord(Model):
         return base_string + f" and {count} other(s)."
 
     def save(self, *args, **kwargs):
+        from apps.sales.ledger import apply_ledger_change, record_state, stored_state
+
         if (self.status in [SUCCESS, FAILURE]) and (self.finalized_on is None):
             self.finalized_on = timezone.now()
-        return super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = stored_state(self.id)
+            result = super().save(*args, **kwargs)
+            apply_ledger_change(previous, record_state(self))
+        return result
+
+
+@receiver(pre_delete, sender=TransactionRecord)
+@disable_on_load
+def remove_ledger_contribution(sender, instance: TransactionRecord, **kwargs):
+    from apps.sales.ledger import apply_ledger_change, stored_state
+
+    apply_ledger_change(stored_state(instance.id), None)
+
+
+class LedgerBalance(Model):
+    """
+    Part of the running total of one user's account for transactions in one status.
+    Changes to TransactionRecords add rows here rather than updating one row per
+    total, so that concurrent payments never wait on each other's locks. A total is
+    the sum of its rows, and the rows are periodically folded together.
+    """
+
+    user = ForeignKey(User, null=True, blank=True, related_name="+", on_delete=CASCADE)
+    account = IntegerField(choices=ACCOUNT_TYPES)
+    status = IntegerField(choices=TRANSACTION_STATUSES)
+    amount = DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "account", "status"], name="sales_ledger_balance_key"
+            ),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.user or '(Artconomy)'} [{self.get_account_display()}, "
+            f"{self.get_status_display()}]: {self.amount}"
+        )
+
+
+class LedgerCheckpoint(Model):
+    """
+    Frozen balances for all transactions finalized before a point in time. Used
+    as a starting point for 'as of' balance queries.
+    """
+
+    as_of = DateTimeField(unique=True, db_index=True)
+    created_on = DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ("-as_of",)
+
+    def __str__(self):
+        return f"Ledger checkpoint as of {self.as_of}"
+
+
+class LedgerCheckpointBalance(Model):
+    checkpoint = ForeignKey(
+        LedgerCheckpoint, related_name="balances", on_delete=CASCADE
+    )
+    user = ForeignKey(User, null=True, blank=True, related_name="+", on_delete=CASCADE)
+    account = IntegerField(choices=ACCOUNT_TYPES)
+    status = IntegerField(choices=TRANSACTION_STATUSES)
+    amount = DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["checkpoint", "user", "account", "status"],
+                nulls_distinct=False,
+                name="unique_ledger_checkpoint_balance",
+            ),
+        ]
 
 
 class Invoice(models.Model):
@@ -1263,6 +1556,8 @@ class Invoice(models.Model):
         ],
         None: [Or(ObjectControls, StaffPower("view_financials"), BillTo, IssuedBy)],
     }
+    # Line items are checked against these too.
+    watch_permission_fields = ("bill_to", "issued_by")
     type = models.IntegerField(default=SALE, choices=INVOICE_TYPES)
     bill_to = models.ForeignKey(
         User, null=True, on_delete=CASCADE, related_name="invoices_billed_to"
@@ -1310,9 +1605,81 @@ class Invoice(models.Model):
     targets = ManyToManyField(
         to="lib.GenericReference", related_name="referencing_invoices", blank=True
     )
+    # Results of tabulating the line items, in the invoice's currency. These are stored
+    # by the transaction which saves or deletes a line item on this invoice, while it
+    # holds a lock on the invoice. Subtotal is the total before discounts. They are
+    # never written by a plain save(), so that an instance loaded before its line items
+    # changed can't restore stale values. Check them with verify_invoice_totals.
+    cached_total = DecimalField(
+        max_digits=12, decimal_places=2, null=True, blank=True, default=None
+    )
+    cached_discount = DecimalField(
+        max_digits=12, decimal_places=2, null=True, blank=True, default=None
+    )
+    cached_subtotal = DecimalField(
+        max_digits=12, decimal_places=2, null=True, blank=True, default=None
+    )
+
+    def watch_permission_dependents(self):
+        return self.line_items.all()
 
     def total(self) -> Money:
-        return reckon_lines(self.line_items.all(), currency=get_currency(self.currency))
+        if self.cached_total is None:
+            self.fill_totals()
+        return Money(self.cached_total, self.currency)
+
+    def discount(self) -> Money:
+        if self.cached_discount is None:
+            self.fill_totals()
+        return Money(self.cached_discount, self.currency)
+
+    def subtotal(self) -> Money:
+        if self.cached_subtotal is None:
+            self.fill_totals()
+        return Money(self.cached_subtotal, self.currency)
+
+    def tabulate(self) -> dict:
+        """
+        Freshly calculates the values for the cached total fields.
+        """
+        total, discount, _ = get_totals(
+            self.line_items.all(), currency=get_currency(self.currency)
+        )
+        return invoice_total_values(total, discount)
+
+    def fill_totals(self):
+        """
+        Calculates totals which haven't been stored, on this instance only. Storing them
+        is left to the transactions which change the line items, since a reader can't
+        tell whether its calculation is already out of date.
+        """
+        for key, value in self.tabulate().items():
+            setattr(self, key, value)
+
+    def update_totals(self):
+        """
+        Recalculates the cached totals and stores them. Call this within the transaction
+        which changed the line items, after changing them.
+        """
+        if self._state.adding:
+            self.fill_totals()
+            return
+        for key, value in store_invoice_totals(self.id).items():
+            setattr(self, key, value)
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and not kwargs.get("force_insert")
+            and kwargs.get("update_fields") is None
+        ):
+            excluded = {*INVOICE_TOTAL_FIELDS, *self.get_deferred_fields()}
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in excluded
+            ]
+        return super().save(*args, **kwargs)
 
     def context_for(self, target):
         # Provided for compatibility in post_payment hook. We might eventually allow for
@@ -1339,6 +1706,48 @@ class Invoice(models.Model):
         ordering = ("-created_on",)
 
 
+INVOICE_TOTAL_FIELDS = ("cached_total", "cached_discount", "cached_subtotal")
+
+
+def invoice_total_values(total: Money, discount: Money) -> dict:
+    """
+    Values for an invoice's cached total fields, given the results of a calculation.
+    """
+    return {
+        "cached_total": total.amount,
+        "cached_discount": discount.amount,
+        "cached_subtotal": (total - discount).amount,
+    }
+
+
+@transaction.atomic
+def store_invoice_totals(invoice_id: str) -> dict:
+    """
+    Tabulates an invoice's line items and stores the results in its cached total
+    fields.
+
+    The invoice is locked before the line items are read. Another transaction changing
+    the line items waits for this one to commit before tabulating, and so includes its
+    changes, rather than both storing results which each miss the other's lines.
+    """
+    currency = (
+        Invoice.objects.select_for_update()
+        .filter(id=invoice_id)
+        .values_list("currency", flat=True)
+        .first()
+    )
+    if currency is None:
+        # The invoice is being deleted along with its line items.
+        return {}
+    total, discount, _ = get_totals(
+        LineItem.objects.filter(invoice_id=invoice_id),
+        currency=get_currency(currency),
+    )
+    values = invoice_total_values(total, discount)
+    Invoice.objects.filter(id=invoice_id).update(**values)
+    return values
+
+
 class LineItemAnnotation(models.Model):
     """
     Annotation for a line item on an invoice. Useful to trigger post-payment effects.
@@ -1434,6 +1843,20 @@ class LineItem(Model):
         super().save(*args, **kwargs)
 
 
+@receiver(post_save, sender=LineItem)
+@receiver(post_delete, sender=LineItem)
+@disable_on_load
+def refresh_invoice_totals(sender, instance: LineItem, **kwargs):
+    if instance.invoice_id is None:
+        return
+    if LineItem.invoice.is_cached(instance) and instance.invoice is not None:
+        # Update the values on the instance we have in memory, too, since it may
+        # be used again further along.
+        instance.invoice.update_totals()
+        return
+    store_invoice_totals(instance.invoice_id)
+
+
 @dataclass(frozen=True)
 class LineItemSim:
     id: int
@@ -1655,7 +2078,9 @@ revision_comment_receiver = receiver(post_save, sender=Revision)(auto_subscribe_
 @disable_on_load
 def delete_comments_and_events(sender, instance, **kwargs):
     content_type = ContentType.objects.get_for_model(instance)
-    Event.objects.filter(object_id=instance.id, content_type=content_type).delete()
+    delete_events(
+        Event.objects.filter(object_id=instance.id, content_type=content_type)
+    )
     Subscription.objects.filter(
         object_id=instance.id, content_type=content_type
     ).delete()
@@ -1663,7 +2088,7 @@ def delete_comments_and_events(sender, instance, **kwargs):
     Comment.objects.filter(
         top_object_id=instance.id, top_content_type=content_type
     ).delete()
-    Event.objects.filter(data__reference=instance.id).delete()
+    delete_events(Event.objects.filter(data__reference=instance.id))
 
 
 class BankAccount(Model):
@@ -1839,7 +2264,7 @@ class ServicePlan(models.Model):
 
 @receiver(post_save, sender=ServicePlan)
 def clear_pricing_cache(instance, *args, **kwargs):
-    cache.delete("price_data")
+    clear_pricing_data()
 
 
 class StripeLocation(models.Model):
@@ -0,0 +1,241 @@
+"""
+Precomputes which products most resemble each other, for product recommendations.
+
+Products are scored against each other by the Jaccard similarity of their tags, with
+a bonus for sharing an artist and for the other product's artist being highly rated.
+Only products sharing at least one tag are considered, and only the closest
+PRODUCT_SIMILARITY_NEIGHBORS of each product are kept. Neighbors are limited to the
+products available_products would list, so that the viewer's own filters are all
+that's left to apply.
+
+Everything is recomputed in a nightly batch, which also picks up changes in which
+products are available. When a product's tags change, its own neighbors are
+recomputed, and its place among the neighbors of every product sharing a tag with it
+is updated. Rows are upserted, since these updates can overlap with each other and
+with the batch.
+"""
+
+import heapq
+from collections import defaultdict
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from apps.lib.utils import advisory_lock
+from django.conf import settings
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Window
+from django.db.models.functions import RowNumber
+
+if TYPE_CHECKING:  # pragma: no cover
+    from apps.sales.models import ProductSimilarity
+
+
+class Candidate(NamedTuple):
+    id: int
+    user_id: int
+    stars: float
+    tags: FrozenSet[str]
+    # Whether the product can be listed as another's neighbor.
+    recommendable: bool
+
+
+def similarity_score(candidate: Candidate, other: Candidate) -> float:
+    shared = len(candidate.tags & other.tags)
+    score = shared / (len(candidate.tags) + len(other.tags) - shared)
+    if candidate.user_id == other.user_id:
+        score += settings.PRODUCT_SIMILARITY_SAME_ARTIST_WEIGHT
+    return score + settings.PRODUCT_SIMILARITY_STARS_WEIGHT * other.stars / 5
+
+
+def load_candidates(product_ids: Optional[Iterable[int]] = None) -> List[Candidate]:
+    """
+    Loads the products which can have neighbors, with their tags and whether they
+    can be recommended themselves. Limited to the given products if any.
+    """
+    from apps.profiles.models import ArtconomyAnonymousUser
+    from apps.sales.models import Product
+    from apps.sales.utils import available_products
+
+    listed = available_products(ArtconomyAnonymousUser(), ordering=False)
+    qs = Product.objects.filter(active=True, table_product=False)
+    if product_ids is not None:
+        qs = qs.filter(id__in=product_ids)
+    rows = qs.annotate(
+        tag_list=ArraySubquery(
+            Product.tags.through.objects.filter(product_id=OuterRef("id")).values(
+                "tag_id"
+            )
+        ),
+        recommendable=Exists(listed.filter(id=OuterRef("id"))),
+    ).values_list("id", "user_id", "user__stars", "tag_list", "recommendable")
+    return [
+        Candidate(product_id, user_id, float(stars or 0), frozenset(tags), shown)
+        for product_id, user_id, stars, tags, shown in rows
+        if tags
+    ]
+
+
+def nearest(
+    candidate: Candidate,
+    by_tag: Dict[str, List[Candidate]],
+) -> List[Tuple[float, int]]:
+    """
+    The closest neighbors of a product among those indexed by tag, as (score, ID)
+    pairs, closest first.
+    """
+    others = {}
+    for tag in candidate.tags:
+        for other in by_tag.get(tag, []):
+            if other.id != candidate.id:
+                others[other.id] = other
+    return heapq.nlargest(
+        settings.PRODUCT_SIMILARITY_NEIGHBORS,
+        ((similarity_score(candidate, other), other.id) for other in others.values()),
+    )
+
+
+def index_by_tag(candidates: Iterable[Candidate]) -> Dict[str, List[Candidate]]:
+    """
+    Indexes the candidates which can be recommended by their tags.
+    """
+    by_tag = defaultdict(list)
+    for candidate in candidates:
+        if not candidate.recommendable:
+            continue
+        for tag in candidate.tags:
+            by_tag[tag].append(candidate)
+    return by_tag
+
+
+def save_similarities(rows: List["ProductSimilarity"]):
+    """
+    Inserts similarity rows, updating the scores of any which already exist. Sorted so
+    that overlapping writers lock rows in the same order.
+    """
+    from apps.sales.models import ProductSimilarity
+
+    ProductSimilarity.objects.bulk_create(
+        sorted(rows, key=lambda row: (row.product_id, row.similar_id)),
+        update_conflicts=True,
+        unique_fields=["product", "similar"],
+        update_fields=["score"],
+    )
+
+
+def compute_similarities():
+    """
+    Recomputes the neighbors of every product.
+    """
+    from apps.sales.models import ProductSimilarity
+
+    candidates = load_candidates()
+    by_tag = index_by_tag(candidates)
+    batch_size = settings.PRODUCT_SIMILARITY_BATCH_SIZE
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start : start + batch_size]
+        rows = [
+            ProductSimilarity(product_id=candidate.id, similar_id=other_id, score=score)
+            for candidate in batch
+            for score, other_id in nearest(candidate, by_tag)
+        ]
+        with transaction.atomic():
+            ProductSimilarity.objects.filter(
+                product_id__in=[candidate.id for candidate in batch]
+            ).delete()
+            save_similarities(rows)
+    # Products which can no longer be recommended, or have lost all their tags.
+    ProductSimilarity.objects.filter(
+        Q(product__active=False)
+        | Q(product__table_product=True)
+        | Q(product__tags__isnull=True)
+    ).delete()
+
+
+def trim_neighbors(product_ids: Iterable[int]):
+    """
+    Drops all but the closest neighbors of these products.
+    """
+    from apps.sales.models import ProductSimilarity
+
+    ranked = ProductSimilarity.objects.filter(product_id__in=product_ids).annotate(
+        rank=Window(
+            RowNumber(),
+            partition_by=F("product_id"),
+            order_by=[F("score").desc(), F("similar_id")],
+        )
+    )
+    ProductSimilarity.objects.filter(
+        id__in=ranked.filter(rank__gt=settings.PRODUCT_SIMILARITY_NEIGHBORS).values(
+            "id"
+        )
+    ).delete()
+
+
+@transaction.atomic
+def refresh_similarities(product_id: int):
+    """
+    Updates the neighbors of a product whose tags have changed, and its place among
+    the neighbors of others.
+    """
+    from apps.sales.models import Product, ProductSimilarity
+
+    # Refreshes for the same product queued close together would otherwise redo
+    # each other's work at the same time.
+    advisory_lock(f"product_similarity__{product_id}")
+    ProductSimilarity.objects.filter(product_id=product_id).delete()
+    ProductSimilarity.objects.filter(similar_id=product_id).delete()
+    found = load_candidates([product_id])
+    if not found:
+        return
+    (candidate,) = found
+    others = load_candidates(
+        Product.tags.through.objects.filter(tag_id__in=candidate.tags)
+        .exclude(product_id=product_id)
+        .values("product_id")
+    )
+    rows = [
+        ProductSimilarity(product_id=product_id, similar_id=other_id, score=score)
+        for score, other_id in nearest(candidate, index_by_tag(others))
+    ]
+    if candidate.recommendable:
+        rows += [
+            ProductSimilarity(
+                product_id=other.id,
+                similar_id=product_id,
+                score=similarity_score(other, candidate),
+            )
+            for other in others
+        ]
+    save_similarities(rows)
+    trim_neighbors([other.id for other in others])
+
+
+def queue_similarity_refresh(product_ids: Iterable[int]):
+    """
+    Refreshes the neighbors of these products in Celery once the current transaction
+    commits.
+    """
+    from apps.sales.tasks import refresh_product_similarities
+
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return
+
+    def dispatch():
+        for product_id in product_ids:
+            refresh_product_similarities.delay(product_id)
+
+    if settings.CELERY_ALWAYS_EAGER:
+        # Only set in tests, where commit hooks never run.
+        dispatch()
+        return
+    transaction.on_commit(dispatch)
@@ -0,0 +1,154 @@
+"""
+Draws random selections for the front page feeds without sorting whole tables at
+random on every request.
+
+Each feed has a pool of eligible IDs, drawn at random from everything it could show
+when the pool is refreshed, and cached. Pools are refreshed periodically, or as soon
+as they're needed if missing. Each request then samples a page's worth of IDs from
+the pool, and runs the feed's usual query limited to them, so viewer filters still
+apply and items which have stopped being eligible since the refresh drop out.
+"""
+
+import random
+from decimal import Decimal
+from typing import Callable, Dict, List
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core.cache import cache
+from django.db.models import (
+    BigIntegerField,
+    Count,
+    F,
+    Func,
+    IntegerField,
+    Q,
+    QuerySet,
+    Value,
+)
+
+from apps.profiles.models import ArtconomyAnonymousUser, User
+from apps.sales.constants import COMPLETED
+from apps.sales.utils import available_products
+
+SAMPLING_POOL_PREFIX = "sampling_pool"
+
+
+def featured_products(qs: QuerySet) -> QuerySet:
+    return qs.filter(Q(featured=True) | Q(user__featured=True))
+
+
+def low_price_products(qs: QuerySet) -> QuerySet:
+    return qs.filter(starting_price__lte=Decimal("30")).exclude(featured=True)
+
+
+def highly_rated_products(qs: QuerySet) -> QuerySet:
+    return qs.filter(user__stars__gte=4.5).exclude(featured=True)
+
+
+def lgbt_products(qs: QuerySet) -> QuerySet:
+    return qs.filter(user__artist_profile__lgbt=True)
+
+
+def artists_of_color_products(qs: QuerySet) -> QuerySet:
+    return qs.filter(user__artist_profile__artist_of_color=True)
+
+
+def new_artist_products(qs: QuerySet) -> QuerySet:
+    from apps.sales.models import Product
+
+    # Can't directly filter on the annotation in this QS because the ORM breaks
+    # grouping.
+    return qs.filter(
+        id__in=Product.objects.all()
+        .annotate(
+            completed_orders=Count(
+                "user__sales",
+                filter=Q(user__sales__deliverables__status=COMPLETED),
+            )
+        )
+        .filter(completed_orders=0)
+        .values("id")
+    )
+
+
+def random_products(qs: QuerySet) -> QuerySet:
+    return qs.filter(featured=False)
+
+
+PRODUCT_FEEDS: Dict[str, Callable[[QuerySet], QuerySet]] = {
+    "featured": featured_products,
+    "low_price": low_price_products,
+    "highly_rated": highly_rated_products,
+    "lgbt": lgbt_products,
+    "artists_of_color": artists_of_color_products,
+    "new_artists": new_artist_products,
+    "random": random_products,
+}
+
+TOP_SELLERS = "top_sellers"
+
+
+def pool_key(name: str) -> str:
+    return f"{SAMPLING_POOL_PREFIX}.{name}"
+
+
+def pool_queryset(name: str) -> QuerySet:
+    """
+    Everything a feed could show to anyone.
+    """
+    if name == TOP_SELLERS:
+        return User.objects.filter(featured=True)
+    return PRODUCT_FEEDS[name](
+        available_products(ArtconomyAnonymousUser(), ordering=False)
+    )
+
+
+def build_pool(name: str) -> List[int]:
+    # Sorting at random is fine here, since it's done once per refresh rather than
+    # once per request.
+    return list(
+        pool_queryset(name)
+        .order_by("?")
+        .values_list("id", flat=True)[: settings.SAMPLING_POOL_SIZE]
+    )
+
+
+def refresh_pools():
+    cache.set_many(
+        {pool_key(name): build_pool(name) for name in [*PRODUCT_FEEDS, TOP_SELLERS]},
+        settings.SAMPLING_POOL_TIMEOUT,
+    )
+
+
+def get_pool(name: str) -> List[int]:
+    pool = cache.get(pool_key(name))
+    if pool is None:
+        pool = build_pool(name)
+        cache.set(pool_key(name), pool, settings.SAMPLING_POOL_TIMEOUT)
+    return pool
+
+
+def sampled(qs: QuerySet, name: str) -> QuerySet:
+    """
+    Limits a queryset to a random sample of a feed's pool, in the order drawn.
+    """
+    pool = get_pool(name)
+    ids = random.sample(pool, min(len(pool), settings.SAMPLING_SIZE))
+    return qs.filter(id__in=ids).order_by(
+        Func(
+            Value(ids, output_field=ArrayField(BigIntegerField())),
+            F("id"),
+            function="array_position",
+            output_field=IntegerField(),
+        )
+    )
+
+
+def sample_products(requester, name: str) -> QuerySet:
+    """
+    A random selection of the products in a feed that the requester can see.
+    """
+    return sampled(
+        PRODUCT_FEEDS[name](available_products(requester, ordering=False)), name
+    )
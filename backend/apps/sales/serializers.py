@@ -683,6 +683,18 @@ class DeliverableSerializer(RelatedAtomicMixin, serializers.ModelSerializer):
     tip_invoice = serializers.SerializerMethodField()
     commission_info = serializers.SerializerMethodField()
     paypal_token = serializers.SerializerMethodField()
+    # Beyond these, only whether the viewer is the buyer, the seller or staff changes
+    # the output for them.
+    viewer_fields = ("subscribed", "read", "outputs")
+
+    @staticmethod
+    def viewer_roles(deliverable: Deliverable):
+        order = deliverable.order
+        roles = defaultdict(list)
+        roles[order.seller_id].append("seller")
+        if order.buyer_id:
+            roles[order.buyer_id].append("buyer")
+        return {user_id: ".".join(sorted(names)) for user_id, names in roles.items()}
 
     def get_fields(self):
         fields = super().get_fields()
@@ -1072,6 +1084,7 @@ class OrderPreviewSerializer(ProductNameMixin, serializers.ModelSerializer):
 
 @register_serializer
 class CardSerializer(serializers.ModelSerializer):
+    viewer_independent = True
     user = RelatedUserSerializer(read_only=True)
     primary = SerializerMethodField("is_primary")
     processor = SerializerMethodField()
@@ -1362,7 +1375,7 @@ class HoldingsSummarySerializer(serializers.ModelSerializer):
         return account_balance(
             obj,
             ESCROW,
-            additional_filters=[Q(finalized_on__lt=self.context["end_date"])],
+            as_of=self.context["end_date"],
         )
 
     def get_holdings(self, obj):
@@ -1370,7 +1383,7 @@ class HoldingsSummarySerializer(serializers.ModelSerializer):
             obj,
             HOLDINGS,
             POSTED_ONLY,
-            additional_filters=[Q(finalized_on__lt=self.context["end_date"])],
+            as_of=self.context["end_date"],
         )
 
     class Meta:
@@ -1910,7 +1923,23 @@ class ReconciliationRecordSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
-class InvoiceReportSerializer(serializers.ModelSerializer):
+class InvoiceTotalsMixin:
+    """
+    Reports that cover many invoices can compute the totals of those without cached
+    totals up front with reckon_many and place them in the serializer context under
+    'totals'. Any other invoice uses its cached total, or is tabulated on its own.
+    """
+
+    context: dict
+
+    def invoice_total(self, obj: Invoice) -> Money:
+        totals = self.context.get("totals") or {}
+        if obj.id in totals:
+            return totals[obj.id]
+        return obj.total()
+
+
+class InvoiceReportSerializer(InvoiceTotalsMixin, serializers.ModelSerializer):
     id = ShortCodeField()
     type = serializers.SerializerMethodField()
     status = serializers.SerializerMethodField()
@@ -1939,7 +1968,7 @@ class InvoiceReportSerializer(serializers.ModelSerializer):
         return obj.issued_by.username
 
     def get_total(self, obj) -> Decimal:
-        return obj.total().amount
+        return self.invoice_total(obj).amount
 
     def get_card_fees(self, obj) -> Decimal:
         return TransactionRecord.objects.filter(
@@ -2013,11 +2042,11 @@ class InvoiceReportSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
-class UnaffiliatedInvoiceSerializer(serializers.ModelSerializer):
+class UnaffiliatedInvoiceSerializer(InvoiceTotalsMixin, serializers.ModelSerializer):
     id = ShortCodeField()
     source = serializers.SerializerMethodField()
     status = serializers.SerializerMethodField()
-    total = MoneyToString()
+    total = serializers.SerializerMethodField()
     tax = serializers.SerializerMethodField()
     card_fees = serializers.SerializerMethodField()
     net = serializers.SerializerMethodField()
@@ -2064,9 +2093,12 @@ class UnaffiliatedInvoiceSerializer(serializers.ModelSerializer):
         remote_ids = set(list(chain(*(record.remote_ids for record in records))))
         return ", ".join(sorted(list(remote_ids)))
 
+    def get_total(self, obj):
+        return MoneyToString().to_representation(self.invoice_total(obj))
+
     def get_net(self, obj):
         return str(
-            obj.total().amount
+            self.invoice_total(obj).amount
             - Decimal(self.get_card_fees(obj))
             - Decimal(self.get_tax(obj))
         )
@@ -2167,6 +2199,9 @@ class SetServiceSerializer(serializers.Serializer):
 
 @register_serializer
 class StripeAccountSerializer(serializers.ModelSerializer):
+    # Output is the same for everyone, so broadcasts can share one payload.
+    viewer_independent = True
+
     class Meta:
         model = StripeAccount
         fields = ("id", "active", "country")
@@ -2271,6 +2306,7 @@ class PaypalConfigSerializer(serializers.ModelSerializer):
 
 @register_serializer
 class SalesStatsSerializer(serializers.ModelSerializer):
+    viewer_independent = True
     products_available = serializers.SerializerMethodField()
     delinquent = serializers.SerializerMethodField()
     active_orders = serializers.SerializerMethodField()
@@ -1,6 +1,10 @@
 import logging
+from collections import defaultdict
 from datetime import datetime
+from io import SEEK_END
+from tempfile import TemporaryFile
 from typing import Dict, Optional, Any
+from uuid import uuid4
 
 from dateutil.parser import parse
 from django.urls import reverse
@@ -14,7 +18,12 @@ from apps.lib.constants import (
     RENEWAL_FIXED,
     AUTO_CLOSED,
 )
-from apps.lib.utils import notify, require_lock, send_transaction_email, utc_now
+from apps.lib.utils import (
+    advisory_lock,
+    notify,
+    send_transaction_email,
+    utc_now,
+)
 from apps.profiles.models import User
 from apps.sales.constants import (
     PAYOUT_ACCOUNT,
@@ -35,6 +44,7 @@ from apps.sales.constants import (
     WEIGHTED_STATUSES,
     COMPLETED,
 )
+from apps.sales.ledger import apply_ledger_changes, record_state
 from apps.sales.mail_campaign import drip
 from apps.sales.models import (
     CreditCardToken,
@@ -62,11 +72,17 @@ from apps.sales.utils import (
 from conf.celery_config import celery_app
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.aggregates import ArrayAgg
 from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management import call_command
 from django.db import transaction, IntegrityError
-from django.db.models import Q, Count
+from django.db.models import Q, Count, Sum
 from django.utils import timezone
 from moneyed import Money
+from short_stuff import unslugify
 from stripe import CardError
 
 from shortcuts import make_url
@@ -274,30 +290,62 @@ def auto_finalize_run():
 RecordMap = Dict[Invoice, TransactionRecord]
 
 
-# TODO: Reimplement this lock as an application lock.
-@require_lock(TransactionRecord, "ACCESS EXCLUSIVE")
 def record_to_invoice_map(user, bank: StripeAccount, amount: Money) -> RecordMap:
-    invoices = Invoice.objects.select_for_update(skip_locked=True).filter(
-        issued_by=user,
-        payout_sent=False,
-        payout_available=True,
-        record_only=False,
-        status=PAID,
+    """
+    Creates a pending payout record for each of a seller's invoices which are ready
+    to be paid out, covering the holdings the seller earned from it.
+
+    Must be run inside a transaction. Holds an advisory lock on the seller until it
+    ends, so payouts for one seller don't hold up payouts or payments for anyone
+    else.
+    """
+    advisory_lock(f"payout_user__{user.id}")
+    invoices = {
+        unslugify(invoice.id): invoice
+        for invoice in Invoice.objects.select_for_update(skip_locked=True).filter(
+            issued_by=user,
+            payout_sent=False,
+            payout_available=True,
+            record_only=False,
+            status=PAID,
+        )
+    }
+    Link = TransactionRecord.targets.through
+    holdings = (
+        Link.objects.filter(
+            transactionrecord__payee=user,
+            transactionrecord__destination=HOLDINGS,
+            transactionrecord__status=SUCCESS,
+            genericreference__content_type=ContentType.objects.get_for_model(Invoice),
+            genericreference__object_id__in=list(invoices),
+        )
+        .values("genericreference__object_id")
+        .annotate(
+            total=Sum("transactionrecord__amount"),
+            record_ids=ArrayAgg("transactionrecord_id"),
+        )
+        .order_by()
     )
+    totals = {}
+    source_records = {}
+    for row in holdings:
+        totals[row["genericreference__object_id"]] = row["total"]
+        source_records[row["genericreference__object_id"]] = row["record_ids"]
+    source_targets = defaultdict(set)
+    for record_id, reference_id in Link.objects.filter(
+        transactionrecord_id__in=[
+            record_id
+            for record_ids in source_records.values()
+            for record_id in record_ids
+        ],
+    ).values_list("transactionrecord_id", "genericreference_id"):
+        source_targets[record_id].add(reference_id)
     record_map: RecordMap = {}
-    bank_ref = ref_for_instance(bank)
-    for invoice in invoices:
-        target = ref_for_instance(invoice)
-        records = TransactionRecord.objects.filter(
-            targets=target,
-            payee=user,
-            destination=HOLDINGS,
-            status=SUCCESS,
-        )
-        sub_amount = sum(sub_record.amount for sub_record in records)
+    for object_id, invoice in invoices.items():
+        sub_amount = Money(totals.get(object_id, 0), amount.currency.code)
         amount -= sub_amount
         assert amount >= Money("0", amount.currency.code)
-        record = TransactionRecord.objects.create(
+        record_map[invoice] = TransactionRecord(
             amount=sub_amount,
             source=HOLDINGS,
             payee=user,
@@ -307,15 +355,26 @@ def record_to_invoice_map(user, bank: StripeAccount, amount: Money) -> RecordMap
             status=PENDING,
             response_message="Failed to connect to server",
         )
-        for sub_record in records:
-            record.targets.add(*sub_record.targets.all())
-        record.targets.add(bank_ref)
-        record_map[invoice] = record
-    if not amount:
-        return record_map
-    raise IntegrityError(
-        f"Amount of {amount} found unconnected to any invoice for {user}!",
-    )
+    if amount:
+        raise IntegrityError(
+            f"Amount of {amount} found unconnected to any invoice for {user}!",
+        )
+    bank_ref = ref_for_instance(bank)
+    links = []
+    for object_id, invoice in invoices.items():
+        reference_ids = {bank_ref.id}
+        for record_id in source_records.get(object_id, []):
+            reference_ids |= source_targets[record_id]
+        record = record_map[invoice]
+        links.extend(
+            Link(transactionrecord_id=record.id, genericreference_id=ref_id)
+            for ref_id in reference_ids
+        )
+    TransactionRecord.objects.bulk_create(record_map.values())
+    Link.objects.bulk_create(links)
+    # Bulk creation skips TransactionRecord.save, which keeps the ledger balances.
+    apply_ledger_changes((None, record_state(record)) for record in record_map.values())
+    return record_map
 
 
 @celery_app.task
@@ -667,6 +726,83 @@ def run_balance_report(
         )
 
 
+@celery_app.task()
+def create_ledger_checkpoint(as_of: Optional[datetime] = None):
+    """
+    Freeze ledger balances as of the start of the day, so that historical balance
+    queries only have to aggregate the transactions since.
+    """
+    from apps.sales.ledger import create_ledger_checkpoint as make_checkpoint
+
+    as_of = as_of or timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    make_checkpoint(as_of)
+
+
+@celery_app.task()
+def fold_ledger_balances() -> None:
+    from apps.sales.ledger import fold_ledger_balances as fold
+
+    fold()
+
+
+@celery_app.task()
+def reconcile_ledger() -> None:
+    """
+    Check the running ledger balances and checkpoints against the ledger itself.
+    Fails if they disagree.
+    """
+    call_command("reconcile_ledger")
+
+
+@celery_app.task()
+def send_journal_report(user_id: int, *, start_date: datetime, end_date: datetime):
+    """
+    Build the journal report in streaming mode and email it to the staff member who
+    asked for it.
+    """
+    from apps.sales.views.reports import (
+        XLSX_CONTENT_TYPE,
+        journal_report_filename,
+        journal_report_storage_name,
+        write_journal_report,
+    )
+
+    user = User.objects.get(id=user_id)
+    if isinstance(start_date, str):
+        start_date, end_date = parse(start_date), parse(end_date)
+    filename = journal_report_filename(start_date=start_date, end_date=end_date)
+    context = {"user": user, "start_date": start_date, "end_date": end_date}
+    attachments = []
+    with TemporaryFile() as report:
+        write_journal_report(
+            report, start_date=start_date, end_date=end_date, streaming=True
+        )
+        size = report.seek(0, SEEK_END)
+        report.seek(0)
+        if size > settings.JOURNAL_REPORT_ATTACHMENT_LIMIT:
+            # Too large to attach. Keep it in storage and send a link instead.
+            report_id = uuid4()
+            default_storage.save(
+                journal_report_storage_name(report_id=report_id, filename=filename),
+                File(report),
+            )
+            context["report_url"] = make_url(
+                reverse(
+                    "sales:journal_report_download",
+                    kwargs={"report_id": report_id, "filename": filename},
+                )
+            )
+        else:
+            attachments.append((filename, report.read(), XLSX_CONTENT_TYPE))
+        send_transaction_email(
+            "Your journal report is ready",
+            "journal_report_ready.html",
+            user,
+            context,
+            attachments=attachments,
+        )
+
+
 @celery_app.task()
 def perform_redaction(deliverable_id: Deliverable) -> None:
     from apps.sales.utils import redact_deliverable
@@ -683,3 +819,24 @@ def redact_scheduled_deliverables() -> None:
         .values_list("id", flat=True)
     ):
         perform_redaction.delay(deliverable_id)
+
+
+@celery_app.task()
+def refresh_sampling_pools() -> None:
+    from apps.sales.sampling import refresh_pools
+
+    refresh_pools()
+
+
+@celery_app.task()
+def compute_product_similarities() -> None:
+    from apps.sales.recommendations import compute_similarities
+
+    compute_similarities()
+
+
+@celery_app.task()
+def refresh_product_similarities(product_id: int) -> None:
+    from apps.sales.recommendations import refresh_similarities
+
+    refresh_similarities(product_id)
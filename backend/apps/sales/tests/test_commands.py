@@ -1,5 +1,10 @@
+import json
+from decimal import Decimal
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
 from dateutil.relativedelta import relativedelta
-from django.core.management import call_command
+from django.core.management import CommandError, call_command
 from django.utils import timezone
 
 from apps.lib.test_resources import EnsurePlansMixin
@@ -7,7 +12,15 @@ from django.test import TestCase, override_settings
 
 from apps.profiles.tests.factories import UserFactory
 from apps.sales.constants import REFUNDED, COMPLETED, IN_PROGRESS, NEW
-from apps.sales.tests.factories import DeliverableFactory
+from apps.sales.ledger import create_ledger_checkpoint
+from apps.sales.models import Invoice, LedgerBalance, TransactionRecord
+from apps.sales.tests.factories import (
+    DeliverableFactory,
+    InvoiceFactory,
+    LineItemFactory,
+    TransactionRecordFactory,
+)
+from moneyed import Money
 
 
 class TestMarkRedactionAvailability(EnsurePlansMixin, TestCase):
@@ -73,3 +86,107 @@ class TestMarkRedactionAvailability(EnsurePlansMixin, TestCase):
                     f"and finalization on {item.finalized_on} with "
                     f"escrow_enabled status {item.escrow_enabled}"
                 )
+
+
+class TestVerifyInvoiceTotals(EnsurePlansMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.invoice = InvoiceFactory.create()
+        LineItemFactory.create(invoice=self.invoice, amount=Money("5.00", "USD"))
+        self.missing = InvoiceFactory.create()
+        LineItemFactory.create(invoice=self.missing, amount=Money("3.00", "USD"))
+        Invoice.objects.filter(id=self.missing.id).update(
+            cached_total=None, cached_discount=None, cached_subtotal=None
+        )
+
+    def test_all_correct(self):
+        out = StringIO()
+        call_command("verify_invoice_totals", stdout=out)
+        self.assertIn("Checked 1 invoice(s).", out.getvalue())
+
+    def test_mismatch(self):
+        Invoice.objects.filter(id=self.invoice.id).update(cached_total=Decimal("4"))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("verify_invoice_totals", stdout=out)
+        self.assertIn(str(self.invoice.id), out.getvalue())
+
+    def test_repair(self):
+        Invoice.objects.filter(id=self.invoice.id).update(cached_total=Decimal("4"))
+        call_command("verify_invoice_totals", "--repair", stdout=StringIO())
+        self.invoice.refresh_from_db()
+        self.missing.refresh_from_db()
+        self.assertEqual(self.invoice.cached_total, Decimal("5.00"))
+        self.assertEqual(self.missing.cached_total, Decimal("3.00"))
+        self.assertEqual(self.missing.cached_subtotal, Decimal("3.00"))
+
+
+class TestReconcileLedger(EnsurePlansMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.record = TransactionRecordFactory.create(amount=Money("10.00", "USD"))
+
+    def test_consistent(self):
+        create_ledger_checkpoint(timezone.now())
+        out = StringIO()
+        call_command("reconcile_ledger", stdout=out)
+        self.assertIn("Ledger reconciled.", out.getvalue())
+
+    def test_mismatch(self):
+        TransactionRecord.objects.update(amount=Money("4.00", "USD"))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("reconcile_ledger", stdout=out)
+        self.assertIn("expected -4.00", out.getvalue())
+
+    def test_repair(self):
+        TransactionRecord.objects.update(amount=Money("4.00", "USD"))
+        call_command("reconcile_ledger", "--repair", stdout=StringIO())
+        self.assertEqual(
+            LedgerBalance.objects.get(user=self.record.payee).amount,
+            Decimal("4.00"),
+        )
+        call_command("reconcile_ledger", stdout=StringIO())
+
+
+class TestBenchmarkLineItems(EnsurePlansMixin, TestCase):
+    def run_benchmark(self, *args):
+        out = StringIO()
+        call_command(
+            "benchmark_line_items",
+            "--sizes",
+            "5",
+            "--iterations",
+            "2",
+            *args,
+            stdout=out,
+        )
+        return json.loads(out.getvalue())
+
+    def test_results(self):
+        report = self.run_benchmark()
+        self.assertEqual(
+            {entry["name"] for entry in report["results"]},
+            {
+                "compact_lines",
+                "calculator_get_totals",
+                "get_totals",
+                "reckon_lines",
+                "deliverable_lines",
+            },
+        )
+        for entry in report["results"]:
+            self.assertEqual(entry["lines"], 5)
+            self.assertEqual(entry["iterations"], 2)
+            self.assertGreater(entry["median"], 0)
+
+    def test_regression(self):
+        report = self.run_benchmark()
+        for entry in report["results"]:
+            entry["median"] = entry["median"] / 1000
+        with NamedTemporaryFile("w", suffix=".json") as baseline:
+            json.dump(report, baseline)
+            baseline.flush()
+            with self.assertRaises(CommandError) as err:
+                self.run_benchmark("--baseline", baseline.name)
+        self.assertIn("Line item performance regressed", str(err.exception))
@@ -1,7 +1,28 @@
+from decimal import Decimal
+
+from apps.lib.test_resources import EnsurePlansMixin
 from apps.sales.line_item_funcs import (
+    compact_lines,
     divide_amount,
+    get_totals,
+    get_totals_many,
+    pricing_engine,
+    reckon_lines,
+    reckon_many,
+    tip_lines,
+)
+from apps.sales.models import Invoice
+from apps.sales.serializers import LineItemCalculationSerializer
+from apps.sales.utils import lines_for_product, pricing_spec
+from apps.sales.tests.factories import (
+    DeliverableFactory,
+    InvoiceFactory,
+    LineItemFactory,
+    add_adjustment,
 )
+from django.core.cache import cache
 from django.test import TestCase
+from line_items import py_get_totals, py_get_totals_compact, py_tip_fee_lines
 from moneyed import Money
 
 
@@ -41,3 +62,116 @@ class TestMoneyHelpers(TestCase):
             divide_amount(Money("10003", "SUR"), 3),
             [Money("3335", "SUR"), Money("3334", "SUR"), Money("3334", "SUR")],
         )
+
+
+class TestBatchTotals(EnsurePlansMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.deliverable = DeliverableFactory.create(
+            product__base_price=Money("15.00", "USD")
+        )
+        add_adjustment(self.deliverable, Money("-2.00", "USD"))
+        self.other = InvoiceFactory.create()
+        LineItemFactory.create(invoice=self.other, amount=Money("3.50", "USD"))
+        LineItemFactory.create(
+            invoice=self.other, amount=Money("0", "USD"), percentage=10, priority=2
+        )
+        self.empty = InvoiceFactory.create()
+
+    def test_get_totals_many(self):
+        results = get_totals_many(Invoice.objects.all())
+        self.assertEqual(len(results), 3)
+        for invoice in Invoice.objects.all():
+            self.assertEqual(results[invoice.id], get_totals(invoice.line_items.all()))
+        self.assertEqual(results[self.empty.id][0], Money("0.00", "USD"))
+
+    def test_reckon_many(self):
+        results = reckon_many(Invoice.objects.all())
+        self.assertEqual(
+            results,
+            {invoice.id: invoice.total() for invoice in Invoice.objects.all()},
+        )
+        self.assertEqual(results[self.other.id], Money("3.85", "USD"))
+
+    def test_reckon_many_query_count(self):
+        with self.assertNumQueries(2):
+            reckon_many(Invoice.objects.all())
+
+
+class TestCompactLines(EnsurePlansMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.deliverable = DeliverableFactory.create(
+            product__base_price=Money("15.00", "USD"),
+            international=True,
+        )
+        add_adjustment(self.deliverable, Money("-2.00", "USD"))
+
+    def test_matches_serialized_calculation(self):
+        lines = list(self.deliverable.invoice.line_items.all())
+        self.assertEqual(
+            py_get_totals_compact(compact_lines(lines), 2),
+            py_get_totals(
+                LineItemCalculationSerializer(many=True, instance=lines).data, 2
+            ),
+        )
+
+    def test_queryset_matches_instances(self):
+        queryset = self.deliverable.invoice.line_items.all()
+        self.assertEqual(compact_lines(queryset), compact_lines(list(queryset)))
+
+    def test_unevaluated_queryset_single_query(self):
+        invoice = self.deliverable.invoice
+        with self.assertNumQueries(1):
+            reckon_lines(invoice.line_items.all())
+
+    def test_simulated_lines(self):
+        lines = lines_for_product(self.deliverable.product)
+        self.assertEqual(
+            py_get_totals_compact(compact_lines(lines), 2),
+            py_get_totals(
+                LineItemCalculationSerializer(many=True, instance=lines).data, 2
+            ),
+        )
+
+
+class TestPricingEngine(EnsurePlansMixin, TestCase):
+    def test_engine_reused(self):
+        self.assertIs(pricing_engine(), pricing_engine())
+
+    def test_engine_rebuilt_on_plan_change(self):
+        engine = pricing_engine()
+        self.landscape.shield_percentage_price = Decimal("9")
+        self.landscape.save()
+        self.assertIsNot(pricing_engine(), engine)
+        lines = pricing_engine().deliverable_lines(
+            base_price="10.00",
+            table_product=False,
+            escrow_enabled=True,
+            international=False,
+            plan_name=self.landscape.name,
+            user_id=1,
+            quantization=2,
+            extra_lines=[],
+        )
+        shield = [line for line in lines if line["id"] == -5][0]
+        self.assertEqual(Decimal(shield["percentage"]), Decimal("9"))
+
+    def test_engine_rebuilt_when_other_process_clears(self):
+        engine = pricing_engine()
+        # As if another process had cleared the pricing cache.
+        cache.delete("price_data_version")
+        self.assertIsNot(pricing_engine(), engine)
+
+    def test_tip_lines_match(self):
+        for international in (False, True):
+            self.assertEqual(
+                tip_lines(international=international),
+                py_tip_fee_lines(
+                    {
+                        "pricing": pricing_spec(),
+                        "international": international,
+                        "quantization": 2,
+                    }
+                ),
+            )
@@ -14,6 +14,7 @@ from apps.lib.utils import FakeRequest
 from apps.profiles.constants import IN_SUPPORTED_COUNTRY, NO_SUPPORTED_COUNTRY
 from apps.profiles.tests.factories import SubmissionFactory, UserFactory
 from apps.sales.constants import (
+    ADD_ON,
     BASE_PRICE,
     CANCELLED,
     COMPLETED,
@@ -32,10 +33,13 @@ from apps.sales.constants import (
 )
 from apps.sales.models import (
     InventoryTracker,
+    Invoice,
+    LineItem,
     Product,
     StripeLocation,
     StripeReader,
     deliverable_from_context,
+    idempotent_lines,
 )
 from apps.sales.tests.factories import (
     CreditCardTokenFactory,
@@ -58,7 +62,9 @@ from apps.sales.tests.factories import (
 from ddt import data, ddt, unpack
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from freezegun import freeze_time
 from moneyed import Money
@@ -236,6 +242,64 @@ class TestDeliverable(EnsurePlansMixin, TestCase):
         LineItemFactory.create(invoice=deliverable.invoice, amount=Money("2.00", "USD"))
         self.assertEqual(deliverable.invoice.total(), Money("11.47", "USD"))
 
+    def sync_query_count(self, deliverable):
+        with CaptureQueriesContext(connection) as context:
+            idempotent_lines(deliverable)
+        return len(context.captured_queries)
+
+    def test_idempotent_lines_query_count(self):
+        deliverable = DeliverableFactory.create(product__base_price=Money(5, "USD"))
+        baseline = self.sync_query_count(deliverable)
+        for _ in range(10):
+            LineItemFactory.create(
+                invoice=deliverable.invoice, type=ADD_ON, amount=Money("1.00", "USD")
+            ).annotate(deliverable)
+        idempotent_lines(deliverable)
+        self.assertEqual(self.sync_query_count(deliverable), baseline)
+        self.assertEqual(
+            deliverable.invoice.line_items.filter(type=ADD_ON).count(),
+            10,
+        )
+
+    def test_idempotent_lines_update_in_place(self):
+        plan = ServicePlanFactory.create(
+            name="Test Plan",
+            shield_percentage_price=Decimal("9"),
+            shield_static_price=Money(".35", "USD"),
+        )
+        deliverable = DeliverableFactory.create(
+            product__base_price=Money("15.00", "USD"),
+            order__seller__service_plan=plan,
+        )
+        line_ids = set(deliverable.invoice.line_items.values_list("id", flat=True))
+        self.assertEqual(
+            deliverable.invoice.line_items.get(type=SHIELD).percentage, Decimal("9")
+        )
+        deliverable.international = True
+        idempotent_lines(deliverable)
+        self.assertEqual(
+            set(deliverable.invoice.line_items.values_list("id", flat=True)),
+            line_ids,
+        )
+        self.assertEqual(
+            deliverable.invoice.line_items.get(type=SHIELD).percentage, Decimal("10")
+        )
+
+    def test_idempotent_lines_removes_duplicates(self):
+        deliverable = DeliverableFactory.create(
+            product__base_price=Money("15.00", "USD"),
+        )
+        shield = deliverable.invoice.line_items.get(type=SHIELD)
+        total = deliverable.invoice.total()
+        duplicate = LineItem.objects.get(id=shield.id)
+        duplicate.id = None
+        duplicate.save()
+        duplicate.annotate(deliverable)
+        idempotent_lines(deliverable)
+        self.assertEqual(deliverable.invoice.line_items.filter(type=SHIELD).count(), 1)
+        deliverable.invoice.refresh_from_db()
+        self.assertEqual(deliverable.invoice.total(), total)
+
     def deliverable_and_context(self):
         deliverable = DeliverableFactory.create()
         deliverable.arbitrator = UserFactory.create()
@@ -850,6 +914,50 @@ class TestInvoice(EnsurePlansMixin, TestCase):
             f"$20.43 for deliverable: Deliverable object ({deliverable.id})",
         )
 
+    def test_total_cached(self):
+        invoice = InvoiceFactory.create()
+        LineItemFactory.create(invoice=invoice, amount=Money("5.00", "USD"))
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.cached_total, Decimal("5.00"))
+        with self.assertNumQueries(0):
+            self.assertEqual(invoice.total(), Money("5.00", "USD"))
+
+    def test_total_missing_not_stored(self):
+        invoice = InvoiceFactory.create()
+        LineItemFactory.create(invoice=invoice, amount=Money("5.00", "USD"))
+        Invoice.objects.filter(id=invoice.id).update(cached_total=None)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total(), Money("5.00", "USD"))
+        invoice.refresh_from_db()
+        self.assertIsNone(invoice.cached_total)
+
+    def test_totals_updated_on_line_change(self):
+        invoice = InvoiceFactory.create()
+        line = LineItemFactory.create(invoice=invoice, amount=Money("5.00", "USD"))
+        discount = LineItemFactory.create(
+            invoice=invoice, amount=Money("-1.00", "USD"), priority=2
+        )
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total(), Money("4.00", "USD"))
+        self.assertEqual(invoice.discount(), Money("-1.00", "USD"))
+        self.assertEqual(invoice.subtotal(), Money("5.00", "USD"))
+        line.amount = Money("6.00", "USD")
+        line.save()
+        discount.delete()
+        invoice = Invoice.objects.get(id=invoice.id)
+        self.assertEqual(invoice.cached_total, Decimal("6.00"))
+        self.assertEqual(invoice.total(), Money("6.00", "USD"))
+        self.assertEqual(invoice.discount(), Money("0.00", "USD"))
+
+    def test_save_does_not_restore_stale_totals(self):
+        invoice = InvoiceFactory.create()
+        LineItemFactory.create(invoice=invoice, amount=Money("5.00", "USD"))
+        stale = Invoice.objects.get(id=invoice.id)
+        LineItemFactory.create(invoice=invoice, amount=Money("2.00", "USD"))
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual(stale.cached_total, Decimal("7.00"))
+
 
 class TestReference(EnsurePlansMixin, TestCase):
     def test_never_reference(self):
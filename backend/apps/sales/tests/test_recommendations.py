@@ -0,0 +1,86 @@
+from apps.lib.models import Tag
+from apps.lib.test_resources import EnsurePlansMixin
+from apps.sales.models import ProductSimilarity
+from apps.sales.recommendations import compute_similarities, save_similarities
+from apps.sales.tests.factories import ProductFactory
+from django.test import TestCase, override_settings
+
+
+class TestRecommendations(EnsurePlansMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Tag.objects.bulk_create(
+            [Tag(name=name) for name in ["beep", "boop", "bap", "bloop"]]
+        )
+
+    def neighbors(self, product):
+        return list(
+            ProductSimilarity.objects.filter(product=product)
+            .order_by("-score")
+            .values_list("similar_id", flat=True)
+        )
+
+    def test_compute(self):
+        product = ProductFactory.create()
+        product.tags.add("beep", "boop", "bap")
+        closest = ProductFactory.create()
+        closest.tags.add("beep", "boop")
+        further = ProductFactory.create()
+        further.tags.add("beep", "bloop")
+        ProductFactory.create().tags.add("bloop")
+        ProductSimilarity.objects.all().delete()
+        compute_similarities()
+        self.assertEqual(self.neighbors(product), [closest.id, further.id])
+        self.assertEqual(self.neighbors(closest), [product.id, further.id])
+
+    def test_same_artist(self):
+        product = ProductFactory.create()
+        product.tags.add("beep", "boop")
+        other_artist = ProductFactory.create()
+        other_artist.tags.add("beep")
+        same_artist = ProductFactory.create(user=product.user)
+        same_artist.tags.add("beep")
+        self.assertEqual(self.neighbors(product), [same_artist.id, other_artist.id])
+
+    @override_settings(PRODUCT_SIMILARITY_NEIGHBORS=1)
+    def test_trimmed(self):
+        product = ProductFactory.create()
+        product.tags.add("beep", "boop")
+        further = ProductFactory.create()
+        further.tags.add("beep")
+        closest = ProductFactory.create()
+        closest.tags.add("beep", "boop")
+        self.assertEqual(self.neighbors(product), [closest.id])
+        self.assertEqual(self.neighbors(further), [product.id])
+
+    def test_tags_removed(self):
+        product = ProductFactory.create()
+        product.tags.add("beep", "boop")
+        other = ProductFactory.create()
+        other.tags.add("beep")
+        self.assertEqual(self.neighbors(product), [other.id])
+        other.tags.remove("beep")
+        self.assertEqual(self.neighbors(product), [])
+        self.assertEqual(self.neighbors(other), [])
+
+    def test_unavailable_not_recommended(self):
+        product = ProductFactory.create()
+        product.tags.add("beep")
+        unavailable = ProductFactory.create(available=False)
+        unavailable.tags.add("beep")
+        self.assertEqual(self.neighbors(product), [])
+        self.assertEqual(self.neighbors(unavailable), [product.id])
+        ProductSimilarity.objects.all().delete()
+        compute_similarities()
+        self.assertEqual(self.neighbors(product), [])
+        self.assertEqual(self.neighbors(unavailable), [product.id])
+
+    def test_save_existing(self):
+        product = ProductFactory.create()
+        product.tags.add("beep")
+        other = ProductFactory.create()
+        other.tags.add("beep")
+        save_similarities([ProductSimilarity(product=product, similar=other, score=5)])
+        self.assertEqual(
+            ProductSimilarity.objects.get(product=product, similar=other).score, 5
+        )
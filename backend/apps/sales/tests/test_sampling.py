@@ -0,0 +1,55 @@
+from apps.lib.test_resources import EnsurePlansMixin
+from apps.profiles.tests.factories import UserFactory
+from apps.sales.sampling import (
+    PRODUCT_FEEDS,
+    TOP_SELLERS,
+    get_pool,
+    pool_key,
+    refresh_pools,
+    sample_products,
+)
+from apps.sales.tests.factories import ProductFactory
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+
+@override_settings(SAMPLING_POOL_TIMEOUT=60)
+class TestSampling(EnsurePlansMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        keys = [pool_key(name) for name in [*PRODUCT_FEEDS, TOP_SELLERS]]
+        cache.delete_many(keys)
+        self.addCleanup(cache.delete_many, keys)
+
+    def test_pool_cached(self):
+        product = ProductFactory.create()
+        self.assertEqual(get_pool("random"), [product.id])
+        new_product = ProductFactory.create()
+        self.assertEqual(get_pool("random"), [product.id])
+        refresh_pools()
+        self.assertCountEqual(get_pool("random"), [product.id, new_product.id])
+
+    @override_settings(SAMPLING_SIZE=2)
+    def test_sample_size(self):
+        products = ProductFactory.create_batch(5)
+        user = UserFactory.create()
+        sample = list(sample_products(user, "random"))
+        self.assertEqual(len(sample), 2)
+        self.assertTrue(set(sample) <= set(products))
+
+    def test_viewer_filters(self):
+        product = ProductFactory.create()
+        blocked = ProductFactory.create()
+        user = UserFactory.create()
+        user.blocking.add(blocked.user)
+        self.assertEqual(list(sample_products(user, "random")), [product])
+
+    def test_no_longer_eligible(self):
+        product = ProductFactory.create()
+        unfeatured = ProductFactory.create(featured=True)
+        refresh_pools()
+        unfeatured.featured = False
+        unfeatured.save()
+        user = UserFactory.create()
+        self.assertEqual(list(sample_products(user, "featured")), [])
+        self.assertEqual(list(sample_products(user, "random")), [product])
@@ -55,7 +55,9 @@ from apps.sales.tasks import (
     drip_sync_cart,
     promote_top_sellers,
     clear_old_webhook_logs,
+    record_to_invoice_map,
     redact_scheduled_deliverables,
+    send_journal_report,
 )
 from apps.sales.tests.factories import (
     CreditCardTokenFactory,
@@ -68,11 +70,12 @@ from apps.sales.tests.factories import (
     ShoppingCartFactory,
     ProductFactory,
 )
-from apps.sales.utils import add_service_plan_line, get_term_invoice
+from apps.sales.utils import PENDING as PENDING_BALANCE
+from apps.sales.utils import account_balance, add_service_plan_line, get_term_invoice
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.core import mail
-from django.db import connection, IntegrityError
+from django.db import connection, IntegrityError, TransactionManagementError
 from django.test import TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
 from djmoney.money import Money
@@ -478,6 +481,41 @@ class TestWithdrawAll(EnsurePlansMixin, TransactionTestCase):
         records = TransactionRecord.objects.filter(destination=PAYOUT_ACCOUNT)
         self.assertEqual(records.count(), 1)
 
+    @patch("apps.sales.tasks.stripe_transfer.delay")
+    def test_withdraw_all_multiple_invoices(self, stripe_transfer):
+        user = UserFactory.create()
+        bank = StripeAccountFactory.create(user=user)
+        invoices = []
+        for value in ["10.00", "5.00"]:
+            invoice = InvoiceFactory(issued_by=user, status=PAID, payout_available=True)
+            record = TransactionRecordFactory(
+                payee=user, destination=HOLDINGS, amount=Money(value, "USD")
+            )
+            record.targets.add(ref_for_instance(invoice))
+            invoices.append(invoice)
+        withdraw_all(user.id)
+        for invoice, value in zip(invoices, ["10.00", "5.00"]):
+            transfer = TransactionRecord.objects.get(
+                category=CASH_WITHDRAW, targets=ref_for_instance(invoice)
+            )
+            self.assertEqual(transfer.amount, Money(value, "USD"))
+            self.assertCountEqual(
+                [target.target for target in transfer.targets.all()],
+                [invoice, bank],
+            )
+            stripe_transfer.assert_any_call(transfer.id, bank.id, invoice.id)
+        # The bulk created records must still be counted in the running balances.
+        self.assertEqual(account_balance(user, HOLDINGS), Decimal("0.00"))
+        self.assertEqual(
+            account_balance(user, PAYOUT_ACCOUNT, PENDING_BALANCE), Decimal("15.00")
+        )
+
+    def test_record_to_invoice_map_requires_transaction(self):
+        user = UserFactory.create()
+        bank = StripeAccountFactory.create(user=user)
+        with self.assertRaises(TransactionManagementError):
+            record_to_invoice_map(user, bank, Money("0.00", "USD"))
+
     @patch("apps.sales.tasks.record_to_invoice_map")
     def test_withdraw_all_bails_on_zero(self, mock_mapper):
         user = UserFactory.create()
@@ -1036,3 +1074,29 @@ class TestRedactScheduled(EnsurePlansMixin, TestCase):
         self.assertTrue(due.redacted_on)
         self.assertFalse(null_date.redacted_on)
         self.assertFalse(not_due.redacted_on)
+
+
+class TestSendJournalReport(EnsurePlansMixin, TestCase):
+    def test_send_journal_report(self):
+        staff = UserFactory.create(is_superuser=True)
+        end_date = utc_now()
+        send_journal_report(
+            staff.id, start_date=end_date - relativedelta(days=30), end_date=end_date
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [staff.email])
+        filename, content, mimetype = mail.outbox[0].attachments[0]
+        self.assertTrue(filename.startswith("journal-report-from-"))
+        self.assertTrue(filename.endswith(".xlsx"))
+        self.assertTrue(content.startswith(b"PK"))
+
+    @override_settings(JOURNAL_REPORT_ATTACHMENT_LIMIT=0)
+    def test_send_journal_report_link(self):
+        staff = UserFactory.create(is_superuser=True)
+        end_date = utc_now()
+        send_journal_report(
+            staff.id, start_date=end_date - relativedelta(days=30), end_date=end_date
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].attachments, [])
+        self.assertIn("/reports/journal-report/", mail.outbox[0].body)
@@ -6,6 +6,7 @@ import ddt
 from apps.lib.models import Notification, ref_for_instance, Comment
 from apps.lib.constants import ORDER_UPDATE
 from apps.lib.test_resources import EnsurePlansMixin, SignalsDisabledMixin
+from apps.lib.tests.factories import TagFactory
 from apps.lib.tests.factories_interdepend import CommentFactory
 from apps.profiles.models import User
 from apps.profiles.tests.factories import UserFactory, CharacterFactory
@@ -17,6 +18,7 @@ from apps.sales.constants import (
     COMPLETED,
     DELIVERABLE_TRACKING,
     ESCROW,
+    ESCROW_HOLD,
     FAILURE,
     HOLDINGS,
     IN_PROGRESS,
@@ -35,7 +37,20 @@ from apps.sales.constants import (
     PAID_STATUSES,
     PAID,
 )
-from apps.sales.models import LineItem, TransactionRecord, Deliverable, Reference
+from apps.sales.ledger import (
+    LedgerMismatchError,
+    create_ledger_checkpoint,
+    fold_ledger_balances,
+    rebuild_ledger_balances,
+)
+from apps.sales.models import (
+    LedgerBalance,
+    LedgerCheckpoint,
+    LineItem,
+    TransactionRecord,
+    Deliverable,
+    Reference,
+)
 from apps.sales.tests.factories import (
     DeliverableFactory,
     InvoiceFactory,
@@ -49,6 +64,7 @@ from apps.sales.tests.factories import (
     TransactionRecordFactory,
 )
 from apps.sales.utils import (
+    ALL,
     PENDING,
     POSTED_ONLY,
     account_balance,
@@ -169,6 +185,166 @@ class BalanceTestCase(EnsurePlansMixin, SignalsDisabledMixin, TestCase):
             account_balance(self.user2, ESCROW, 50)
 
 
+class TestLedgerBalances(EnsurePlansMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.payer = UserFactory.create()
+        self.payee = UserFactory.create()
+
+    def make_record(self, **kwargs):
+        return TransactionRecordFactory.create(
+            payer=self.payer,
+            payee=self.payee,
+            source=CARD,
+            destination=ESCROW,
+            **kwargs,
+        )
+
+    def test_new_record(self):
+        self.make_record(amount=Money("10.00", "USD"))
+        self.assertEqual(account_balance(self.payee, ESCROW), Decimal("10.00"))
+        self.assertEqual(account_balance(self.payer, CARD), Decimal("-10.00"))
+        self.assertEqual(
+            LedgerBalance.objects.get(user=self.payee, account=ESCROW).amount,
+            Decimal("10.00"),
+        )
+
+    def test_status_change(self):
+        record = self.make_record(amount=Money("10.00", "USD"), status=PENDING)
+        self.assertEqual(account_balance(self.payee, ESCROW, PENDING), Decimal("10.00"))
+        self.assertEqual(
+            account_balance(self.payee, ESCROW, POSTED_ONLY), Decimal("0.00")
+        )
+        record.status = SUCCESS
+        record.save()
+        self.assertEqual(account_balance(self.payee, ESCROW, PENDING), Decimal("0.00"))
+        self.assertEqual(
+            account_balance(self.payee, ESCROW, POSTED_ONLY), Decimal("10.00")
+        )
+        record.status = FAILURE
+        record.save()
+        self.assertEqual(account_balance(self.payee, ESCROW), Decimal("0.00"))
+
+    def test_delete(self):
+        record = self.make_record(amount=Money("10.00", "USD"), status=PENDING)
+        record.delete()
+        self.assertEqual(account_balance(self.payee, ESCROW), Decimal("0.00"))
+
+    def test_account_change(self):
+        record = self.make_record(amount=Money("10.00", "USD"))
+        record.destination = HOLDINGS
+        record.save()
+        self.assertEqual(account_balance(self.payee, ESCROW), Decimal("0.00"))
+        self.assertEqual(account_balance(self.payee, HOLDINGS), Decimal("10.00"))
+
+    def test_all_users(self):
+        self.make_record(amount=Money("10.00", "USD"))
+        TransactionRecordFactory.create(
+            destination=ESCROW, amount=Money("5.00", "USD"), payee=None
+        )
+        self.assertEqual(account_balance(ALL, ESCROW), Decimal("15.00"))
+        self.assertEqual(account_balance(None, ESCROW), Decimal("5.00"))
+
+    def test_balance_as_of(self):
+        start = timezone.now() - relativedelta(days=10)
+        for days in range(5):
+            self.make_record(
+                amount=Money("1.00", "USD"),
+                finalized_on=start + relativedelta(days=days),
+            )
+        create_ledger_checkpoint(start + relativedelta(days=2, hours=12))
+        checkpoint = LedgerCheckpoint.objects.get()
+        self.assertEqual(
+            checkpoint.balances.get(user=self.payee, account=ESCROW).amount,
+            Decimal("3.00"),
+        )
+        cutoff = start + relativedelta(days=3, hours=12)
+        self.assertEqual(
+            account_balance(self.payee, ESCROW, as_of=cutoff), Decimal("4.00")
+        )
+        self.assertEqual(
+            account_balance(self.payee, ESCROW, as_of=start), Decimal("0.00")
+        )
+        self.assertEqual(
+            account_balance(ALL, ESCROW, POSTED_ONLY, as_of=cutoff), Decimal("4.00")
+        )
+
+    def test_checkpoint_built_from_previous(self):
+        start = timezone.now() - relativedelta(days=10)
+        for days in range(4):
+            self.make_record(
+                amount=Money("1.00", "USD"),
+                finalized_on=start + relativedelta(days=days),
+            )
+        create_ledger_checkpoint(start + relativedelta(days=1, hours=12))
+        later = create_ledger_checkpoint(start + relativedelta(days=3, hours=12))
+        self.assertEqual(
+            later.balances.get(user=self.payee, account=ESCROW).amount,
+            Decimal("4.00"),
+        )
+
+    def test_checkpoint_invalidated(self):
+        start = timezone.now() - relativedelta(days=10)
+        record = self.make_record(amount=Money("1.00", "USD"), finalized_on=start)
+        create_ledger_checkpoint(start + relativedelta(days=1))
+        create_ledger_checkpoint(start - relativedelta(days=1))
+        record.amount = Money("2.00", "USD")
+        record.save()
+        self.assertEqual(
+            list(LedgerCheckpoint.objects.values_list("as_of", flat=True)),
+            [start - relativedelta(days=1)],
+        )
+        self.assertEqual(
+            account_balance(self.payee, ESCROW, as_of=start + relativedelta(days=1)),
+            Decimal("2.00"),
+        )
+
+    def test_fold(self):
+        record = self.make_record(amount=Money("10.00", "USD"), status=PENDING)
+        record.status = SUCCESS
+        record.save()
+        self.make_record(amount=Money("5.00", "USD"))
+        self.assertEqual(
+            LedgerBalance.objects.filter(user=self.payee, account=ESCROW).count(), 4
+        )
+        fold_ledger_balances()
+        self.assertEqual(
+            LedgerBalance.objects.get(
+                user=self.payee, account=ESCROW, status=SUCCESS
+            ).amount,
+            Decimal("15.00"),
+        )
+        # The pending rows cancel out.
+        self.assertFalse(LedgerBalance.objects.filter(status=PENDING).exists())
+        self.assertEqual(account_balance(self.payee, ESCROW), Decimal("15.00"))
+        self.assertEqual(account_balance(self.payer, CARD), Decimal("-15.00"))
+
+    def test_additional_filters_use_aggregate(self):
+        self.make_record(amount=Money("10.00", "USD"), category=ESCROW_HOLD)
+        self.make_record(amount=Money("5.00", "USD"), category=SHIELD_FEE)
+        self.assertEqual(
+            account_balance(
+                self.payee, ESCROW, additional_filters=[Q(category=SHIELD_FEE)]
+            ),
+            Decimal("5.00"),
+        )
+
+    @override_settings(LEDGER_VERIFY_BALANCES=True)
+    def test_verification(self):
+        self.make_record(amount=Money("10.00", "USD"))
+        LedgerBalance.objects.filter(user=self.payee).update(amount=Decimal("3.00"))
+        with self.assertRaises(LedgerMismatchError):
+            account_balance(self.payee, ESCROW)
+
+    @override_settings(LEDGER_VERIFY_BALANCES=False)
+    def test_rebuild(self):
+        self.make_record(amount=Money("10.00", "USD"))
+        TransactionRecord.objects.update(amount=Money("4.00", "USD"))
+        self.assertEqual(account_balance(self.payee, ESCROW), Decimal("10.00"))
+        rebuild_ledger_balances()
+        self.assertEqual(account_balance(self.payee, ESCROW), Decimal("4.00"))
+
+
 class TestClaim(EnsurePlansMixin, TestCase):
     def test_order_claim_no_token(self):
         user = UserFactory.create()
@@ -273,6 +449,72 @@ class TestAvailableProducts(EnsurePlansMixin, TestCase):
         ProductFactory.create()
         self.assertIn("ORDER BY", str(available_products(user).query))
 
+    def test_search_partial_name(self):
+        user = UserFactory.create()
+        product = ProductFactory.create(name="Watercolor Portraits")
+        ProductFactory.create(name="Sculpture")
+        self.assertEqual(list(available_products(user, query="color")), [product])
+
+    def test_search_tags_and_username(self):
+        user = UserFactory.create()
+        tagged = ProductFactory.create(name="Sketch")
+        tagged.tags.add(TagFactory.create(name="dragons"))
+        seller = UserFactory.create(username="Inkwell")
+        by_seller = ProductFactory.create(name="Sketch", user=seller)
+        self.assertEqual(list(available_products(user, query="dragons")), [tagged])
+        self.assertEqual(list(available_products(user, query="inkw")), [by_seller])
+
+    def test_search_ranked(self):
+        user = UserFactory.create()
+        described = ProductFactory.create(
+            name="Sketch", description="A quick dragon doodle."
+        )
+        named = ProductFactory.create(name="Dragon Portrait")
+        self.assertEqual(
+            list(available_products(user, query="dragon")), [named, described]
+        )
+
+    def test_search_follows_username_change(self):
+        user = UserFactory.create()
+        product = ProductFactory.create()
+        product.user.username = "Renamed"
+        product.user.save()
+        self.assertEqual(list(available_products(user, query="renamed")), [product])
+
+    def test_search_follows_shortened_username(self):
+        user = UserFactory.create()
+        seller = UserFactory.create(username="bobby")
+        ProductFactory.create(name="Sketch", user=seller)
+        seller.username = "bob"
+        seller.save()
+        self.assertEqual(list(available_products(user, query="bobby")), [])
+
+    @patch("apps.sales.models.refresh_product_search")
+    def test_search_kept_without_username_change(self, mock_refresh):
+        seller = UserFactory.create()
+        ProductFactory.create(user=seller)
+        mock_refresh.reset_mock()
+        seller.save()
+        seller.username = "Renamed"
+        seller.save(update_fields=["email"])
+        mock_refresh.assert_not_called()
+
+    def test_search_follows_tag_deletion(self):
+        user = UserFactory.create()
+        product = ProductFactory.create(name="Sketch")
+        tag = TagFactory.create(name="dragons")
+        product.tags.add(tag)
+        tag.delete()
+        self.assertEqual(list(available_products(user, query="dragons")), [])
+
+    def test_search_follows_tag_removal(self):
+        user = UserFactory.create()
+        product = ProductFactory.create(name="Sketch")
+        tag = TagFactory.create(name="dragons")
+        product.tags.add(tag)
+        tag.products.remove(product)
+        self.assertEqual(list(available_products(user, query="dragons")), [])
+
 
 class TestFreezeLineItems(EnsurePlansMixin, TestCase):
     def test_freezes_values(self):
@@ -530,6 +530,11 @@ urlpatterns = [
         reports.JournalReport.as_view(),
         name="journal_report",
     ),
+    path(
+        "reports/journal-report/<uuid:report_id>/<str:filename>",
+        reports.JournalReportDownload.as_view(),
+        name="journal_report_download",
+    ),
     path(
         "reports/tip-report/csv/",
         reports.TipReportCSV.as_view(),
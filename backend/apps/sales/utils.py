@@ -30,6 +30,7 @@ from urllib.parse import quote
 from pytz import UTC
 
 from apps.lib.models import (
+    ArchivedNotification,
     Comment,
     Event,
     Notification,
@@ -55,7 +56,9 @@ from apps.lib.utils import (
     recall_notification,
     clear_comments_by_content_obj_ref,
     clear_comments,
+    unread_counts_kept,
 )
+from apps.profiles.content_filters import get_content_filter
 from apps.profiles.models import User
 from apps.profiles.permissions import staff_power
 from apps.profiles.tasks import create_or_update_stripe_user
@@ -131,7 +134,13 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
 from django.core.exceptions import MultipleObjectsReturned
 from django.db import IntegrityError, transaction
-from django.db.models import Case, F, IntegerField, Model, Q, Sum, When
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramWordSimilarity,
+)
+from django.db.models import F, Model, Q, QuerySet, Sum, Value
 from django.db.transaction import atomic
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
@@ -177,23 +186,76 @@ POSTED_ONLY = 1
 PENDING = 2
 
 
+def balance_statuses(balance_type: int) -> List[int]:
+    if balance_type == PENDING:
+        return [PENDING]
+    elif balance_type == POSTED_ONLY:
+        return [SUCCESS]
+    elif balance_type == AVAILABLE:
+        return [SUCCESS, PENDING]
+    raise TypeError(f"Invalid balance type: {balance_type}")
+
+
 def account_balance(
     user: Union[User, None, Type[ALL]],
     account_type: int,
     balance_type: int = AVAILABLE,
     additional_filters: Optional[list[Q]] = None,
+    as_of: Optional[datetime] = None,
+) -> Decimal:
+    """
+    Get the balance of an account, using the running ledger balances. If as_of is
+    given, only transactions finalized before that time are counted.
+
+    Arbitrary additional filters can't be answered from the running balances, and
+    so fall back to aggregating the ledger.
+    """
+    if additional_filters:
+        if as_of is not None:
+            additional_filters = [*additional_filters, Q(finalized_on__lt=as_of)]
+        return aggregate_account_balance(
+            user, account_type, balance_type, additional_filters
+        )
+    from apps.sales.ledger import LedgerMismatchError, balance_as_of, ledger_balance
+
+    statuses = balance_statuses(balance_type)
+    all_users = user is ALL
+    user_id = None if (all_users or user is None) else user.id
+    if as_of is None:
+        balance = ledger_balance(user_id, account_type, statuses, all_users=all_users)
+    else:
+        balance = balance_as_of(
+            user_id, account_type, statuses, as_of, all_users=all_users
+        )
+    if settings.LEDGER_VERIFY_BALANCES:
+        expected = aggregate_account_balance(
+            user,
+            account_type,
+            balance_type,
+            [Q(finalized_on__lt=as_of)] if as_of is not None else None,
+        )
+        if expected != balance:
+            raise LedgerMismatchError(
+                f"Ledger balance for {user} in account {account_type} was "
+                f"{balance}, but the ledger aggregates to {expected}."
+            )
+    return balance
+
+
+def aggregate_account_balance(
+    user: Union[User, None, Type[ALL]],
+    account_type: int,
+    balance_type: int = AVAILABLE,
+    additional_filters: Optional[list[Q]] = None,
 ) -> Decimal:
+    """
+    Get the balance of an account by summing up every matching transaction in
+    the ledger. Used to verify the running balances.
+    """
     additional_filters = additional_filters or []
     from apps.sales.models import TransactionRecord
 
-    if balance_type == PENDING:
-        statuses = [PENDING]
-    elif balance_type == POSTED_ONLY:
-        statuses = [SUCCESS]
-    elif balance_type == AVAILABLE:
-        statuses = [SUCCESS, PENDING]
-    else:
-        raise TypeError(f"Invalid balance type: {balance_type}")
+    statuses = balance_statuses(balance_type)
     kwargs = {
         "status__in": statuses,
         "source": account_type,
@@ -236,33 +298,75 @@ def account_balance(
     return Decimal(credit - debit)
 
 
-def product_ordering(qs, query=""):
-    return (
-        qs.annotate(
-            matches=Case(
-                When(name__iexact=query, then=0), default=1, output_field=IntegerField()
-            ),
-            tag_matches=Case(
-                When(tags__name__iexact=query, then=0),
-                default=1,
-                output_field=IntegerField(),
+# Text search configuration for product search documents.
+PRODUCT_SEARCH_CONFIG = "english"
+
+
+def refresh_product_search(products: QuerySet):
+    """
+    Rebuilds the search documents for a set of products from their names, tags,
+    seller usernames and descriptions, in that order of weight. Also rebuilds the
+    lowercased text used for trigram matching, which leaves out the description.
+    """
+    from apps.sales.models import Product
+
+    for product in (
+        products.select_related("user")
+        .prefetch_related("tags")
+        .only("id", "name", "description", "user__username")
+    ):
+        tags = " ".join(tag.name for tag in product.tags.all())
+        username = product.user.username
+        Product.objects.filter(id=product.id).update(
+            search_document=(
+                SearchVector(
+                    Value(product.name), weight="A", config=PRODUCT_SEARCH_CONFIG
+                )
+                + SearchVector(
+                    Value(f"{tags} {username}"),
+                    weight="B",
+                    config=PRODUCT_SEARCH_CONFIG,
+                )
+                + SearchVector(
+                    Value(product.description),
+                    weight="C",
+                    config=PRODUCT_SEARCH_CONFIG,
+                )
             ),
-            # How can we make it distinct on id while making matches and tag_matches
-            # priority ordering?
+            search_text=f"{product.name} {tags} {username}".lower(),
         )
-        .order_by("id", "matches", "tag_matches")
-        .distinct("id")
+
+
+def search_products(qs: QuerySet, query: str) -> QuerySet:
+    """
+    Filters products to those matching a search, either by full text or by part of
+    a word in their name, tags or seller's username, and annotates each with a
+    search_rank for ordering by relevance.
+    """
+    text = query.lower()
+    search_query = SearchQuery(
+        query, config=PRODUCT_SEARCH_CONFIG, search_type="websearch"
     )
+    return qs.filter(
+        Q(search_document=search_query) | Q(search_text__contains=text)
+    ).annotate(
+        search_rank=SearchRank(F("search_document"), search_query)
+        + TrigramWordSimilarity(Value(text), "search_text"),
+    )
+
+
+def product_ordering(qs, query=""):
+    if query:
+        return qs.order_by("-search_rank", "id")
+    return qs.order_by("id")
 
 
 def available_products(requester, query="", ordering=True):
     from apps.sales.models import Product
 
+    qs = Product.objects.filter(available=True)
     if query:
-        q = Q(name__istartswith=query) | Q(tags__name=query.lower())
-        qs = Product.objects.filter(available=True).filter(q)
-    else:
-        qs = Product.objects.filter(available=True)
+        qs = search_products(qs, query)
     qs = qs.exclude(active=False)
     qs = qs.exclude(table_product=True)
     # TODO: Recheck this for basic/free plan when we have orders that have been placed
@@ -275,13 +379,14 @@ def available_products(requester, query="", ordering=True):
         wait_list=True,
     )
     if requester.is_authenticated:
+        content_filter = get_content_filter(requester)
         if not (
             staff_power(requester, "view_as")
             or staff_power(requester, "moderate_content")
         ):
-            qs = qs.exclude(user__blocking=requester)
+            qs = qs.exclude(user_id__in=content_filter.blocked_by)
             qs = qs.exclude(table_product=True)
-        qs = qs.exclude(user__blocked_by=requester)
+        qs = qs.exclude(user_id__in=content_filter.blocking)
     if ordering:
         return product_ordering(qs, query)
     return qs
@@ -703,7 +808,10 @@ def transfer_order(order, old_buyer, new_buyer, skip_notification=False, force=F
         # Can't delete the below safely.
         return
     Subscription.objects.filter(subscriber=old_buyer).delete()
-    Notification.objects.filter(user=old_buyer).update(user=new_buyer)
+    notifications = Notification.objects.filter(user=old_buyer)
+    with unread_counts_kept(notifications):
+        notifications.update(user=new_buyer)
+    ArchivedNotification.objects.filter(user=old_buyer).update(user=new_buyer)
     Comment.objects.filter(user=old_buyer).update(user=new_buyer)
     CreditCardToken.objects.filter(user=old_buyer).update(user=new_buyer)
 
@@ -1531,6 +1639,7 @@ def freeze_line_items(invoice: "Invoice"):
     for line_item in line_items:
         line_item.frozen_value = results[line_item]
         line_item.save()
+    invoice.update_totals()
 
 
 @transaction.atomic
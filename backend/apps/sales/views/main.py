@@ -1,5 +1,4 @@
 import logging
-from decimal import Decimal
 from functools import lru_cache
 from typing import Dict, Optional
 from uuid import uuid4
@@ -60,6 +59,7 @@ from apps.profiles.models import (
     trigger_reconnect,
 )
 from apps.profiles.constants import IN_SUPPORTED_COUNTRY
+from apps.profiles.content_filters import get_content_filter
 from apps.profiles.permissions import (
     AccountCurrentPermission,
     BillTo,
@@ -198,6 +198,7 @@ from apps.sales.serializers import (
     ShoppingCartSerializer,
     VendorInvoiceCreationSerializer,
 )
+from apps.sales.sampling import TOP_SELLERS, sample_products, sampled
 from apps.sales.utils import (
     PENDING,
     POSTED_ONLY,
@@ -227,7 +228,6 @@ from django.db import transaction
 from django.db.models import (
     BooleanField,
     Case,
-    Count,
     F,
     IntegerField,
     Q,
@@ -2381,12 +2381,11 @@ class ProductSearch(ListAPIView):
             products = products.filter(user__artist_profile__lgbt=True)
         if content_rating:
             products = products.filter(max_rating__gte=content_rating)
+        # Matches are ranked by relevance within the chosen ordering.
+        ordering = ["-search_rank"] if query else []
         if by_rating:
-            products = products.order_by(
-                F("user__stars").desc(nulls_last=True), "-edited_on", "id"
-            ).distinct()
-        else:
-            products = products.order_by("-edited_on", "id").distinct("edited_on", "id")
+            ordering.insert(0, F("user__stars").desc(nulls_last=True))
+        products = products.order_by(*ordering, "-edited_on", "id")
         return products.select_related("user").prefetch_related("tags")
 
 
@@ -2746,17 +2745,17 @@ class FeaturedProducts(ListAPIView):
     serializer_class = ProductSerializer
 
     def get_queryset(self):
-        return (
-            available_products(self.request.user, ordering=False)
-            .filter(Q(featured=True) | Q(user__featured=True))
-            .order_by("?")
-            .distinct()
-        )
+        return sample_products(self.request.user, "featured")
 
 
 class RandomTopSeller(RetrieveAPIView):
     def get_object(self):
-        return User.objects.filter(featured=True).order_by("?").first()
+        return sampled(
+            User.objects.filter(featured=True).exclude(
+                id__in=get_content_filter(self.request.user).blocked_by
+            ),
+            TOP_SELLERS,
+        ).first()
 
     def get(self, request):
         context = self.get_serializer_context()
@@ -2788,81 +2787,42 @@ class LowPriceProducts(ListAPIView):
     serializer_class = ProductSerializer
 
     def get_queryset(self):
-        return (
-            available_products(self.request.user, ordering=False)
-            .filter(
-                starting_price__lte=Decimal("30"),
-            )
-            .exclude(featured=True)
-            .order_by("?")
-        )
+        return sample_products(self.request.user, "low_price")
 
 
 class HighlyRatedProducts(ListAPIView):
     serializer_class = ProductSerializer
 
     def get_queryset(self):
-        return (
-            available_products(self.request.user, ordering=False)
-            .filter(user__stars__gte=4.5)
-            .exclude(featured=True)
-            .order_by("?")
-        )
+        return sample_products(self.request.user, "highly_rated")
 
 
 class LgbtProducts(ListAPIView):
     serializer_class = ProductSerializer
 
     def get_queryset(self):
-        return (
-            available_products(self.request.user, ordering=False)
-            .filter(user__artist_profile__lgbt=True)
-            .order_by("?")
-        )
+        return sample_products(self.request.user, "lgbt")
 
 
 class ArtistsOfColor(ListAPIView):
     serializer_class = ProductSerializer
 
     def get_queryset(self):
-        return (
-            available_products(self.request.user, ordering=False)
-            .filter(user__artist_profile__artist_of_color=True)
-            .order_by("?")
-        )
+        return sample_products(self.request.user, "artists_of_color")
 
 
 class NewArtistProducts(ListAPIView):
     serializer_class = ProductSerializer
 
     def get_queryset(self):
-        # Can't directly do order_by on this QS because the ORM breaks grouping by
-        # placing it before the annotation.
-        return (
-            available_products(self.request.user, ordering=False)
-            .filter(
-                id__in=Product.objects.all()
-                .annotate(
-                    completed_orders=Count(
-                        "user__sales",
-                        filter=Q(user__sales__deliverables__status=COMPLETED),
-                    )
-                )
-                .filter(completed_orders=0)
-            )
-            .order_by("?")
-        )
+        return sample_products(self.request.user, "new_artists")
 
 
 class RandomProducts(ListAPIView):
     serializer_class = ProductSerializer
 
     def get_queryset(self):
-        return (
-            available_products(self.request.user, ordering=False)
-            .filter(featured=False)
-            .order_by("?")
-        )
+        return sample_products(self.request.user, "random")
 
 
 def get_order_facts(product: Optional[Product], serializer, seller: User):
@@ -3013,23 +2973,13 @@ class ProductRecommendations(ListAPIView):
         return get_object_or_404(Product, id=self.kwargs["product"])
 
     def get_queryset(self):
-        product = self.get_object()
-        qs = available_products(self.request.user, ordering=False).exclude(
-            id=product.id
-        )
-        qs = qs.annotate(n=Count("pk"))
-        qs = qs.filter(tags__in=product.tags.all())
-        qs = qs.annotate(
-            same_artist=Case(
-                When(user=product.user, then=1),
-                default=0,
-                output_field=IntegerField(),
-            ),
+        # Neighbors are precomputed by apps.sales.recommendations, so only the
+        # viewer's filters are applied here.
+        return (
+            available_products(self.request.user, ordering=False)
+            .filter(similar_to__product=self.get_object())
+            .order_by("-similar_to__score", "id")
         )
-        qs = qs.order_by(
-            "-n", "same_artist", "user__stars", "edited_on", "id"
-        ).distinct()
-        return qs
 
 
 class DeliverableCharacterList(ListAPIView):
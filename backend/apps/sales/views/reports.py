@@ -1,11 +1,22 @@
+import heapq
 from datetime import datetime
 from decimal import Decimal
 from io import BytesIO
-from typing import Iterable, TypeVar, Any
+from itertools import islice
+from operator import itemgetter
+from tempfile import TemporaryFile
+from typing import IO, Any, Iterable, Iterator, TypeVar, Union
 
 import xlsxwriter
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    StreamingHttpResponse,
+)
 from django.views import View
 from moneyed import Money
 from pytz import UTC
@@ -45,6 +56,7 @@ from apps.sales.constants import (
     BANK_MISC_FEES,
     VENDOR,
 )
+from apps.sales.line_item_funcs import reckon_many
 from apps.sales.models import Deliverable, Invoice, TransactionRecord
 from apps.sales.serializers import (
     DeliverableSerializer,
@@ -59,12 +71,19 @@ from apps.sales.serializers import (
 from apps.sales.utils import PENDING
 from dateutil.parser import ParserError, parse
 from dateutil.relativedelta import relativedelta
-from django.db.models import F, Q
+from django.db.models import F, Q, QuerySet
 from django.utils import timezone
 from django.utils.timezone import make_aware
 from rest_framework.generics import ListAPIView
 from rest_framework.request import Request
-from rest_framework_csv.renderers import CSVRenderer
+from rest_framework_csv.renderers import CSVRenderer, CSVStreamingRenderer
+
+T = TypeVar("T")
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# How many rows to fetch at a time from each server-side cursor when streaming.
+REPORT_CHUNK_SIZE = 500
 
 
 class DateConstrained:
@@ -133,12 +152,83 @@ class DateConstrained:
         return date_filter
 
 
-class CustomerHoldingsCSV(DateConstrained, ListAPIView):
+def range_report_name(
+    base_name: str, *, start_date: datetime, end_date: datetime
+) -> str:
+    name = base_name
+    name += "-from-" + str(start_date.date())
+    if end_date:
+        name += "-to-" + str(end_date.date())
+    return name
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[list[T]]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class CSVReport:
+    """
+    Streams CSV rows to the client as they're serialized, rather than rendering the
+    whole report in memory first. Records are read through a server-side cursor
+    chunk_size at a time, with related data fetched once per chunk, so exports
+    start downloading immediately and use flat memory however wide the date range.
+    """
+
+    report_name = "report"
+    renderer_classes = [CSVRenderer]
+    start_date: datetime
+    end_date: datetime
+    chunk_size = REPORT_CHUNK_SIZE
+    select_related_fields: tuple[str, ...] = ()
+    prefetch_related_fields: tuple[str, ...] = ()
+
+    def chunk_context(self, chunk: list) -> dict[str, Any]:
+        """
+        Extra serializer context for one chunk of records, for data that's better
+        fetched for many rows at once.
+        """
+        return {}
+
+    def stream_rows(self, queryset: QuerySet) -> Iterator[dict[str, Any]]:
+        queryset = queryset.select_related(*self.select_related_fields)
+        queryset = queryset.prefetch_related(*self.prefetch_related_fields)
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+        for chunk in chunked(
+            queryset.iterator(chunk_size=self.chunk_size), self.chunk_size
+        ):
+            chunk_context = {**context, **self.chunk_context(chunk)}
+            for instance in chunk:
+                yield serializer_class(instance=instance, context=chunk_context).data
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = CSVStreamingRenderer().render(
+            self.stream_rows(queryset),
+            renderer_context=self.get_renderer_context(),
+        )
+        return StreamingHttpResponse(
+            rows, content_type=f"{CSVRenderer.media_type}; charset=utf-8"
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        name = range_report_name(
+            self.report_name,
+            start_date=self.start_date,
+            end_date=self.end_date,
+        )
+        response["Content-Disposition"] = f"attachment; filename={name}.csv"
+        return response
+
+
+class CustomerHoldingsCSV(CSVReport, DateConstrained, ListAPIView):
     date_fields = ["finalized_on"]
     serializer_class = HoldingsSummarySerializer
     permission_classes = [IsSuperuser]
     pagination_class = None
-    renderer_classes = [CSVRenderer]
 
     def get_queryset(self):
         return (
@@ -175,31 +265,20 @@ class CustomerHoldingsCSV(DateConstrained, ListAPIView):
         return response
 
 
-def range_report_name(
-    base_name: str, *, start_date: datetime, end_date: datetime
-) -> str:
-    name = base_name
-    name += "-from-" + str(start_date.date())
-    if end_date:
-        name += "-to-" + str(end_date.date())
-    return name
-
-
-class CSVReport:
-    report_name = "report"
-    renderer_classes = [CSVRenderer]
-    start_date: datetime
-    end_date: datetime
+class InvoiceTotalsReport:
+    """
+    Invoices in the report use their cached totals. Any in a chunk which don't have
+    them stored yet are tabulated together in one batch, rather than once per row.
+    For use with serializers based on InvoiceTotalsMixin.
+    """
 
-    def finalize_response(self, request, response, *args, **kwargs):
-        response = super().finalize_response(request, response, *args, **kwargs)
-        name = range_report_name(
-            self.report_name,
-            start_date=self.start_date,
-            end_date=self.end_date,
+    def chunk_context(self, chunk: list) -> dict[str, Any]:
+        context = super().chunk_context(chunk)
+        missing = [invoice.id for invoice in chunk if invoice.cached_total is None]
+        context["totals"] = (
+            reckon_many(Invoice.objects.filter(id__in=missing)) if missing else {}
         )
-        response["Content-Disposition"] = f"attachment; filename={name}.csv"
-        return response
+        return context
 
 
 class OrderValues(CSVReport, ListAPIView, DateConstrained):
@@ -208,6 +287,7 @@ class OrderValues(CSVReport, ListAPIView, DateConstrained):
     permission_classes = [IsSuperuser]
     pagination_class = None
     report_name = "order-report"
+    select_related_fields = ("order__buyer", "order__seller", "tip_invoice")
 
     def get_queryset(self):
         return (
@@ -245,12 +325,15 @@ class OrderValues(CSVReport, ListAPIView, DateConstrained):
         return context
 
 
-class SubscriptionReportCSV(CSVReport, ListAPIView, DateConstrained):
+class SubscriptionReportCSV(
+    InvoiceTotalsReport, CSVReport, ListAPIView, DateConstrained
+):
     serializer_class = InvoiceReportSerializer
     permission_classes = [IsSuperuser]
     pagination_class = None
     date_fields = ["paid_on"]
     report_name = "subscription-report"
+    select_related_fields = ("bill_to", "issued_by")
 
     def get_renderer_context(self):
         context = super().get_renderer_context()
@@ -281,12 +364,15 @@ class SubscriptionReportCSV(CSVReport, ListAPIView, DateConstrained):
         )
 
 
-class UnaffiliatedSaleReportCSV(CSVReport, ListAPIView, DateConstrained):
+class UnaffiliatedSaleReportCSV(
+    InvoiceTotalsReport, CSVReport, ListAPIView, DateConstrained
+):
     serializer_class = UnaffiliatedInvoiceSerializer
     permission_classes = [IsSuperuser]
     pagination_class = None
     date_fields = ["paid_on"]
     report_name = "unaffiliated-sales-report"
+    select_related_fields = ("bill_to", "issued_by")
 
     def get_renderer_context(self):
         context = super().get_renderer_context()
@@ -324,6 +410,7 @@ class TipReportCSV(CSVReport, ListAPIView, DateConstrained):
     pagination_class = None
     date_fields = ["paid_on"]
     report_name = "tip-report"
+    select_related_fields = ("bill_to", "issued_by")
 
     def get_renderer_context(self):
         context = super().get_renderer_context()
@@ -369,6 +456,8 @@ class ReconciliationReport(CSVReport, ListAPIView, DateConstrained):
     permission_classes = [StaffPower("view_financials")]
     pagination_class = None
     report_name = "reconciliation-report"
+    select_related_fields = ("payer", "payee")
+    prefetch_related_fields = ("targets",)
 
     def get_renderer_context(self):
         context = super().get_renderer_context()
@@ -412,6 +501,7 @@ class PayoutReportCSV(CSVReport, ListAPIView, DateConstrained):
     permission_classes = [StaffPower("view_financials")]
     pagination_class = None
     report_name = "payout-report"
+    select_related_fields = ("payee",)
 
     def get_renderer_context(self):
         context = super().get_renderer_context()
@@ -475,32 +565,99 @@ class JournalReport(View, DateConstrained):
     """
 
     def get(self, request):
-        if not request.user.is_authenticated and request.user.is_superuser:
+        if not (request.user.is_authenticated and request.user.is_superuser):
             return HttpResponse(
                 content="Access denied.",
                 status=status.HTTP_403_FORBIDDEN,
             )
-        report = build_journal_report(
+        limit = self.start_date + relativedelta(
+            days=settings.JOURNAL_REPORT_INLINE_DAYS
+        )
+        if self.end_date > limit:
+            # Too long to build while the request waits.
+            self.queue_report()
+            return HttpResponse(
+                content="This report covers too long a period to build right away. "
+                "It will be emailed to you once it's ready.",
+                content_type="text/plain",
+                status=status.HTTP_202_ACCEPTED,
+            )
+        # Written to a temporary file rather than memory, so that wide date ranges
+        # don't exhaust the web worker. Closing the response removes the file.
+        report = TemporaryFile()
+        write_journal_report(
+            report,
             start_date=self.start_date,
             end_date=self.end_date,
+            streaming=True,
         )
-        # Set up the Http response.
-        name = range_report_name(
-            "journal-report",
+        report.seek(0)
+        return FileResponse(
+            report,
+            as_attachment=True,
+            filename=journal_report_filename(
+                start_date=self.start_date, end_date=self.end_date
+            ),
+            content_type=XLSX_CONTENT_TYPE,
+        )
+
+    def post(self, request):
+        """
+        Build the report in the background and email it to the requester, for date
+        ranges too large to wait on.
+        """
+        if not (request.user.is_authenticated and request.user.is_superuser):
+            return HttpResponse(
+                content="Access denied.",
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        self.queue_report()
+        return HttpResponse(status=status.HTTP_202_ACCEPTED)
+
+    def queue_report(self):
+        from apps.sales.tasks import send_journal_report
+
+        send_journal_report.delay(
+            self.request.user.id,
             start_date=self.start_date,
             end_date=self.end_date,
         )
-        filename = f"{name}.xlsx"
-        response = HttpResponse(
-            report,
-            content_type="application/vnd.openxmlformats-officedocument."
-            "spreadsheetml.sheet",
+
+
+class JournalReportDownload(View):
+    """
+    Serves a journal report that was too large to email, and so was saved to storage
+    by the background task instead.
+    """
+
+    def get(self, request, report_id, filename):
+        if not (request.user.is_authenticated and request.user.is_superuser):
+            return HttpResponse(
+                content="Access denied.",
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        name = journal_report_storage_name(report_id=report_id, filename=filename)
+        if not default_storage.exists(name):
+            raise Http404
+        return FileResponse(
+            default_storage.open(name),
+            as_attachment=True,
+            filename=filename,
+            content_type=XLSX_CONTENT_TYPE,
         )
-        response["Content-Disposition"] = f"attachment; filename={filename}"
-        return response
 
 
-T = TypeVar("T")
+def journal_report_filename(*, start_date: datetime, end_date: datetime) -> str:
+    name = range_report_name(
+        "journal-report",
+        start_date=start_date,
+        end_date=end_date,
+    )
+    return f"{name}.xlsx"
+
+
+def journal_report_storage_name(*, report_id: Any, filename: str) -> str:
+    return f"reports/journal/{report_id}/{filename}"
 
 
 def all_by_date(
@@ -519,15 +676,45 @@ def all_by_date(
     return entries
 
 
+def stream_by_date(
+    iterables: tuple[tuple[QuerySet, str, str], ...],
+    chunk_size: int = REPORT_CHUNK_SIZE,
+) -> Iterator[tuple[datetime, str, Any]]:
+    """
+    Streaming version of all_by_date. Each queryset is read in order of its date
+    field through a server-side cursor, and the results are merged lazily, so only
+    a chunk of each is held in memory at a time.
+    """
+
+    def dated(queryset: QuerySet, key: str, label: str):
+        for entry in queryset.order_by(key, "pk").iterator(chunk_size=chunk_size):
+            yield getattr(entry, key), label, entry
+
+    return heapq.merge(
+        *(dated(*iterable_set) for iterable_set in iterables),
+        key=itemgetter(0),
+    )
+
+
+def report_entries(
+    iterables: tuple[tuple[QuerySet, str, str], ...], streaming: bool
+) -> Iterable[tuple[datetime, str, Any]]:
+    if streaming:
+        return stream_by_date(iterables)
+    return all_by_date(iterables=iterables)
+
+
 def write_revenue_entries(
     worksheet: Worksheet,
-    entries: list[tuple[datetime, str, Any]],
+    entries: Iterable[tuple[datetime, str, Any]],
     date_format: Format,
     headers: dict[str, int],
     sum_columns: tuple[str, ...] = tuple(),
     start_row: int = 1,
+    totals: dict[str, Money] | None = None,
 ):
     row = start_row
+    totals = totals or {}
     for timestamp, label, entry in entries:
         match label:
             case "paid_deliverables":
@@ -540,10 +727,13 @@ def write_revenue_entries(
                 del data["card_fees"]
                 del data["price"]
             case "other_invoices":
-                if entry.total().amount == Decimal(0):
+                total = totals[entry.id] if entry.id in totals else entry.total()
+                if total.amount == Decimal(0):
                     # We should probably find a way not to need these zero invoices.
                     continue
-                data = InvoiceReportSerializer(instance=entry).data
+                data = InvoiceReportSerializer(
+                    instance=entry, context={"totals": totals}
+                ).data
                 data["buyer"], data["seller"] = data["bill_to"], data["issued_by"]
                 data["price"] = data["total"]
                 # Do we really need to duplicate this?
@@ -576,7 +766,7 @@ def write_revenue_entries(
 
 def write_expense_entries(
     worksheet: Worksheet,
-    entries: list[tuple[datetime, str, Any]],
+    entries: Iterable[tuple[datetime, str, Any]],
     date_format: Format,
     headers: dict[str, int],
     sum_columns: tuple[str, ...] = tuple(),
@@ -620,6 +810,7 @@ def populate_expense_worksheet(
     start_date: datetime,
     end_date: datetime,
     date_format: Format,
+    streaming: bool = False,
 ) -> None:
     """
     Adds the contents of the expense worksheet.
@@ -639,11 +830,12 @@ def populate_expense_worksheet(
         finalized_on__gt=start_date,
         finalized_on__lte=end_date,
     )
-    entries = all_by_date(
-        iterables=(
+    entries = report_entries(
+        (
             (payouts, "finalized_on", "payouts"),
             (fees, "finalized_on", "fees"),
         ),
+        streaming,
     )
     headers: dict[str, int] = {
         key: index
@@ -674,7 +866,9 @@ def populate_expense_worksheet(
             "processor fees",
         ),
     )
-    worksheet.autofit()
+    if not streaming:
+        # Autofit needs all the rows in memory, which streaming avoids keeping.
+        worksheet.autofit()
     worksheet.set_column(headers["date"], headers["date"], width=20)
     worksheet.set_column(headers["amount"], headers["amount"], width=10)
 
@@ -685,6 +879,7 @@ def populate_revenue_worksheet(
     start_date: datetime,
     end_date: datetime,
     date_format: Format,
+    streaming: bool = False,
 ) -> None:
     """
     Adds the contents of the revenue worksheet.
@@ -717,13 +912,14 @@ def populate_revenue_worksheet(
         payee=None,
         category=TOP_UP,
     )
-    entries = all_by_date(
-        iterables=(
+    entries = report_entries(
+        (
             (paid, "paid_on", "paid_deliverables"),
             (refunded, "refunded_on", "refunded_deliverables"),
             (invoices, "paid_on", "other_invoices"),
             (top_ups, "finalized_on", "top_ups"),
         ),
+        streaming,
     )
     headers: dict[str, int] = {
         key: index
@@ -753,6 +949,13 @@ def populate_revenue_worksheet(
         entries=entries,
         date_format=date_format,
         headers=headers,
+        # When streaming, invoices missing their cached totals are tabulated one at a
+        # time rather than holding those totals all at once.
+        totals=(
+            None
+            if streaming
+            else reckon_many(invoices.filter(cached_total__isnull=True))
+        ),
         sum_columns=(
             "price",
             "card_fees",
@@ -763,7 +966,8 @@ def populate_revenue_worksheet(
             "top_up",
         ),
     )
-    worksheet.autofit()
+    if not streaming:
+        worksheet.autofit()
     worksheet.set_column(headers["date"], headers["date"], width=20)
     worksheet.set_column(headers["price"], headers["price"], width=10)
 
@@ -772,6 +976,7 @@ def populate_balances_worksheet(
     worksheet: Worksheet,
     *,
     end_date: datetime,
+    streaming: bool = False,
 ) -> None:
     """
     Populate the balances worksheet.
@@ -798,6 +1003,8 @@ def populate_balances_worksheet(
         worksheet.write(row, column, header)
     row += 1
     start_row = row
+    if streaming:
+        users = users.iterator(chunk_size=REPORT_CHUNK_SIZE)
     for user in users:
         summary = HoldingsSummarySerializer(instance=user, context=context).data
         if summary["escrow"] == Decimal(0) and summary["holdings"] == Decimal(0):
@@ -813,22 +1020,30 @@ def populate_balances_worksheet(
         end_cell = xl_rowcol_to_cell(end_row, column_number)
         worksheet.write(row, column_number, f"=SUM({start_cell}:{end_cell})")
 
-    worksheet.autofit()
+    if not streaming:
+        worksheet.autofit()
     worksheet.set_column(headers["escrow"], headers["escrow"], width=10)
 
 
-def build_journal_report(*, start_date: datetime, end_date: datetime) -> BytesIO:
+def write_journal_report(
+    output: Union[str, IO[bytes]],
+    *,
+    start_date: datetime,
+    end_date: datetime,
+    streaming: bool = False,
+) -> None:
     """
-    Build the journal report XLSX file.
+    Write the journal report XLSX file to output, which may be a path or a file
+    object. In streaming mode, records are read through server-side cursors and
+    rows are flushed to disk as they're written, so memory use stays flat no
+    matter how wide the date range is.
     """
-    output = BytesIO()
-    workbook = xlsxwriter.Workbook(
-        output,
-        options={
-            "in_memory": True,
-            "remove_timezone": True,
-        },
-    )
+    options = {"remove_timezone": True}
+    if streaming:
+        options["constant_memory"] = True
+    else:
+        options["in_memory"] = True
+    workbook = xlsxwriter.Workbook(output, options=options)
     date_format = workbook.add_format(
         {
             "num_format": "YYYY/mm/dd hh:mm:ss",
@@ -843,17 +1058,28 @@ def build_journal_report(*, start_date: datetime, end_date: datetime) -> BytesIO
         start_date=start_date,
         end_date=end_date,
         date_format=date_format,
+        streaming=streaming,
     )
     populate_expense_worksheet(
         expense,
         start_date=start_date,
         end_date=end_date,
         date_format=date_format,
+        streaming=streaming,
     )
     populate_balances_worksheet(
         balances,
         end_date=end_date,
+        streaming=streaming,
     )
     workbook.close()
+
+
+def build_journal_report(*, start_date: datetime, end_date: datetime) -> BytesIO:
+    """
+    Build the journal report XLSX file in memory.
+    """
+    output = BytesIO()
+    write_journal_report(output, start_date=start_date, end_date=end_date)
     output.seek(0)
     return output
@@ -1,7 +1,9 @@
 from csv import DictReader
 from decimal import Decimal
-from io import StringIO
+from io import BytesIO, StringIO
 from unittest.mock import patch
+from uuid import uuid4
+from zipfile import ZipFile
 
 from dateutil.relativedelta import relativedelta
 
@@ -31,7 +33,8 @@ from apps.sales.constants import (
     TIPPING,
     FUND,
 )
-from apps.sales.models import Deliverable, StripeAccount, TransactionRecord
+from apps.sales.line_item_funcs import reckon_many
+from apps.sales.models import Deliverable, Invoice, StripeAccount, TransactionRecord
 from apps.sales.tests.factories import (
     DeliverableFactory,
     InvoiceFactory,
@@ -43,7 +46,15 @@ from apps.sales.utils import (
     finalize_deliverable,
     get_term_invoice,
 )
+from apps.sales.views.reports import (
+    SubscriptionReportCSV,
+    all_by_date,
+    journal_report_storage_name,
+    stream_by_date,
+)
 from dateutil.parser import parse
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.test import override_settings
 from freezegun import freeze_time
 from moneyed import Money
@@ -51,6 +62,10 @@ from rest_framework import status
 from rest_framework.response import Response
 
 
+def streamed_csv(response) -> StringIO:
+    return StringIO(b"".join(response.streaming_content).decode("utf-8"))
+
+
 class TestCustomerHoldings(APITestCase):
     def test_customer_holdings(self):
         buyer = UserFactory.create()
@@ -93,7 +108,7 @@ class TestCustomerHoldings(APITestCase):
             "/api/sales/v1/reports/customer-holdings/csv/"
             f"?end_date={end_date.year}-{end_date.month}-{end_date.day}"
         )
-        reader = DictReader(StringIO(response.content.decode("utf-8")))
+        reader = DictReader(streamed_csv(response))
         lines = [line for line in reader]
         self.assertEqual(len(lines), 1)
         self.assertEqual(lines[0]["username"], deliverable.order.seller.username)
@@ -185,7 +200,7 @@ class TestUnaffiliatedSales(APITestCase):
                 "end_date": utc_now().date().isoformat(),
             },
         )
-        reader = DictReader(StringIO(response.content.decode("utf-8")))
+        reader = DictReader(streamed_csv(response))
         lines = [line for line in reader]
         self.assertEqual(len(lines), 3)
         # Card
@@ -264,7 +279,7 @@ class TestPayoutReport(APITestCase):
             },
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        reader = DictReader(StringIO(response.content.decode("utf-8")))
+        reader = DictReader(streamed_csv(response))
         lines = [line for line in reader]
         self.assertEqual(len(lines), 1)
         self.assertEqual(lines[0]["id"], transaction.id)
@@ -282,6 +297,127 @@ class TestPayoutReport(APITestCase):
         self.assertEqual(parse(lines[0]["finalized_on"]), transaction.finalized_on)
 
 
+class TestJournalReport(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.payout = TransactionRecordFactory.create(
+            source=HOLDINGS,
+            destination=PAYOUT_ACCOUNT,
+            finalized_on=utc_now() - relativedelta(days=2),
+            status=SUCCESS,
+        )
+        self.payout.payee = self.payout.payer
+        self.payout.save()
+        self.range = {
+            "start_date": (utc_now() - relativedelta(days=5)).date().isoformat(),
+            "end_date": utc_now().date().isoformat(),
+        }
+
+    def test_download(self):
+        self.login(UserFactory.create(is_superuser=True))
+        response = self.client.get("/api/sales/v1/reports/journal-report/", self.range)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("attachment;", response["Content-Disposition"])
+        workbook = ZipFile(BytesIO(b"".join(response.streaming_content)))
+        sheets = workbook.read("xl/workbook.xml").decode("utf-8")
+        for name in ("revenue", "expense", "balances"):
+            self.assertIn(f'name="{name}"', sheets)
+        # Streamed rows are written with inline strings.
+        expense = workbook.read("xl/worksheets/sheet2.xml").decode("utf-8")
+        self.assertIn(self.payout.id, expense)
+
+    def test_download_denied(self):
+        self.login(UserFactory.create())
+        response = self.client.get("/api/sales/v1/reports/journal-report/", self.range)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @patch("apps.sales.tasks.send_journal_report.delay")
+    def test_download_long_range_queued(self, mock_delay):
+        staff = UserFactory.create(is_superuser=True)
+        self.login(staff)
+        response = self.client.get(
+            "/api/sales/v1/reports/journal-report/",
+            {
+                "start_date": (utc_now() - relativedelta(years=1)).date().isoformat(),
+                "end_date": utc_now().date().isoformat(),
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        mock_delay.assert_called_once()
+        self.assertEqual(mock_delay.call_args.args, (staff.id,))
+
+    @patch("apps.sales.tasks.send_journal_report.delay")
+    def test_queue(self, mock_delay):
+        staff = UserFactory.create(is_superuser=True)
+        self.login(staff)
+        response = self.client.post(
+            "/api/sales/v1/reports/journal-report/?start_date="
+            f"{self.range['start_date']}&end_date={self.range['end_date']}",
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        mock_delay.assert_called_once()
+        self.assertEqual(mock_delay.call_args.args, (staff.id,))
+
+    @patch("apps.sales.tasks.send_journal_report.delay")
+    def test_queue_denied(self, mock_delay):
+        self.login(UserFactory.create())
+        response = self.client.post("/api/sales/v1/reports/journal-report/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        mock_delay.assert_not_called()
+
+    def stored_report(self):
+        report_id = uuid4()
+        name = default_storage.save(
+            journal_report_storage_name(report_id=report_id, filename="report.xlsx"),
+            ContentFile(b"PK report"),
+        )
+        self.addCleanup(default_storage.delete, name)
+        return f"/api/sales/v1/reports/journal-report/{report_id}/report.xlsx"
+
+    def test_stored_download(self):
+        self.login(UserFactory.create(is_superuser=True))
+        response = self.client.get(self.stored_report())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("attachment;", response["Content-Disposition"])
+        self.assertEqual(b"".join(response.streaming_content), b"PK report")
+
+    def test_stored_download_denied(self):
+        self.login(UserFactory.create())
+        response = self.client.get(self.stored_report())
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_stored_download_missing(self):
+        self.login(UserFactory.create(is_superuser=True))
+        response = self.client.get(
+            f"/api/sales/v1/reports/journal-report/{uuid4()}/report.xlsx"
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stream_by_date_matches(self):
+        TransactionRecordFactory.create(
+            finalized_on=utc_now() - relativedelta(days=3), status=SUCCESS
+        )
+        TransactionRecordFactory.create(
+            finalized_on=utc_now() - relativedelta(days=1), status=SUCCESS
+        )
+        iterables = (
+            (
+                TransactionRecord.objects.filter(source=HOLDINGS),
+                "finalized_on",
+                "payouts",
+            ),
+            (
+                TransactionRecord.objects.exclude(source=HOLDINGS),
+                "finalized_on",
+                "others",
+            ),
+        )
+        self.assertEqual(
+            list(stream_by_date(iterables, chunk_size=1)),
+            all_by_date(iterables=iterables),
+        )
+
+
 class TestTipReport(APITestCase):
     @freeze_time("2022-03-25")
     def test_tip_report_all_data_available(self):
@@ -366,7 +502,7 @@ class TestTipReport(APITestCase):
                 "end_date": utc_now().date().isoformat(),
             },
         )
-        reader = DictReader(StringIO(response.content.decode("utf-8")))
+        reader = DictReader(streamed_csv(response))
         lines = [line for line in reader]
         self.assertEqual(len(lines), 1)
         self.assertEqual(lines[0]["id"], invoice.id)
@@ -422,7 +558,7 @@ class TestTipReport(APITestCase):
                 "end_date": utc_now().date().isoformat(),
             },
         )
-        reader = DictReader(StringIO(response.content.decode("utf-8")))
+        reader = DictReader(streamed_csv(response))
         lines = [line for line in reader]
         self.assertEqual(len(lines), 1)
         self.assertEqual(lines[0]["id"], invoice.id)
@@ -483,7 +619,7 @@ class TestTipReport(APITestCase):
                 "end_date": utc_now().date().isoformat(),
             },
         )
-        reader = DictReader(StringIO(response.content.decode("utf-8")))
+        reader = DictReader(streamed_csv(response))
         lines = [line for line in reader]
         self.assertEqual(len(lines), 1)
         self.assertEqual(lines[0]["id"], invoice.id)
@@ -543,7 +679,7 @@ class TestSubscriptionReport(APITestCase):
             },
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        reader = DictReader(StringIO(response.content.decode("utf-8")))
+        reader = DictReader(streamed_csv(response))
         lines = [line for line in reader]
         self.assertEqual(len(lines), 1)
         self.assertEqual(lines[0]["id"], term_invoice.id)
@@ -552,6 +688,50 @@ class TestSubscriptionReport(APITestCase):
         self.assertEqual(lines[0]["status"], "Paid")
         self.assertEqual(parse(lines[0]["paid_on"]), term_invoice.paid_on)
 
+    @freeze_time("2022-03-25")
+    def test_subscription_report_chunked(self):
+        invoices = []
+        for index in range(3):
+            user = UserFactory.create()
+            invoice = get_term_invoice(user)
+            LineItemFactory.create(
+                invoice=invoice,
+                amount=Money(f"{index + 1}.00", "USD"),
+            )
+            invoice.paid_on = utc_now().replace(day=5 + index)
+            invoice.status = PAID
+            invoice.save()
+            invoices.append(invoice)
+        # Only invoices without cached totals should need their lines read.
+        Invoice.objects.filter(id=invoices[2].id).update(cached_total=None)
+        self.login(UserFactory.create(is_superuser=True))
+        with (
+            patch.object(SubscriptionReportCSV, "chunk_size", 2),
+            patch(
+                "apps.sales.views.reports.reckon_many", wraps=reckon_many
+            ) as mock_reckon_many,
+        ):
+            response = self.client.get(
+                "/api/sales/v1/reports/subscription-report/csv/",
+                {
+                    "start_date": utc_now().replace(day=1).date().isoformat(),
+                    "end_date": utc_now().date().isoformat(),
+                },
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            lines = list(DictReader(streamed_csv(response)))
+        mock_reckon_many.assert_called_once()
+        self.assertEqual(
+            [invoice.id for invoice in mock_reckon_many.call_args.args[0]],
+            [invoices[2].id],
+        )
+        self.assertEqual([line["id"] for line in lines], [i.id for i in invoices])
+        self.assertEqual(
+            [line["total"] for line in lines],
+            [str(invoice.total().amount) for invoice in invoices],
+        )
+
     # Adding a few tests to check the date filter since this is a simple endpoint.
 
     @freeze_time("2022-03-25")
@@ -601,7 +781,7 @@ class TestSubscriptionReport(APITestCase):
             "/api/sales/v1/reports/subscription-report/csv/",
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        reader = DictReader(StringIO(response.content.decode("utf-8")))
+        reader = DictReader(streamed_csv(response))
         lines = [line for line in reader]
         self.assertEqual(len(lines), 1)
         self.assertEqual(lines[0]["id"], term_invoice.id)
@@ -661,7 +841,7 @@ class TestSubscriptionReport(APITestCase):
             },
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        reader = DictReader(StringIO(response.content.decode("utf-8")))
+        reader = DictReader(streamed_csv(response))
         lines = [line for line in reader]
         self.assertEqual(len(lines), 1)
         self.assertEqual(lines[0]["id"], term_invoice.id)
@@ -681,7 +861,7 @@ class TestOrderValues(APITestCase, DeliverableChargeMixin):
 
     def get_lines(self, response: Response):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        reader = DictReader(StringIO(response.content.decode("utf-8")))
+        reader = DictReader(streamed_csv(response))
         return [line for line in reader]
 
     @patch("apps.sales.tasks.stripe")
@@ -183,6 +183,18 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Serialized broadcast payloads are shared between consumers through the cache for
+# this many seconds. Consumers waiting on another to serialize a payload check back
+# every BROADCAST_CACHE_WAIT_INTERVAL seconds, up to BROADCAST_CACHE_WAIT_STEPS
+# times, before serializing it themselves.
+BROADCAST_CACHE_TIMEOUT = int(get_env("BROADCAST_CACHE_TIMEOUT", "30"))
+BROADCAST_CACHE_WAIT_INTERVAL = float(get_env("BROADCAST_CACHE_WAIT_INTERVAL", "0.05"))
+BROADCAST_CACHE_WAIT_STEPS = int(get_env("BROADCAST_CACHE_WAIT_STEPS", "20"))
+
+# Model updates are sent to each watcher as the fields which changed since the last
+# payload it was sent, with the full payload sent every this many updates.
+WEBSOCKET_SNAPSHOT_INTERVAL = int(get_env("WEBSOCKET_SNAPSHOT_INTERVAL", "20"))
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -591,6 +603,54 @@ SESSION_COOKIE_AGE = int(get_env("SESSION_COOKIE_AGE", str(60 * 60 * 24 * 365)))
 
 TELEGRAM_BOT_KEY = get_env("TELEGRAM_BOT_KEY", "")
 TELEGRAM_BOT_USERNAME = get_env("TELEGRAM_BOT_USERNAME", "")
+# Telegram starts refusing messages from bots sending more than about thirty a second.
+TELEGRAM_MAX_CONCURRENCY = int(get_env("TELEGRAM_MAX_CONCURRENCY", "8"))
+TELEGRAM_RATE_LIMIT = float(get_env("TELEGRAM_RATE_LIMIT", "25"))
+
+# Number of subscribers each notification delivery task handles.
+NOTIFICATION_BATCH_SIZE = int(get_env("NOTIFICATION_BATCH_SIZE", "50"))
+# Subscriber lists for notification targets are cached for up to this many seconds.
+# They're dropped whenever the subscriptions or email preferences behind them change.
+NOTIFICATION_SUBSCRIBERS_CACHE_TIMEOUT = int(
+    get_env("NOTIFICATION_SUBSCRIBERS_CACHE_TIMEOUT", str(60 * 60))
+)
+# Viewers' block lists and tag blacklists are cached for up to this many seconds, for
+# filtering listings. They're dropped whenever the viewer's blocks or blacklists change.
+CONTENT_FILTER_CACHE_TIMEOUT = int(
+    get_env("CONTENT_FILTER_CACHE_TIMEOUT", str(60 * 60))
+)
+# The front page feeds pick from pools of this many eligible IDs, drawn at random
+# and refreshed every few minutes, and sample this many IDs from them per request.
+SAMPLING_POOL_SIZE = int(get_env("SAMPLING_POOL_SIZE", "2000"))
+SAMPLING_SIZE = int(get_env("SAMPLING_SIZE", "100"))
+# Pools are rebuilt on every request while testing, so they always match the test data.
+SAMPLING_POOL_TIMEOUT = int(
+    get_env("SAMPLING_POOL_TIMEOUT", "0" if TESTING else str(15 * 60))
+)
+# Product recommendations keep this many of each product's closest neighbors, scored
+# by shared tags, with bonuses for sharing an artist and for highly rated artists.
+PRODUCT_SIMILARITY_NEIGHBORS = int(get_env("PRODUCT_SIMILARITY_NEIGHBORS", "100"))
+PRODUCT_SIMILARITY_SAME_ARTIST_WEIGHT = float(
+    get_env("PRODUCT_SIMILARITY_SAME_ARTIST_WEIGHT", "0.1")
+)
+PRODUCT_SIMILARITY_STARS_WEIGHT = float(
+    get_env("PRODUCT_SIMILARITY_STARS_WEIGHT", "0.1")
+)
+# Products whose neighbors are written per transaction in the nightly batch.
+PRODUCT_SIMILARITY_BATCH_SIZE = int(get_env("PRODUCT_SIMILARITY_BATCH_SIZE", "500"))
+# Journal reports covering more than this many days are built in the background and
+# emailed, rather than downloaded directly. About a quarter covers the default range.
+JOURNAL_REPORT_INLINE_DAYS = int(get_env("JOURNAL_REPORT_INLINE_DAYS", "93"))
+# Emailed journal reports larger than this many bytes are saved to storage and linked
+# instead of attached, to stay under mail size limits.
+JOURNAL_REPORT_ATTACHMENT_LIMIT = int(
+    get_env("JOURNAL_REPORT_ATTACHMENT_LIMIT", str(5 * 1024 * 1024))
+)
+# Read notifications for events older than this many days are moved to the archive.
+NOTIFICATION_ARCHIVE_DAYS = int(get_env("NOTIFICATION_ARCHIVE_DAYS", "90"))
+NOTIFICATION_ARCHIVE_BATCH_SIZE = int(
+    get_env("NOTIFICATION_ARCHIVE_BATCH_SIZE", "5000")
+)
 
 RABBIT_HOST = get_env("RABBIT_HOST", "rabbit")
 RABBIT_PORT = int(get_env("RABBIT_PORT", "5672"))
@@ -658,8 +718,38 @@ CELERYBEAT_SCHEDULE = {
         "task": "apps.sales.tasks.redact_scheduled_deliverables",
         "schedule": crontab(hour="5", minute="15"),
     },
+    "create_ledger_checkpoint": {
+        "task": "apps.sales.tasks.create_ledger_checkpoint",
+        "schedule": crontab(hour="0", minute="30"),
+    },
+    "reconcile_ledger": {
+        "task": "apps.sales.tasks.reconcile_ledger",
+        "schedule": crontab(hour="0", minute="45"),
+    },
+    "fold_ledger_balances": {
+        "task": "apps.sales.tasks.fold_ledger_balances",
+        "schedule": crontab(minute="*/5"),
+    },
+    "archive_notifications": {
+        "task": "apps.lib.tasks.archive_notifications",
+        "schedule": crontab(hour="4", minute="0"),
+    },
+    "compute_product_similarities": {
+        "task": "apps.sales.tasks.compute_product_similarities",
+        "schedule": crontab(hour="4", minute="30"),
+    },
+    "refresh_sampling_pools": {
+        "task": "apps.sales.tasks.refresh_sampling_pools",
+        "schedule": crontab(minute="*/5"),
+    },
 }
 
+# When set, every balance read from the running ledger balances is checked against
+# a full aggregate of the ledger, raising an error if they disagree. This is too slow
+# to leave on in production, where the reconcile_ledger task checks the balances
+# nightly instead.
+LEDGER_VERIFY_BALANCES = bool(int(get_env("LEDGER_VERIFY_BALANCES", TESTING)))
+
 ENV_NAME = get_env("ENV_NAME", "prod")
 
 OTP_TOTP_ISSUER = get_env("OTP_TOTP_ISSUER", "Artconomy")
@@ -0,0 +1,189 @@
+//! Benchmarks for the line item calculations, run with `cargo bench`.
+//!
+//! Invoices are generated at several sizes with their lines spread over many priority tiers, which
+//! is the worst case for the tabulation. Criterion keeps machine-readable results for every run
+//! under target/criterion, and compares each run against the last one saved.
+
+use criterion::{criterion_group, criterion_main, BatchSize, BenchmarkId, Criterion};
+use line_items::data::{
+    Account, Category, DeliverableLinesContext, LineItem, LineType, Pricing, ServicePlan,
+};
+use line_items::funcs::{
+    deliverable_lines, divide_amount, get_totals, lines_by_priority, PricingEngine,
+};
+use line_items::s;
+use rust_decimal_macros::dec;
+use std::hint::black_box;
+
+const SIZES: [usize; 3] = [5, 50, 500];
+const QUANTIZATION: u32 = 2;
+
+fn pricing() -> Pricing {
+    Pricing {
+        plans: vec![ServicePlan {
+            id: 1,
+            name: s!("Basic"),
+            per_deliverable_price: s!("1.35"),
+            max_simultaneous_orders: 0,
+            waitlisting: false,
+            shield_static_price: s!("3.50"),
+            shield_percentage_price: s!("5"),
+            paypal_invoicing: false,
+            connection_fee_waived: false,
+        }],
+        minimum_price: s!("1.00"),
+        table_percentage: s!("10"),
+        table_static: s!("5.00"),
+        table_tax: s!("8.25"),
+        processing_percentage: s!("1"),
+        processing_static: s!("0.15"),
+        stripe_blended_rate_static: s!("0.30"),
+        stripe_active_account_monthly_fee: s!("2.00"),
+        stripe_blended_rate_percentage: s!("3.30"),
+        stripe_payout_cross_border_percentage: s!("1"),
+        stripe_payout_static: s!(".25"),
+        stripe_payout_percentage: s!("1.25"),
+        international_conversion_percentage: s!("1"),
+        preferred_plan: s!("Basic"),
+    }
+}
+
+fn add_on(id: i32, priority: i16, amount: &str, percentage: &str) -> LineItem {
+    LineItem {
+        id,
+        priority,
+        kind: LineType::AddOn,
+        amount: s!(amount),
+        frozen_value: None,
+        percentage: s!(percentage),
+        description: s!(""),
+        back_into_percentage: false,
+        category: Category::EscrowHold,
+        destination_user_id: Some(1),
+        destination_account: Account::Escrow,
+    }
+}
+
+/// A base price followed by add-ons and percentage fees, with a new priority tier every few
+/// lines.
+fn invoice(size: usize) -> Vec<LineItem> {
+    let mut lines = vec![LineItem {
+        kind: LineType::BasePrice,
+        ..add_on(0, 0, "100.00", "0")
+    }];
+    for index in 1..size {
+        let priority = (index / 3 * 100) as i16;
+        lines.push(if index % 3 == 0 {
+            add_on(index as i32, priority, "0.00", "0.5")
+        } else {
+            add_on(index as i32, priority, "1.25", "0")
+        });
+    }
+    lines
+}
+
+/// Lines a customer has added to a deliverable on top of the generated ones.
+fn extra_lines(size: usize) -> Vec<LineItem> {
+    (0..size)
+        .map(|index| add_on(index as i32 + 1, 100, "1.25", "0"))
+        .collect()
+}
+
+fn context(extra_lines: Vec<LineItem>) -> DeliverableLinesContext {
+    DeliverableLinesContext {
+        base_price: s!("25.00"),
+        table_product: false,
+        escrow_enabled: true,
+        international: false,
+        extra_lines,
+        plan_name: Some(s!("Basic")),
+        pricing: Some(pricing()),
+        user_id: 1,
+        allow_soft_failure: false,
+        quantization: QUANTIZATION,
+    }
+}
+
+fn bench_lines_by_priority(c: &mut Criterion) {
+    let mut group = c.benchmark_group("lines_by_priority");
+    for size in SIZES {
+        let lines = invoice(size);
+        group.bench_with_input(BenchmarkId::from_parameter(size), &lines, |b, lines| {
+            b.iter_batched(
+                || lines.clone(),
+                |lines| lines_by_priority(black_box(lines)).unwrap(),
+                BatchSize::SmallInput,
+            )
+        });
+    }
+    group.finish();
+}
+
+fn bench_get_totals(c: &mut Criterion) {
+    let mut group = c.benchmark_group("get_totals");
+    for size in SIZES {
+        let lines = invoice(size);
+        group.bench_with_input(BenchmarkId::from_parameter(size), &lines, |b, lines| {
+            b.iter_batched(
+                || lines.clone(),
+                |lines| get_totals(black_box(lines), QUANTIZATION).unwrap(),
+                BatchSize::SmallInput,
+            )
+        });
+    }
+    group.finish();
+}
+
+fn bench_deliverable_lines(c: &mut Criterion) {
+    let mut group = c.benchmark_group("deliverable_lines");
+    for size in SIZES {
+        let extra = extra_lines(size);
+        group.bench_with_input(BenchmarkId::from_parameter(size), &extra, |b, extra| {
+            b.iter_batched(
+                || context(extra.clone()),
+                |ctx| deliverable_lines(black_box(ctx)).unwrap(),
+                BatchSize::SmallInput,
+            )
+        });
+    }
+    group.finish();
+}
+
+fn bench_pricing_engine(c: &mut Criterion) {
+    let mut group = c.benchmark_group("pricing_engine_deliverable_lines");
+    let engine = PricingEngine::new(pricing()).unwrap();
+    for size in SIZES {
+        let extra = extra_lines(size);
+        group.bench_with_input(BenchmarkId::from_parameter(size), &extra, |b, extra| {
+            b.iter_batched(
+                || DeliverableLinesContext {
+                    pricing: None,
+                    ..context(extra.clone())
+                },
+                |ctx| engine.deliverable_lines(black_box(ctx)).unwrap(),
+                BatchSize::SmallInput,
+            )
+        });
+    }
+    group.finish();
+}
+
+fn bench_divide_amount(c: &mut Criterion) {
+    let mut group = c.benchmark_group("divide_amount");
+    for size in SIZES {
+        group.bench_with_input(BenchmarkId::from_parameter(size), &size, |b, size| {
+            b.iter(|| divide_amount(black_box(dec!(1000.01)), *size as u16, QUANTIZATION).unwrap())
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(
+    benches,
+    bench_lines_by_priority,
+    bench_get_totals,
+    bench_deliverable_lines,
+    bench_pricing_engine,
+    bench_divide_amount,
+);
+criterion_main!(benches);
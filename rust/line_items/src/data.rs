@@ -1,6 +1,7 @@
 #[cfg(feature = "python")]
 use pyo3::prelude::*;
 use rust_decimal::Decimal;
+use serde::de::DeserializeOwned;
 use serde::{Deserialize, Serialize};
 use serde_repr::*;
 use std::collections::HashMap;
@@ -524,6 +525,87 @@ pub type LineDecimalMap = HashMap<LineItem, Decimal>;
 /// Intermediate map used for serializing to the frontend.
 pub type IdToMoneyVal = HashMap<i32, String>;
 
+/// Independent sets of line items keyed by an identifier, such as an invoice ID. Used for
+/// tabulating many invoices in one call.
+pub type LineGroups = HashMap<String, Vec<LineItem>>;
+
+/// Positional representation of a LineItem, using the integer values of its enums as they are
+/// stored in the database. This lets callers build line items straight from query results instead
+/// of serializing them into dictionaries first. The fields are, in order: id, priority, kind,
+/// amount, percentage, frozen_value, back_into_percentage, category, destination_account,
+/// destination_user_id, and description.
+pub type CompactLineItem = (
+    i32,
+    i16,
+    u16,
+    String,
+    String,
+    Option<String>,
+    bool,
+    u16,
+    u16,
+    Option<i64>,
+    String,
+);
+
+/// Independent sets of compact line items keyed by an identifier, such as an invoice ID.
+pub type CompactLineGroups = HashMap<String, Vec<CompactLineItem>>;
+
+/// Converts the integer value of one of the enums above into the enum itself.
+fn enum_from_int<T: DeserializeOwned>(value: u16, label: &str) -> Result<T, TabulationError> {
+    match serde_json::from_value(serde_json::Value::from(value)) {
+        Ok(result) => Ok(result),
+        Err(_) => Err(TabulationError::from(format!("Unknown {label}: {value}"))),
+    }
+}
+
+impl TryFrom<CompactLineItem> for LineItem {
+    type Error = TabulationError;
+
+    fn try_from(compact: CompactLineItem) -> Result<Self, Self::Error> {
+        let (
+            id,
+            priority,
+            kind,
+            amount,
+            percentage,
+            frozen_value,
+            back_into_percentage,
+            category,
+            destination_account,
+            destination_user_id,
+            description,
+        ) = compact;
+        Ok(LineItem {
+            id,
+            priority,
+            kind: enum_from_int(kind, "line type")?,
+            amount,
+            description,
+            frozen_value,
+            percentage,
+            category: enum_from_int(category, "category")?,
+            destination_user_id,
+            destination_account: enum_from_int(destination_account, "account")?,
+            back_into_percentage,
+        })
+    }
+}
+
+/// Converts a vector of compact line items into full LineItem structs.
+pub fn from_compact(lines: Vec<CompactLineItem>) -> Result<Vec<LineItem>, TabulationError> {
+    lines.into_iter().map(LineItem::try_from).collect()
+}
+
+/// Converts groups of compact line items into groups of full LineItem structs.
+pub fn groups_from_compact(groups: CompactLineGroups) -> Result<LineGroups, TabulationError> {
+    let mut result = LineGroups::with_capacity(groups.len());
+    for (key, lines) in groups.into_iter() {
+        result.insert(key, from_compact(lines)?);
+    }
+    Ok(result)
+}
+
 /// 'Calculation' structure used as the basis of the return value for JS-based calls to the line
 /// item functions.
 #[derive(Serialize, Deserialize)]
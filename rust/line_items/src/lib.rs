@@ -35,11 +35,13 @@ macro_rules! set_trace {
 pub mod funcs {
     #[cfg(any(feature = "python", feature = "wasm"))]
     use crate::data::Calculation;
+    #[cfg(feature = "python")]
+    use crate::data::{from_compact, groups_from_compact, CompactLineGroups, CompactLineItem};
     use crate::data::{
         Account, Category, DeliverableLinesContext, InvoiceLinesContext, LineType, Pricing,
-        TipLinesContext,
+        ServicePlan, TipLinesContext,
     };
-    use crate::data::{LineDecimalMap, LineItem, TabulationError};
+    use crate::data::{LineDecimalMap, LineGroups, LineItem, TabulationError};
     use crate::{dec_from_string, s};
     #[cfg(feature = "wasm")]
     use js_sys::JsString;
@@ -351,6 +353,55 @@ pub mod funcs {
         Ok(value)
     }
 
+    /// Run get_totals over several independent sets of line items, such as the lines of many
+    /// invoices. Each set is tabulated on its own, and the results are keyed the same way as the
+    /// input.
+    pub fn get_totals_many(
+        groups: LineGroups,
+        quantization: u32,
+    ) -> Result<HashMap<String, (Decimal, Decimal, LineDecimalMap)>, TabulationError> {
+        let mut results = HashMap::with_capacity(groups.len());
+        for (key, lines) in groups.into_iter() {
+            let totals = match get_totals(lines, quantization) {
+                Ok(result) => result,
+                Err(error) => return Err(TabulationError::from(format!("{key}: {error}"))),
+            };
+            results.insert(key, totals);
+        }
+        Ok(results)
+    }
+
+    /// Given several independent sets of line items, get the total amount of each.
+    pub fn reckon_many(
+        groups: LineGroups,
+        quantization: u32,
+    ) -> Result<HashMap<String, Decimal>, TabulationError> {
+        let mut results = HashMap::with_capacity(groups.len());
+        for (key, (total, _discount, _subtotals)) in get_totals_many(groups, quantization)? {
+            results.insert(key, total);
+        }
+        Ok(results)
+    }
+
+    /// Converts the output of get_totals into the serializable Calculation structure.
+    #[cfg(any(feature = "python", feature = "wasm"))]
+    fn to_calculation(
+        total: Decimal,
+        discount: Decimal,
+        source_map: LineDecimalMap,
+        quantization: u32,
+    ) -> Calculation {
+        let mut subtotals = HashMap::<i32, String>::new();
+        for (key, value) in source_map.into_iter() {
+            subtotals.insert(key.id, value.to_string());
+        }
+        Calculation {
+            total: value_string(&total, quantization),
+            discount: value_string(&discount, quantization),
+            subtotals,
+        }
+    }
+
     /// Javascript-callable function binding for reckon_lines.
     #[cfg(feature = "wasm")]
     #[wasm_bindgen]
@@ -386,15 +437,7 @@ pub mod funcs {
             Ok(result) => result,
             Err(error) => return Err(TabulationError::from(error.to_string())),
         };
-        let mut subtotals = HashMap::<i32, String>::new();
-        for (key, value) in source_map.into_iter() {
-            subtotals.insert(key.id, value.to_string());
-        }
-        let result = Calculation {
-            total: value_string(&total, quantization),
-            discount: value_string(&discount, quantization),
-            subtotals,
-        };
+        let result = to_calculation(total, discount, source_map, quantization);
         match serde_wasm_bindgen::to_value(&result) {
             Ok(result) => Ok(result),
             Err(err) => Err(TabulationError::from(err.to_string())),
@@ -408,15 +451,7 @@ pub mod funcs {
             Ok(result) => result,
             Err(error) => return Err(PyValueError::new_err(error.to_string())),
         };
-        let mut subtotals = HashMap::<i32, String>::new();
-        for (key, value) in source_map.into_iter() {
-            subtotals.insert(key.id, value.to_string());
-        }
-        Ok(Calculation {
-            total: value_string(&total, quantization),
-            discount: value_string(&discount, quantization),
-            subtotals,
-        })
+        Ok(to_calculation(total, discount, source_map, quantization))
     }
 
     #[cfg(feature = "python")]
@@ -429,6 +464,77 @@ pub mod funcs {
         }
     }
 
+    /// Python binding for get_totals which takes compact line item tuples rather than
+    /// dictionaries. See CompactLineItem for the expected layout.
+    #[cfg(feature = "python")]
+    #[pyfunction]
+    fn py_get_totals_compact(
+        lines: Vec<CompactLineItem>,
+        quantization: u32,
+    ) -> PyResult<Calculation> {
+        let lines = match from_compact(lines) {
+            Ok(result) => result,
+            Err(error) => return Err(PyValueError::new_err(error.to_string())),
+        };
+        py_get_totals(lines, quantization)
+    }
+
+    /// Python binding for reckon_lines which takes compact line item tuples rather than
+    /// dictionaries.
+    #[cfg(feature = "python")]
+    #[pyfunction]
+    fn py_reckon_lines_compact(lines: Vec<CompactLineItem>, quantization: u32) -> PyResult<String> {
+        let lines = match from_compact(lines) {
+            Ok(result) => result,
+            Err(error) => return Err(PyValueError::new_err(error.to_string())),
+        };
+        py_reckon_lines(lines, quantization)
+    }
+
+    /// Python binding for get_totals_many. Takes a dictionary of compact line item lists keyed
+    /// by invoice ID and returns a dictionary of calculations with the same keys.
+    #[cfg(feature = "python")]
+    #[pyfunction]
+    fn py_get_totals_many(
+        groups: CompactLineGroups,
+        quantization: u32,
+    ) -> PyResult<HashMap<String, Calculation>> {
+        let results = match groups_from_compact(groups)
+            .and_then(|groups| get_totals_many(groups, quantization))
+        {
+            Ok(result) => result,
+            Err(error) => return Err(PyValueError::new_err(error.to_string())),
+        };
+        let mut calculations = HashMap::with_capacity(results.len());
+        for (key, (total, discount, source_map)) in results.into_iter() {
+            calculations.insert(
+                key,
+                to_calculation(total, discount, source_map, quantization),
+            );
+        }
+        Ok(calculations)
+    }
+
+    /// Python binding for reckon_many.
+    #[cfg(feature = "python")]
+    #[pyfunction]
+    fn py_reckon_many(
+        groups: CompactLineGroups,
+        quantization: u32,
+    ) -> PyResult<HashMap<String, String>> {
+        let results = match groups_from_compact(groups)
+            .and_then(|groups| reckon_many(groups, quantization))
+        {
+            Ok(result) => result,
+            Err(error) => return Err(PyValueError::new_err(error.to_string())),
+        };
+        let mut totals = HashMap::with_capacity(results.len());
+        for (key, total) in results.into_iter() {
+            totals.insert(key, total.to_string());
+        }
+        Ok(totals)
+    }
+
     /// A Python module implemented in Rust. The name of this function must match
     /// the `lib.name` setting in the `Cargo.toml`, else Python will not be able to
     /// import the module.
@@ -437,9 +543,15 @@ pub mod funcs {
     fn line_items(m: &Bound<'_, PyModule>) -> PyResult<()> {
         m.add_function(wrap_pyfunction!(py_get_totals, m)?)?;
         m.add_function(wrap_pyfunction!(py_reckon_lines, m)?)?;
+        m.add_function(wrap_pyfunction!(py_get_totals_compact, m)?)?;
+        m.add_function(wrap_pyfunction!(py_reckon_lines_compact, m)?)?;
+        m.add_function(wrap_pyfunction!(py_get_totals_many, m)?)?;
+        m.add_function(wrap_pyfunction!(py_reckon_many, m)?)?;
         m.add_function(wrap_pyfunction!(py_divide_amount, m)?)?;
         m.add_function(wrap_pyfunction!(py_deliverable_lines, m)?)?;
+        m.add_function(wrap_pyfunction!(py_deliverable_lines_compact, m)?)?;
         m.add_function(wrap_pyfunction!(py_tip_fee_lines, m)?)?;
+        m.add_class::<PricingEngine>()?;
         m.add_class::<LineType>()?;
         m.add_class::<Account>()?;
         m.add_class::<Category>()?;
@@ -523,67 +635,7 @@ pub mod funcs {
             Some(x) => x,
             None => return Err(TabulationError::from("Pricing not specified.")),
         };
-        let mut processing_percentage = dec_from_string!(pricing.processing_percentage);
-        if tip_context.international {
-            processing_percentage += dec_from_string!(pricing.international_conversion_percentage)
-        }
-        let mut lines = vec![
-            LineItem {
-                id: -1,
-                priority: 300,
-                destination_user_id: None,
-                destination_account: Account::Fund,
-                kind: LineType::Processing,
-                percentage: processing_percentage.to_string(),
-                amount: pricing.processing_static,
-                back_into_percentage: false,
-                description: s!(""),
-                frozen_value: None,
-                category: Category::ProcessingFee,
-            },
-            LineItem {
-                id: -7,
-                priority: 350,
-                amount: pricing.stripe_blended_rate_static,
-                percentage: pricing.stripe_blended_rate_percentage,
-                back_into_percentage: false,
-                kind: LineType::CardFee,
-                destination_user_id: None,
-                destination_account: Account::Fund,
-                description: s!(""),
-                frozen_value: None,
-                category: Category::ThirdPartyFee,
-            },
-            LineItem {
-                id: -9,
-                priority: 325,
-                amount: pricing.stripe_payout_static,
-                percentage: pricing.stripe_payout_percentage,
-                back_into_percentage: false,
-                frozen_value: None,
-                category: Category::ThirdPartyFee,
-                kind: LineType::PayoutFee,
-                destination_user_id: None,
-                destination_account: Account::Fund,
-                description: s!(""),
-            },
-        ];
-        if tip_context.international {
-            lines.push(LineItem {
-                id: -8,
-                priority: 325,
-                amount: s!("0"),
-                percentage: pricing.stripe_payout_cross_border_percentage,
-                category: Category::ThirdPartyFee,
-                kind: LineType::CrossBorderTransferFee,
-                back_into_percentage: false,
-                destination_user_id: None,
-                destination_account: Account::Fund,
-                description: s!(""),
-                frozen_value: None,
-            })
-        }
-        Ok(lines)
+        Ok(PricingEngine::new(pricing)?.tip_fee_lines(tip_context.international))
     }
 
     /// Convenience function for previewing line items that would be given for a particular
@@ -656,208 +708,136 @@ pub mod funcs {
     pub fn deliverable_lines(
         mut lines_context: DeliverableLinesContext,
     ) -> Result<Vec<LineItem>, TabulationError> {
-        let mut lines: Vec<LineItem> = vec![];
-        let plan_name: String;
-
-        match lines_context.plan_name {
-            Some(name) => {
-                plan_name = name;
-            }
-            None => {
-                if lines_context.allow_soft_failure {
-                    return Ok(lines);
-                }
-                return Err(TabulationError::from("No plan name specified."));
+        if lines_context.plan_name.is_none() {
+            if lines_context.allow_soft_failure {
+                return Ok(vec![]);
             }
+            return Err(TabulationError::from("No plan name specified."));
         }
-        let pricing: Pricing;
-        match lines_context.pricing {
-            Some(price_spec) => pricing = price_spec,
+        let pricing = match lines_context.pricing.take() {
+            Some(price_spec) => price_spec,
             None => {
                 if lines_context.allow_soft_failure {
-                    return Ok(lines);
+                    return Ok(vec![]);
                 }
                 return Err(TabulationError::from("Pricing specification not provided."));
             }
-        }
-        let plan = match pricing.plans.iter().find(|entry| entry.name == plan_name) {
-            Some(inner) => inner,
-            None => {
-                return if lines_context.allow_soft_failure {
-                    Ok(lines)
-                } else {
-                    Err(TabulationError::from(format!(
-                        "Could not find {plan_name} in plan list."
-                    )))
-                }
-            }
         };
-        // Sanity check.
-        match Decimal::from_str_exact(&lines_context.base_price) {
-            Ok(_) => {}
-            Err(err) => {
-                return if lines_context.allow_soft_failure {
-                    Ok(lines)
-                } else {
-                    Err(TabulationError::from(err.to_string()))
+        PricingEngine::new(pricing)?.deliverable_lines(lines_context)
+    }
+
+    /// A service plan with its decimal values parsed ahead of time.
+    #[derive(Debug, Clone)]
+    struct PreparedPlan {
+        plan: ServicePlan,
+        per_deliverable_price: Decimal,
+        shield_percentage: String,
+        international_shield_percentage: String,
+    }
+
+    /// Pricing specification prepared once for repeated line item calculations. Plans are
+    /// indexed by name and their decimal values parsed up front, so that each call only has to
+    /// deal with the details of the order at hand. Any invalid decimal in the specification is
+    /// reported when the engine is built.
+    #[cfg_attr(feature = "python", pyclass(frozen))]
+    #[derive(Debug, Clone)]
+    pub struct PricingEngine {
+        pricing: Pricing,
+        plans: HashMap<String, PreparedPlan>,
+        processing_percentage: String,
+        international_processing_percentage: String,
+    }
+
+    impl PricingEngine {
+        /// Prepares a pricing specification for repeated use.
+        pub fn new(pricing: Pricing) -> Result<PricingEngine, TabulationError> {
+            let international_conversion_percentage =
+                dec_from_string!(pricing.international_conversion_percentage);
+            let processing_percentage = dec_from_string!(pricing.processing_percentage);
+            let mut plans = HashMap::new();
+            for plan in pricing.plans.iter() {
+                if plans.contains_key(&plan.name) {
+                    // The first plan with a given name wins, as it would in a search of the list.
+                    continue;
                 }
+                let shield_percentage = dec_from_string!(plan.shield_percentage_price);
+                plans.insert(
+                    plan.name.clone(),
+                    PreparedPlan {
+                        plan: plan.clone(),
+                        per_deliverable_price: dec_from_string!(plan.per_deliverable_price),
+                        shield_percentage: shield_percentage.to_string(),
+                        international_shield_percentage: (shield_percentage
+                            + international_conversion_percentage)
+                            .to_string(),
+                    },
+                );
             }
-        };
-        let per_deliverable_price = match Decimal::from_str_exact(&plan.per_deliverable_price) {
-            Err(err) => return Err(TabulationError::from(err.to_string())),
-            Ok(result) => result,
-        };
-        if !lines_context
-            .extra_lines
-            .iter()
-            .any(|line| line.kind == LineType::BasePrice)
-        {
-            lines.push(LineItem {
-                id: -1,
-                priority: 0,
-                kind: LineType::BasePrice,
-                category: Category::EscrowHold,
-                frozen_value: None,
-                amount: lines_context.base_price,
-                percentage: s!("0"),
-                description: s!(""),
-                back_into_percentage: false,
-                destination_account: Account::Escrow,
-                destination_user_id: Some(lines_context.user_id),
-            });
-        }
-        let mut calc_lines = lines.clone();
-        calc_lines.extend(lines_context.extra_lines.clone());
-        let total = match reckon_lines(calc_lines, lines_context.quantization) {
-            Ok(some) => some,
-            Err(err) => return Err(TabulationError::from(err.to_string())),
-        };
-        // Escrow is always enabled for table products, though we handle it a bit differently,
-        // since for table events we're actually willing to refund the full amount. That means
-        // we're not selling the escrow service in such cases-- we're selling the art. It also means
-        // we have to add a tax line, since selling art is taxable while selling payment services
-        // isn't.
-        let escrow_enabled = if total <= quantized_zero(lines_context.quantization) {
-            false
-        } else {
-            lines_context.escrow_enabled || lines_context.table_product
-        };
-        if lines_context.table_product {
-            // TODO: Table changes to numbers now that we're tabulating
-            // ours separately from the card charger's.
-            lines.push(LineItem {
-                id: -3,
-                priority: 400,
-                kind: LineType::TableService,
-                category: Category::TableHandling,
-                back_into_percentage: false,
-                amount: pricing.table_static,
-                frozen_value: None,
-                description: s!(""),
-                percentage: pricing.table_percentage,
-                destination_account: Account::Reserve,
-                destination_user_id: None,
-            });
-            lines.push(LineItem {
-                id: -4,
-                priority: 700,
-                kind: LineType::Tax,
-                description: s!(""),
-                category: Category::Taxes,
-                back_into_percentage: false,
-                percentage: pricing.table_tax,
-                amount: s!("0"),
-                frozen_value: None,
-                // TODO: Do these staging accounts actually help us or just make accounting
-                // more complicated? Ask the accountant. It may be especially useless for table
-                // cases.
-                destination_account: Account::MoneyHoleStage,
-                destination_user_id: None,
-            })
-        } else if escrow_enabled {
-            let mut shield_percentage_price = dec_from_string!(&plan.shield_percentage_price);
-            // We include the extra bump onto our shield price for international artists.
-            // This allows us to incorperate any additional conversion fees that may be there.
-            // We could have made this a separate line, but to do so, we would need to mark it for
-            // our primary concern, foreign exchange fees. However, just because a user is
-            // international, doesn't mean there's a conversion.
-            //
-            // For example, there are several countries that have 'dollarized'. This means they use
-            // the US dollar locally to some degree, which means such a fee wouldn't make sense.
-            // It's also possible that there are US dollar accounts in countries that normally don't
-            // have them, which would be an edge case, but I can't rule it out. Hopefully, we won't
-            // have any domestic accounts with foreign currency-- which is the one case we aren't
-            // covering here.
-            //
-            // Due to the ambiguity of circumstances, we just say we add on an international
-            // surcharge of 1% from our end, rather than trying to certainly earmark it.
-            if lines_context.international {
-                let international_conversion_percentage =
-                    dec_from_string!(&pricing.international_conversion_percentage);
-                shield_percentage_price += international_conversion_percentage
-            }
-            lines.push(LineItem {
-                id: -5,
-                priority: 330,
-                kind: LineType::Shield,
-                description: s!(""),
-                category: Category::ShieldFee,
-                back_into_percentage: false,
-                amount: plan.shield_static_price.clone(),
-                frozen_value: None,
-                percentage: shield_percentage_price.to_string(),
-                destination_account: Account::Fund,
-                destination_user_id: None,
-            })
-        } else if per_deliverable_price > dec!(0) {
-            lines.push(LineItem {
-                id: -6,
-                priority: 300,
-                kind: LineType::DeliverableTracking,
-                description: s!(""),
-                category: Category::SubscriptionDues,
-                back_into_percentage: false,
-                amount: plan.per_deliverable_price.clone(),
-                frozen_value: None,
-                percentage: s!("0"),
-                destination_account: Account::Fund,
-                destination_user_id: None,
+            Ok(PricingEngine {
+                processing_percentage: processing_percentage.to_string(),
+                international_processing_percentage: (processing_percentage
+                    + international_conversion_percentage)
+                    .to_string(),
+                pricing,
+                plans,
             })
         }
-        // If any escrow/payment handling is done, we need to add the lines for upstream fees.
-        if escrow_enabled {
-            lines.push(LineItem {
-                id: -7,
-                priority: 350,
-                amount: pricing.stripe_blended_rate_static,
-                percentage: pricing.stripe_blended_rate_percentage,
-                back_into_percentage: true,
-                kind: LineType::CardFee,
-                destination_user_id: None,
-                destination_account: Account::Fund,
-                description: s!(""),
-                frozen_value: None,
-                category: Category::ThirdPartyFee,
-            });
-            lines.push(LineItem {
-                id: -9,
-                priority: 325,
-                amount: pricing.stripe_payout_static,
-                percentage: pricing.stripe_payout_percentage,
-                back_into_percentage: false,
-                frozen_value: None,
-                category: Category::ThirdPartyFee,
-                kind: LineType::PayoutFee,
-                destination_user_id: None,
-                destination_account: Account::Fund,
-                description: s!(""),
-            });
-            if lines_context.international {
+
+        /// Line items expected to be on an initialized tip invoice, excluding the tip itself.
+        pub fn tip_fee_lines(&self, international: bool) -> Vec<LineItem> {
+            let pricing = &self.pricing;
+            let processing_percentage = if international {
+                self.international_processing_percentage.clone()
+            } else {
+                self.processing_percentage.clone()
+            };
+            let mut lines = vec![
+                LineItem {
+                    id: -1,
+                    priority: 300,
+                    destination_user_id: None,
+                    destination_account: Account::Fund,
+                    kind: LineType::Processing,
+                    percentage: processing_percentage,
+                    amount: pricing.processing_static.clone(),
+                    back_into_percentage: false,
+                    description: s!(""),
+                    frozen_value: None,
+                    category: Category::ProcessingFee,
+                },
+                LineItem {
+                    id: -7,
+                    priority: 350,
+                    amount: pricing.stripe_blended_rate_static.clone(),
+                    percentage: pricing.stripe_blended_rate_percentage.clone(),
+                    back_into_percentage: false,
+                    kind: LineType::CardFee,
+                    destination_user_id: None,
+                    destination_account: Account::Fund,
+                    description: s!(""),
+                    frozen_value: None,
+                    category: Category::ThirdPartyFee,
+                },
+                LineItem {
+                    id: -9,
+                    priority: 325,
+                    amount: pricing.stripe_payout_static.clone(),
+                    percentage: pricing.stripe_payout_percentage.clone(),
+                    back_into_percentage: false,
+                    frozen_value: None,
+                    category: Category::ThirdPartyFee,
+                    kind: LineType::PayoutFee,
+                    destination_user_id: None,
+                    destination_account: Account::Fund,
+                    description: s!(""),
+                },
+            ];
+            if international {
                 lines.push(LineItem {
                     id: -8,
                     priority: 325,
                     amount: s!("0"),
-                    percentage: pricing.stripe_payout_cross_border_percentage,
+                    percentage: pricing.stripe_payout_cross_border_percentage.clone(),
                     category: Category::ThirdPartyFee,
                     kind: LineType::CrossBorderTransferFee,
                     back_into_percentage: false,
@@ -867,26 +847,305 @@ pub mod funcs {
                     frozen_value: None,
                 })
             }
-            if !plan.connection_fee_waived {
+            lines
+        }
+
+        /// Returns the expected line items for a deliverable. The pricing field of the context
+        /// is ignored in favor of the engine's own.
+        pub fn deliverable_lines(
+            &self,
+            mut lines_context: DeliverableLinesContext,
+        ) -> Result<Vec<LineItem>, TabulationError> {
+            let pricing = &self.pricing;
+            let mut lines: Vec<LineItem> = vec![];
+            let plan_name: String;
+
+            match lines_context.plan_name.take() {
+                Some(name) => {
+                    plan_name = name;
+                }
+                None => {
+                    if lines_context.allow_soft_failure {
+                        return Ok(lines);
+                    }
+                    return Err(TabulationError::from("No plan name specified."));
+                }
+            }
+            let prepared = match self.plans.get(&plan_name) {
+                Some(inner) => inner,
+                None => {
+                    return if lines_context.allow_soft_failure {
+                        Ok(lines)
+                    } else {
+                        Err(TabulationError::from(format!(
+                            "Could not find {plan_name} in plan list."
+                        )))
+                    }
+                }
+            };
+            // Sanity check.
+            match Decimal::from_str_exact(&lines_context.base_price) {
+                Ok(_) => {}
+                Err(err) => {
+                    return if lines_context.allow_soft_failure {
+                        Ok(lines)
+                    } else {
+                        Err(TabulationError::from(err.to_string()))
+                    }
+                }
+            };
+            let plan = &prepared.plan;
+            let per_deliverable_price = prepared.per_deliverable_price;
+            if !lines_context
+                .extra_lines
+                .iter()
+                .any(|line| line.kind == LineType::BasePrice)
+            {
                 lines.push(LineItem {
-                    id: -10,
-                    priority: 325,
-                    amount: pricing.stripe_active_account_monthly_fee,
+                    id: -1,
+                    priority: 0,
+                    kind: LineType::BasePrice,
+                    category: Category::EscrowHold,
+                    frozen_value: None,
+                    amount: lines_context.base_price,
                     percentage: s!("0"),
-                    category: Category::ThirdPartyFee,
-                    kind: LineType::ConnectFee,
+                    description: s!(""),
+                    back_into_percentage: false,
+                    destination_account: Account::Escrow,
+                    destination_user_id: Some(lines_context.user_id),
+                });
+            }
+            let mut calc_lines = lines.clone();
+            calc_lines.extend(lines_context.extra_lines.clone());
+            let total = match reckon_lines(calc_lines, lines_context.quantization) {
+                Ok(some) => some,
+                Err(err) => return Err(TabulationError::from(err.to_string())),
+            };
+            // Escrow is always enabled for table products, though we handle it a bit differently,
+            // since for table events we're actually willing to refund the full amount. That means
+            // we're not selling the escrow service in such cases-- we're selling the art. It also
+            // means we have to add a tax line, since selling art is taxable while selling payment
+            // services isn't.
+            let escrow_enabled = if total <= quantized_zero(lines_context.quantization) {
+                false
+            } else {
+                lines_context.escrow_enabled || lines_context.table_product
+            };
+            if lines_context.table_product {
+                // TODO: Table changes to numbers now that we're tabulating
+                // ours separately from the card charger's.
+                lines.push(LineItem {
+                    id: -3,
+                    priority: 400,
+                    kind: LineType::TableService,
+                    category: Category::TableHandling,
+                    back_into_percentage: false,
+                    amount: pricing.table_static.clone(),
+                    frozen_value: None,
+                    description: s!(""),
+                    percentage: pricing.table_percentage.clone(),
+                    destination_account: Account::Reserve,
                     destination_user_id: None,
-                    destination_account: Account::Fund,
+                });
+                lines.push(LineItem {
+                    id: -4,
+                    priority: 700,
+                    kind: LineType::Tax,
+                    description: s!(""),
+                    category: Category::Taxes,
+                    back_into_percentage: false,
+                    percentage: pricing.table_tax.clone(),
+                    amount: s!("0"),
+                    frozen_value: None,
+                    // TODO: Do these staging accounts actually help us or just make accounting
+                    // more complicated? Ask the accountant. It may be especially useless for table
+                    // cases.
+                    destination_account: Account::MoneyHoleStage,
+                    destination_user_id: None,
+                })
+            } else if escrow_enabled {
+                // We include the extra bump onto our shield price for international artists. This
+                // allows us to incorperate any additional conversion fees that may be there. We
+                // could have made this a separate line, but to do so, we would need to mark it for
+                // our primary concern, foreign exchange fees. However, just because a user is
+                // international, doesn't mean there's a conversion.
+                //
+                // For example, there are several countries that have 'dollarized'. This means they
+                // use the US dollar locally to some degree, which means such a fee wouldn't make
+                // sense. It's also possible that there are US dollar accounts in countries that
+                // normally don't have them, which would be an edge case, but I can't rule it out.
+                // Hopefully, we won't have any domestic accounts with foreign currency-- which is
+                // the one case we aren't covering here.
+                //
+                // Due to the ambiguity of circumstances, we just say we add on an international
+                // surcharge of 1% from our end, rather than trying to certainly earmark it.
+                let shield_percentage_price = if lines_context.international {
+                    prepared.international_shield_percentage.clone()
+                } else {
+                    prepared.shield_percentage.clone()
+                };
+                lines.push(LineItem {
+                    id: -5,
+                    priority: 330,
+                    kind: LineType::Shield,
+                    description: s!(""),
+                    category: Category::ShieldFee,
                     back_into_percentage: false,
+                    amount: plan.shield_static_price.clone(),
+                    frozen_value: None,
+                    percentage: shield_percentage_price,
+                    destination_account: Account::Fund,
+                    destination_user_id: None,
+                })
+            } else if per_deliverable_price > dec!(0) {
+                lines.push(LineItem {
+                    id: -6,
+                    priority: 300,
+                    kind: LineType::DeliverableTracking,
                     description: s!(""),
+                    category: Category::SubscriptionDues,
+                    back_into_percentage: false,
+                    amount: plan.per_deliverable_price.clone(),
                     frozen_value: None,
+                    percentage: s!("0"),
+                    destination_account: Account::Fund,
+                    destination_user_id: None,
                 })
             }
+            // If any escrow/payment handling is done, we need to add the lines for upstream fees.
+            if escrow_enabled {
+                lines.push(LineItem {
+                    id: -7,
+                    priority: 350,
+                    amount: pricing.stripe_blended_rate_static.clone(),
+                    percentage: pricing.stripe_blended_rate_percentage.clone(),
+                    back_into_percentage: true,
+                    kind: LineType::CardFee,
+                    destination_user_id: None,
+                    destination_account: Account::Fund,
+                    description: s!(""),
+                    frozen_value: None,
+                    category: Category::ThirdPartyFee,
+                });
+                lines.push(LineItem {
+                    id: -9,
+                    priority: 325,
+                    amount: pricing.stripe_payout_static.clone(),
+                    percentage: pricing.stripe_payout_percentage.clone(),
+                    back_into_percentage: false,
+                    frozen_value: None,
+                    category: Category::ThirdPartyFee,
+                    kind: LineType::PayoutFee,
+                    destination_user_id: None,
+                    destination_account: Account::Fund,
+                    description: s!(""),
+                });
+                if lines_context.international {
+                    lines.push(LineItem {
+                        id: -8,
+                        priority: 325,
+                        amount: s!("0"),
+                        percentage: pricing.stripe_payout_cross_border_percentage.clone(),
+                        category: Category::ThirdPartyFee,
+                        kind: LineType::CrossBorderTransferFee,
+                        back_into_percentage: false,
+                        destination_user_id: None,
+                        destination_account: Account::Fund,
+                        description: s!(""),
+                        frozen_value: None,
+                    })
+                }
+                if !plan.connection_fee_waived {
+                    lines.push(LineItem {
+                        id: -10,
+                        priority: 325,
+                        amount: pricing.stripe_active_account_monthly_fee.clone(),
+                        percentage: s!("0"),
+                        category: Category::ThirdPartyFee,
+                        kind: LineType::ConnectFee,
+                        destination_user_id: None,
+                        destination_account: Account::Fund,
+                        back_into_percentage: false,
+                        description: s!(""),
+                        frozen_value: None,
+                    })
+                }
+            }
+            for entry in lines_context.extra_lines.drain(..) {
+                lines.push(entry)
+            }
+            Ok(lines)
         }
-        for entry in lines_context.extra_lines.drain(..) {
-            lines.push(entry)
+    }
+
+    #[cfg(feature = "python")]
+    #[pymethods]
+    impl PricingEngine {
+        #[new]
+        fn py_new(pricing: Pricing) -> PyResult<Self> {
+            match PricingEngine::new(pricing) {
+                Ok(engine) => Ok(engine),
+                Err(error) => Err(PyValueError::new_err(error.to_string())),
+            }
+        }
+
+        /// Python binding for deliverable_lines. Takes only the details of the order, with
+        /// extra lines given as compact line item tuples.
+        #[pyo3(
+            name = "deliverable_lines",
+            signature = (
+                *,
+                base_price,
+                table_product,
+                escrow_enabled,
+                international,
+                plan_name,
+                user_id,
+                quantization,
+                extra_lines,
+                allow_soft_failure = false,
+            )
+        )]
+        #[allow(clippy::too_many_arguments)]
+        fn py_deliverable_lines(
+            &self,
+            base_price: String,
+            table_product: bool,
+            escrow_enabled: bool,
+            international: bool,
+            plan_name: Option<String>,
+            user_id: i64,
+            quantization: u32,
+            extra_lines: Vec<CompactLineItem>,
+            allow_soft_failure: bool,
+        ) -> PyResult<Vec<LineItem>> {
+            let extra_lines = match from_compact(extra_lines) {
+                Ok(result) => result,
+                Err(error) => return Err(PyValueError::new_err(error.to_string())),
+            };
+            let lines_context = DeliverableLinesContext {
+                base_price,
+                table_product,
+                escrow_enabled,
+                international,
+                extra_lines,
+                plan_name,
+                pricing: None,
+                user_id,
+                allow_soft_failure,
+                quantization,
+            };
+            match self.deliverable_lines(lines_context) {
+                Ok(some) => Ok(some),
+                Err(error) => Err(PyValueError::new_err(error.to_string())),
+            }
+        }
+
+        /// Python binding for tip_fee_lines.
+        #[pyo3(name = "tip_fee_lines")]
+        fn py_tip_fee_lines(&self, international: bool) -> Vec<LineItem> {
+            self.tip_fee_lines(international)
         }
-        Ok(lines)
     }
 
     /// JavaScript binding for invoice_lines
@@ -939,6 +1198,21 @@ pub mod funcs {
         }
     }
 
+    /// Python binding for deliverable_lines which takes the extra lines as compact line item
+    /// tuples. Any extra_lines in the provided context are replaced by them.
+    #[cfg(feature = "python")]
+    #[pyfunction]
+    pub fn py_deliverable_lines_compact(
+        mut provided_lines_context: DeliverableLinesContext,
+        extra_lines: Vec<CompactLineItem>,
+    ) -> PyResult<Vec<LineItem>> {
+        provided_lines_context.extra_lines = match from_compact(extra_lines) {
+            Ok(result) => result,
+            Err(error) => return Err(PyValueError::new_err(error.to_string())),
+        };
+        py_deliverable_lines(provided_lines_context)
+    }
+
     /// Python binding for tip_fee_lines
     #[cfg(feature = "python")]
     #[pyfunction]
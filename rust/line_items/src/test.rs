@@ -1,11 +1,12 @@
 #[cfg(test)]
 mod interface_tests {
-    use crate::data::{LineItem, TabulationError};
-    use crate::funcs::{frozen_lines, get_totals, reckon_lines};
+    use crate::data::{from_compact, Account, Category, LineItem, LineType, TabulationError};
+    use crate::funcs::{frozen_lines, get_totals, get_totals_many, reckon_lines, reckon_many};
     use crate::s;
     use ntest::timeout;
     use pretty_assertions::assert_eq;
     use rust_decimal_macros::dec;
+    use std::collections::HashMap;
 
     #[test]
     #[timeout(100)]
@@ -406,6 +407,185 @@ mod interface_tests {
         assert_eq!(reckon_lines(input.clone(), 2).unwrap(), dec!(10.00));
     }
 
+    #[test]
+    #[timeout(100)]
+    fn test_get_totals_many() {
+        let first = vec![
+            LineItem {
+                amount: s!("10.00"),
+                priority: 0,
+                id: 1,
+                ..Default::default()
+            },
+            LineItem {
+                percentage: s!("10"),
+                priority: 1,
+                id: 2,
+                ..Default::default()
+            },
+        ];
+        let second = vec![
+            LineItem {
+                amount: s!("5.00"),
+                priority: 0,
+                id: 3,
+                ..Default::default()
+            },
+            LineItem {
+                amount: s!("-1.00"),
+                priority: 1,
+                id: 4,
+                ..Default::default()
+            },
+        ];
+        let groups = HashMap::from([
+            (s!("first"), first.clone()),
+            (s!("second"), second.clone()),
+            (s!("empty"), vec![]),
+        ]);
+        let results = get_totals_many(groups, 2).unwrap();
+        assert_eq!(results.len(), 3);
+        assert_eq!(results["first"], get_totals(first, 2).unwrap());
+        assert_eq!(results["second"], get_totals(second, 2).unwrap());
+        assert_eq!(results["second"].1, dec!(-1.00));
+        assert_eq!(results["empty"].0, dec!(0.00));
+    }
+
+    #[test]
+    #[timeout(100)]
+    fn test_get_totals_many_error_names_group() {
+        let groups = HashMap::from([(
+            s!("broken"),
+            vec![LineItem {
+                amount: s!("bork"),
+                priority: 0,
+                id: 1,
+                ..Default::default()
+            }],
+        )]);
+        assert_eq!(
+            get_totals_many(groups, 2),
+            Err(TabulationError::from(
+                "broken: Invalid decimal: unknown character"
+            )),
+        );
+    }
+
+    #[test]
+    #[timeout(100)]
+    fn test_from_compact() {
+        let lines = from_compact(vec![
+            (
+                5,
+                100,
+                1,
+                s!("2.50"),
+                s!("0.000"),
+                None,
+                false,
+                401,
+                302,
+                Some(12),
+                s!("Extra shading"),
+            ),
+            (
+                6,
+                350,
+                13,
+                s!("0.30"),
+                s!("4.000"),
+                Some(s!("1.23")),
+                true,
+                408,
+                313,
+                None,
+                s!(""),
+            ),
+        ])
+        .unwrap();
+        assert_eq!(
+            lines,
+            vec![
+                LineItem {
+                    id: 5,
+                    priority: 100,
+                    kind: LineType::AddOn,
+                    amount: s!("2.50"),
+                    percentage: s!("0.000"),
+                    frozen_value: None,
+                    back_into_percentage: false,
+                    category: Category::EscrowHold,
+                    destination_account: Account::Escrow,
+                    destination_user_id: Some(12),
+                    description: s!("Extra shading"),
+                },
+                LineItem {
+                    id: 6,
+                    priority: 350,
+                    kind: LineType::CardFee,
+                    amount: s!("0.30"),
+                    percentage: s!("4.000"),
+                    frozen_value: Some(s!("1.23")),
+                    back_into_percentage: true,
+                    category: Category::ThirdPartyFee,
+                    destination_account: Account::Fund,
+                    destination_user_id: None,
+                    description: s!(""),
+                },
+            ]
+        );
+    }
+
+    #[test]
+    #[timeout(100)]
+    fn test_from_compact_unknown_enum() {
+        let result = from_compact(vec![(
+            1,
+            0,
+            9999,
+            s!("1.00"),
+            s!("0"),
+            None,
+            false,
+            401,
+            302,
+            None,
+            s!(""),
+        )]);
+        assert_eq!(
+            result,
+            Err(TabulationError::from("Unknown line type: 9999"))
+        );
+    }
+
+    #[test]
+    #[timeout(100)]
+    fn test_reckon_many() {
+        let groups = HashMap::from([
+            (
+                s!("first"),
+                vec![LineItem {
+                    amount: s!("1.50"),
+                    priority: 0,
+                    id: 1,
+                    ..Default::default()
+                }],
+            ),
+            (
+                s!("second"),
+                vec![LineItem {
+                    amount: s!("2.25"),
+                    priority: 0,
+                    id: 2,
+                    ..Default::default()
+                }],
+            ),
+        ]);
+        let results = reckon_many(groups, 2).unwrap();
+        assert_eq!(results["first"], dec!(1.50));
+        assert_eq!(results["second"], dec!(2.25));
+    }
+
     #[test]
     #[timeout(100)]
     fn test_percentage() {
@@ -452,7 +632,7 @@ mod line_item_generation_tests {
         Account, Category, DeliverableLinesContext, InvoiceLinesContext, LineItem, LineType,
         Pricing, Product, ServicePlan, TabulationError, TipLinesContext,
     };
-    use crate::funcs::{deliverable_lines, invoice_lines, tip_fee_lines};
+    use crate::funcs::{deliverable_lines, invoice_lines, tip_fee_lines, PricingEngine};
     use crate::s;
     use ntest::timeout;
     use pretty_assertions::assert_eq;
@@ -1462,6 +1642,81 @@ mod line_item_generation_tests {
         ];
         assert_eq!(tip_fee_lines(parameters), Ok(expected));
     }
+
+    #[test]
+    #[timeout(100)]
+    fn test_pricing_engine_reused() {
+        let engine = PricingEngine::new(gen_pricing()).unwrap();
+        for (plan_name, escrow_enabled, international, table_product) in [
+            ("Free", true, false, false),
+            ("Basic", true, true, false),
+            ("Basic", false, false, false),
+            ("Landscape", true, true, false),
+            ("Landscape", false, false, true),
+        ] {
+            let context = DeliverableLinesContext {
+                escrow_enabled,
+                pricing: Some(gen_pricing()),
+                base_price: s!("25.00"),
+                international,
+                plan_name: Some(s!(plan_name)),
+                table_product,
+                extra_lines: vec![],
+                allow_soft_failure: false,
+                user_id: -1,
+                quantization: 2,
+            };
+            let mut engine_context = context.clone();
+            engine_context.pricing = None;
+            assert_eq!(
+                engine.deliverable_lines(engine_context),
+                deliverable_lines(context)
+            );
+        }
+        for international in [false, true] {
+            assert_eq!(
+                Ok(engine.tip_fee_lines(international)),
+                tip_fee_lines(TipLinesContext {
+                    international,
+                    pricing: Some(gen_pricing()),
+                    quantization: 2,
+                })
+            );
+        }
+    }
+
+    #[test]
+    #[timeout(100)]
+    fn test_pricing_engine_unknown_plan() {
+        let engine = PricingEngine::new(gen_pricing()).unwrap();
+        let context = DeliverableLinesContext {
+            escrow_enabled: true,
+            pricing: None,
+            base_price: s!("25.00"),
+            international: false,
+            plan_name: Some(s!("Backup")),
+            table_product: false,
+            extra_lines: vec![],
+            allow_soft_failure: false,
+            user_id: -1,
+            quantization: 2,
+        };
+        assert_eq!(
+            engine.deliverable_lines(context),
+            Err(TabulationError::from("Could not find Backup in plan list."))
+        );
+    }
+
+    #[test]
+    #[timeout(100)]
+    fn test_pricing_engine_invalid_pricing() {
+        let mut pricing = gen_pricing();
+        pricing.plans[1].shield_percentage_price = s!("boop");
+        assert_eq!(
+            PricingEngine::new(pricing).err(),
+            Some(TabulationError::from("Invalid decimal: unknown character"))
+        );
+    }
 }
 
 #[cfg(test)]